@@ -0,0 +1,116 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Clock of the daemon loops.
+
+Loop periods, idle times, retry delays and cache expirations go through the process clock, so that simulations
+can replace it with a VirtualClock, which advances instantly on sleep. Durations reported in metrics and traces
+keep using the real time.
+"""
+
+import threading
+import time
+
+
+class Clock(object):
+    """Real clock."""
+
+    def time(self):
+        """
+        Get the current time.
+
+        :return: seconds since the epoch
+        """
+        return time.time()
+
+    def sleep(self, seconds):
+        """
+        Wait for the given time.
+
+        :param seconds: seconds to wait
+        """
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """Clock advancing only on sleep, or when advanced explicitly, for the simulation of the daemon loops."""
+
+    def __init__(self, start_time=0):
+        """
+        Initialize the clock.
+
+        :param start_time: initial time, in seconds since the epoch
+        """
+        self._now = start_time
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        """
+        Move the clock forward.
+
+        :param seconds: seconds to add to the current time
+        """
+        with self._lock:
+            self._now += max(seconds, 0)
+
+
+_clock = Clock()
+
+
+def get_clock():
+    """
+    Get the clock of the process.
+
+    :return: the Clock object
+    """
+    return _clock
+
+
+def set_clock(clock):
+    """
+    Replace the clock of the process, e.g. with a VirtualClock.
+
+    :param clock: the Clock object
+    :return: the previous Clock object
+    """
+    global _clock
+
+    previous_clock = _clock
+    _clock = clock
+    return previous_clock
+
+
+def now():
+    """
+    Get the current time of the process clock.
+
+    :return: seconds since the epoch
+    """
+    return _clock.time()
+
+
+def sleep(seconds):
+    """
+    Wait for the given time on the process clock.
+
+    :param seconds: seconds to wait
+    """
+    _clock.sleep(seconds)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from common.tracing import record_span
+
+# seconds after which a command is killed, unless a different timeout is given
+DEFAULT_COMMAND_TIMEOUT = 300
+
+# max number of command strings kept already split
+_SPLIT_CACHE_SIZE = 256
+
+_READ_SIZE = 65536
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class CommandTimeoutError(subprocess.CalledProcessError):
+    """The command did not complete in time and has been killed."""
+
+    def __init__(self, cmd, timeout, output=None):
+        subprocess.CalledProcessError.__init__(self, -signal.SIGKILL, cmd)
+        self.output = output
+        self.timeout = timeout
+
+    def __str__(self):
+        return "Command '{0}' timed out after {1} seconds".format(self.cmd, self.timeout)
+
+
+class CommandOutputLimitError(subprocess.CalledProcessError):
+    """The command produced more output than allowed and has been killed."""
+
+    def __init__(self, cmd, max_output_size):
+        subprocess.CalledProcessError.__init__(self, -signal.SIGKILL, cmd)
+        self.output = None
+        self.max_output_size = max_output_size
+
+    def __str__(self):
+        return "Command '{0}' output exceeded {1} bytes".format(self.cmd, self.max_output_size)
+
+
+def is_command_failure(exception):
+    """
+    Tell whether a command exception is a failure to run the command, rather than a non-zero exit status.
+
+    :param exception: the exception
+    :return: True if the command timed out or could not be executed
+    """
+    return isinstance(exception, (CommandTimeoutError, OSError))
+
+
+def get_command_executor():
+    """
+    Get the command executor shared by all the callers in the process.
+
+    :return: the CommandExecutor object
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = CommandExecutor()
+        return _executor
+
+
+class CommandExecutor(object):
+    """
+    Execute scheduler commands with timeouts and collect per-command statistics.
+
+    The process environment is copied once, at creation time. Statistics are grouped by command name,
+    i.e. the basename of the executable.
+    """
+
+    def __init__(self, default_timeout=DEFAULT_COMMAND_TIMEOUT):
+        self.default_timeout = default_timeout
+        self._base_env = os.environ.copy()
+        self._envs = {}
+        self._split_commands = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def check_output(self, command, env=None, timeout=None, max_output_size=None):
+        """
+        Execute command and return its output, stderr included.
+
+        :param command: command to execute, as a string or a list of arguments
+        :param env: a dictionary containing additional environment variables
+        :param timeout: seconds after which the command is killed, None for the default timeout
+        :param max_output_size: max number of bytes of output, the command is killed if it exceeds it
+        :return: the command output
+        :raise: subprocess.CalledProcessError if the command fails, times out or exceeds the output size
+        """
+        command = self._split(command)
+        output = []
+        output_size = 0
+        with self._run(command, env, timeout, stderr=subprocess.STDOUT) as process:
+            fd = process.stdout.fileno()
+            while True:
+                chunk = os.read(fd, _READ_SIZE)
+                if not chunk:
+                    break
+                output_size += len(chunk)
+                if max_output_size is not None and output_size > max_output_size:
+                    raise CommandOutputLimitError(command, max_output_size)
+                output.append(chunk)
+
+        return _to_text(b"".join(output))
+
+    def call(self, command, env=None, timeout=None):
+        """
+        Execute command, leaving its output to the daemon stdout and stderr.
+
+        :param command: command to execute, as a string or a list of arguments
+        :param env: a dictionary containing additional environment variables
+        :param timeout: seconds after which the command is killed, None for the default timeout
+        :raise: subprocess.CalledProcessError if the command fails or times out
+        """
+        with self._run(self._split(command), env, timeout, stdout=None):
+            pass
+
+    @contextmanager
+    def stream(self, command, env=None, timeout=None):
+        """
+        Execute command and expose its standard output as a binary stream, not buffered whole in memory.
+
+        Standard error is not captured and goes to the daemon stderr.
+
+        :param command: command to execute, as a string or a list of arguments
+        :param env: a dictionary containing additional environment variables
+        :param timeout: seconds after which the command is killed, None for the default timeout
+        :return: the stdout stream of the running command
+        :raise: subprocess.CalledProcessError if the command fails or times out
+        """
+        with self._run(self._split(command), env, timeout) as process:
+            yield process.stdout
+            # read what the consumer did not, to avoid a broken pipe
+            for _ in process.stdout:
+                pass
+
+    def iter_lines(self, command, env=None, timeout=None, max_output_size=None):
+        """
+        Execute command and yield its output line by line, as soon as it is produced.
+
+        :param command: command to execute, as a string or a list of arguments
+        :param env: a dictionary containing additional environment variables
+        :param timeout: seconds after which the command is killed, None for the default timeout
+        :param max_output_size: max number of bytes of output, the command is killed if it exceeds it
+        :return: a generator of lines, without the trailing newline
+        :raise: subprocess.CalledProcessError if the command fails, times out or exceeds the output size
+        """
+        command = self._split(command)
+        output_size = 0
+        with self.stream(command, env, timeout) as output:
+            # the stdout pipe is not buffered, reading it line by line would take a system call per byte
+            fd = output.fileno()
+            partial_line = b""
+            while True:
+                chunk = os.read(fd, _READ_SIZE)
+                if not chunk:
+                    break
+                output_size += len(chunk)
+                if max_output_size is not None and output_size > max_output_size:
+                    raise CommandOutputLimitError(command, max_output_size)
+                lines = (partial_line + chunk).split(b"\n")
+                partial_line = lines.pop()
+                for line in lines:
+                    yield _to_text(line)
+            if partial_line:
+                yield _to_text(partial_line)
+
+    def get_stats(self):
+        """
+        Get the statistics of the commands executed so far.
+
+        :return: a dictionary command name -> dictionary of statistics
+        """
+        with self._lock:
+            return dict((name, dict(stats, exit_codes=dict(stats["exit_codes"]))) for name, stats in self._stats.items())
+
+    def log_stats(self, log):
+        for name, stats in sorted(self.get_stats().items()):
+            log.debug(
+                "Command %s: %d runs, %d failures, %d timeouts, avg %.3fs, max %.3fs, exit codes %s",
+                name,
+                stats["count"],
+                stats["failures"],
+                stats["timeouts"],
+                stats["total_time"] / stats["count"],
+                stats["max_time"],
+                stats["exit_codes"],
+            )
+
+    @contextmanager
+    def _run(self, command, env, timeout, stdout=subprocess.PIPE, stderr=None):
+        if timeout is None:
+            timeout = self.default_timeout
+
+        start_time = time.time()
+        process = subprocess.Popen(command, env=self._get_env(env), stdout=stdout, stderr=stderr)
+        timer = None
+        timed_out = []
+        if timeout:
+            timer = threading.Timer(timeout, _kill, [process, timed_out])
+            timer.daemon = True
+            timer.start()
+
+        try:
+            yield process
+        except BaseException:
+            # the consumer failed or stopped reading, do not leave the command running
+            _kill(process)
+            self._record(command, start_time, process.wait(), bool(timed_out))
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+            if process.stdout:
+                process.stdout.close()
+
+        returncode = process.wait()
+        self._record(command, start_time, returncode, bool(timed_out))
+        if timed_out:
+            raise CommandTimeoutError(command, timeout)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    def _split(self, command):
+        if not isinstance(command, basestring):
+            return command
+
+        with self._lock:
+            args = self._split_commands.get(command)
+            if args is None:
+                if len(self._split_commands) >= _SPLIT_CACHE_SIZE:
+                    self._split_commands.clear()
+                args = self._split_commands[command] = shlex.split(command.encode("ascii"))
+            return list(args)
+
+    def _get_env(self, env):
+        if not env:
+            return self._base_env
+
+        key = tuple(sorted(env.items()))
+        with self._lock:
+            if key not in self._envs:
+                # variables of the daemon environment take precedence
+                merged_env = dict(env)
+                merged_env.update(self._base_env)
+                self._envs[key] = merged_env
+            return self._envs[key]
+
+    def _record(self, command, start_time, returncode, timed_out):
+        elapsed = time.time() - start_time
+        name = os.path.basename(command[0])
+        record_span(
+            "command " + name, start_time, command=" ".join(command), exit_code=returncode, timed_out=timed_out
+        )
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {
+                    "count": 0,
+                    "failures": 0,
+                    "timeouts": 0,
+                    "total_time": 0.0,
+                    "max_time": 0.0,
+                    "exit_codes": {},
+                }
+            stats["count"] += 1
+            stats["failures"] += 1 if returncode != 0 else 0
+            stats["timeouts"] += 1 if timed_out else 0
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            stats["exit_codes"][returncode] = stats["exit_codes"].get(returncode, 0) + 1
+
+
+def _kill(process, timed_out=None):
+    if process.poll() is None:
+        if timed_out is not None:
+            timed_out.append(True)
+        try:
+            process.kill()
+        except OSError:
+            # already terminated
+            pass
+
+
+def _to_text(data):
+    if not isinstance(data, str):
+        data = data.decode("utf-8", "replace")
+    return data
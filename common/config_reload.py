@@ -0,0 +1,159 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import ConfigParser
+import logging
+import signal
+import threading
+
+log = logging.getLogger(__name__)
+
+# options applied by the _get_config of every daemon as a side effect, they take effect on reload
+COMMON_LIVE_OPTIONS = [
+    "loglevel",
+    "log_rate_limit",
+    "log_sample_rate",
+    "metrics_textfile",
+    "tracing",
+    "tracing_sample_rate",
+    "tracing_file",
+]
+
+_reloaders = {}
+_reloaders_lock = threading.Lock()
+
+
+def get_config_reloader(section, config_file, get_config, live_options):
+    """
+    Get the config reloader of the given daemon, creating it the first time.
+
+    To be called right after reading the config at startup, the options read are the ones in use.
+
+    :param section: config section of the daemon, e.g. sqswatcher
+    :param config_file: config file path
+    :param get_config: function returning the daemon config namedtuple
+    :param live_options: dictionary option name -> config namedtuple field of the options applied without restart
+    :return: the ConfigReloader object
+    """
+    with _reloaders_lock:
+        reloader = _reloaders.get(section)
+        if reloader is None:
+            reloader = _reloaders[section] = ConfigReloader(section, config_file, get_config, live_options)
+        else:
+            # the daemon main has been restarted, reading the config again
+            reloader.reset()
+        return reloader
+
+
+def install_reload_handler():
+    """
+    Install the SIGHUP handler requesting a config reload to all the daemon loops of the process.
+
+    Signal handlers can only be installed by the main thread, the call does nothing in the other threads.
+    """
+    try:
+        signal.signal(signal.SIGHUP, _request_reload)
+        signal.siginterrupt(signal.SIGHUP, False)
+    except ValueError:
+        log.debug("Config reload signal handler not installed, not in the main thread")
+
+
+def _request_reload(signum, frame):
+    with _reloaders_lock:
+        reloaders = list(_reloaders.values())
+    for reloader in reloaders:
+        reloader.request()
+
+
+class ConfigReloader(object):
+    """
+    Reload the config of a daemon when requested, applying the changes between two loop iterations.
+
+    Changed options not in live_options are reported and ignored, they need a restart of the daemon.
+    """
+
+    def __init__(self, section, config_file, get_config, live_options):
+        self.section = section
+        self.config_file = config_file
+        self._get_config = get_config
+        self._live_options = dict((option, None) for option in COMMON_LIVE_OPTIONS)
+        self._live_options.update(live_options)
+        self._options = self._read_options()
+        self._requested = threading.Event()
+
+    def reset(self):
+        """Take the options in the config file as the ones in use."""
+        self._options = self._read_options()
+
+    def request(self):
+        """Request a reload, applied by the next call to reload."""
+        log.info("%s config reload requested", self.section)
+        self._requested.set()
+
+    def reload(self, config):
+        """
+        Reload the config, if requested.
+
+        :param config: the config namedtuple in use
+        :return: the config namedtuple to use from now on, the given one if nothing changed
+        """
+        if not self._requested.is_set():
+            return config
+        self._requested.clear()
+
+        try:
+            options = self._read_options()
+            new_config = self._get_config()
+        except Exception as e:
+            log.error("Unable to reload %s. Keeping the current config. Failed with exception: %s", self.config_file, e)
+            return config
+
+        changed_options = sorted(
+            option
+            for option in set(self._options.keys()) | set(options.keys())
+            if self._options.get(option) != options.get(option)
+        )
+        live_changes = [option for option in changed_options if option in self._live_options]
+        restart_changes = [option for option in changed_options if option not in self._live_options]
+
+        fields = {}
+        for option in live_changes:
+            field = self._live_options[option]
+            if field:
+                fields[field] = getattr(new_config, field)
+        # options requiring a restart keep being compared with the values in use
+        for option in live_changes:
+            if option in options:
+                self._options[option] = options[option]
+            else:
+                self._options.pop(option, None)
+
+        if live_changes:
+            log.info("%s config reloaded, settings applied: %s", self.section, ", ".join(live_changes))
+        else:
+            log.info("%s config reloaded, no setting to apply", self.section)
+        if restart_changes:
+            log.warning(
+                "%s settings changed but not applied, they require a restart: %s",
+                self.section,
+                ", ".join(restart_changes),
+            )
+        return config._replace(**fields) if fields else config
+
+    def _read_options(self):
+        config = ConfigParser.RawConfigParser()
+        config.read(self.config_file)
+        if not config.has_section(self.section):
+            return {}
+        return dict(config.items(self.section))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+On-demand diagnostics of a running daemon, triggered by signals.
+
+- SIGUSR1 writes the stacks of all the threads
+- SIGUSR2 starts a profiling session, the next SIGUSR2 stops it and writes the stats of every profiled loop
+- SIGWINCH writes the top memory allocations grown since the previous SIGWINCH
+
+Files are written to /var/run/<daemon>/diagnostics/.
+"""
+
+import cProfile
+import gc
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+log = logging.getLogger(__name__)
+
+DIAGNOSTICS_DIR = "/var/run/{0}/diagnostics/"
+
+STACKS_SIGNAL = signal.SIGUSR1
+PROFILE_SIGNAL = signal.SIGUSR2
+MEMORY_SIGNAL = signal.SIGWINCH
+
+# number of entries of the memory snapshot diff
+MEMORY_TOP_ENTRIES = 25
+
+_diagnostics = None
+_diagnostics_lock = threading.Lock()
+
+
+def install_diagnostics_handlers(daemon_name, diagnostics_dir=None):
+    """
+    Install the diagnostics signal handlers.
+
+    Signal handlers can only be installed by the main thread, the call does nothing in the other threads,
+    e.g. in the daemon loops hosted by masterwatcher, which installs them for the whole process.
+
+    :param daemon_name: daemon name, used for the default diagnostics directory
+    :param diagnostics_dir: directory of the diagnostics files
+    """
+    global _diagnostics
+
+    with _diagnostics_lock:
+        if _diagnostics is None:
+            _diagnostics = Diagnostics(diagnostics_dir or DIAGNOSTICS_DIR.format(daemon_name))
+    try:
+        for signal_number, handler in [
+            (STACKS_SIGNAL, _diagnostics.dump_stacks),
+            (PROFILE_SIGNAL, _diagnostics.toggle_profiling),
+            (MEMORY_SIGNAL, _diagnostics.dump_memory),
+        ]:
+            signal.signal(signal_number, lambda signum, frame, handler=handler: _run_handler(handler))
+            # restart the system calls interrupted by the signals, e.g. reads of the scheduler commands output
+            signal.siginterrupt(signal_number, False)
+    except ValueError:
+        log.debug("Diagnostics signal handlers not installed, not in the main thread")
+
+
+def diagnostics_checkpoint():
+    """
+    Start or stop the profiling of the calling thread, as requested by the last profiling signal.
+
+    To be called by the daemon loops at the end of every iteration, profilers only see the thread enabling them.
+    """
+    if _diagnostics:
+        _diagnostics.checkpoint()
+
+
+def _run_handler(handler):
+    try:
+        handler()
+    except Exception as e:
+        log.error("Failed when collecting diagnostics with exception %s", e)
+
+
+class Diagnostics(object):
+    """Collect the diagnostics of the process and write them to the diagnostics directory."""
+
+    def __init__(self, diagnostics_dir):
+        self.diagnostics_dir = diagnostics_dir
+        self.profiling = False
+        self._profilers = {}
+        self._lock = threading.Lock()
+        self._memory_snapshot = None
+
+    def dump_stacks(self):
+        """Write the current stack of every thread."""
+        threads = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        lines = []
+        for thread_id, frame in sys._current_frames().items():
+            lines.append('Thread "{0}" ({1}):\n'.format(threads.get(thread_id, "unknown"), thread_id))
+            lines.extend(traceback.format_stack(frame))
+            lines.append("\n")
+        path = self._write("stacks", "txt", "".join(lines))
+        log.info("Stacks of %d threads written to %s", len(threads), path)
+
+    def toggle_profiling(self):
+        """Request to start or to stop profiling, applied by every loop at its next checkpoint."""
+        self.profiling = not self.profiling
+        log.info(
+            "Profiling %s at the end of the current loop iterations", "starts" if self.profiling else "stops"
+        )
+
+    def checkpoint(self):
+        """Enable or disable the profiler of the calling thread, writing its stats when disabled."""
+        thread = threading.current_thread()
+        with self._lock:
+            profiler = self._profilers.get(thread.ident)
+            if self.profiling and profiler is None:
+                profiler = self._profilers[thread.ident] = cProfile.Profile()
+                profiler.enable()
+                log.info("Profiling thread %s", thread.name)
+                return
+            if self.profiling or profiler is None:
+                return
+            del self._profilers[thread.ident]
+
+        profiler.disable()
+        path = self._get_path("profile-" + thread.name, "prof")
+        profiler.dump_stats(path)
+        log.info("Profile stats of thread %s written to %s", thread.name, path)
+
+    def dump_memory(self):
+        """
+        Write the allocations grown the most since the previous call.
+
+        tracemalloc is used when available and started at the first call, which writes only the baseline.
+        Otherwise the live objects tracked by the garbage collector are counted by type.
+        """
+        try:
+            import tracemalloc
+        except ImportError:
+            tracemalloc = None
+
+        if tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            snapshot = tracemalloc.take_snapshot()
+            lines = []
+            if self._memory_snapshot is not None:
+                top_stats = snapshot.compare_to(self._memory_snapshot, "lineno")[:MEMORY_TOP_ENTRIES]
+                lines = [str(stat) + "\n" for stat in top_stats]
+        else:
+            snapshot = _count_objects_by_type()
+            lines = []
+            if self._memory_snapshot is not None:
+                growth = [
+                    (count - self._memory_snapshot.get(type_name, 0), count, type_name)
+                    for type_name, count in snapshot.items()
+                ]
+                growth.sort(reverse=True)
+                lines = [
+                    "{0}: {1} objects ({2:+d})\n".format(type_name, count, diff)
+                    for diff, count, type_name in growth[:MEMORY_TOP_ENTRIES]
+                ]
+
+        if self._memory_snapshot is None:
+            lines = ["Baseline memory snapshot, the next one is compared with it\n"]
+        self._memory_snapshot = snapshot
+        path = self._write("memory", "txt", "".join(lines))
+        log.info("Memory snapshot diff written to %s", path)
+
+    def _write(self, prefix, extension, content):
+        path = self._get_path(prefix, extension)
+        with open(path, "w") as diagnostics_file:
+            diagnostics_file.write(content)
+        return path
+
+    def _get_path(self, prefix, extension):
+        if not os.path.exists(self.diagnostics_dir):
+            os.makedirs(self.diagnostics_dir)
+        now = time.time()
+        timestamp = "{0}.{1:03d}".format(time.strftime("%Y%m%d-%H%M%S", time.localtime(now)), int(now * 1000) % 1000)
+        return os.path.join(self.diagnostics_dir, "{0}-{1}.{2}".format(prefix, timestamp, extension))
+
+
+def _count_objects_by_type():
+    counts = {}
+    for obj in gc.get_objects():
+        type_name = type(obj).__name__
+        counts[type_name] = counts.get(type_name, 0) + 1
+    return counts
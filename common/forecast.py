@@ -0,0 +1,219 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Forecast of the nodes required by the jobs, from the demand of the previous days.
+
+The jobwatcher samples the pending, running and desired nodes every SAMPLE_INTERVAL seconds into a ring buffer of
+fixed size, saved to disk so that the history survives restarts. The nodes required in the next lead time seconds
+are estimated from the peak demand in the same time window of the previous days, weighting the recent days more,
+so that nodes are requested before the daily submissions and are ready when the jobs arrive.
+"""
+
+import array
+import logging
+import os
+import struct
+import tempfile
+
+log = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+
+# seconds covered by every sample of the history, the max demand in the interval is kept
+SAMPLE_INTERVAL = 300
+# days of history, i.e. the max number of days the forecast is based on
+HISTORY_DAYS = 7
+# weight of the most recent day in the exponentially weighted average of the daily peaks
+SMOOTHING_FACTOR = 0.5
+
+# fields of every sample in the history array
+_FIELDS = ("time", "pending", "running", "desired")
+# history file header: version, capacity in samples, number of samples, index of the oldest sample
+_HEADER_FORMAT = "<IIII"
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+# to be incremented when the layout of the history file changes, files of other versions are discarded
+_HISTORY_VERSION = 1
+
+
+class DemandHistory(object):
+    """Ring buffer of demand samples, one every SAMPLE_INTERVAL seconds, oldest first."""
+
+    def __init__(self, path, capacity=HISTORY_DAYS * DAY // SAMPLE_INTERVAL):
+        """
+        Load the history file, if any.
+
+        :param path: history file path, None to keep the history in memory only
+        :param capacity: max number of samples, the oldest ones are overwritten
+        """
+        self.path = path
+        self.capacity = capacity
+        self._samples = array.array("d", [0.0] * (capacity * len(_FIELDS)))
+        self._count = 0
+        self._start = 0
+        if path:
+            self._load()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, timestamp, pending, running, desired):
+        """
+        Add a demand sample, merging it with the last one if in the same SAMPLE_INTERVAL.
+
+        :param timestamp: sample time, in seconds since the epoch
+        :param pending: nodes required by the pending jobs
+        :param running: nodes running jobs
+        :param desired: desired capacity of the ASG
+        :return: True if a new sample was added, False if merged with the last one
+        """
+        fields = len(_FIELDS)
+        if self._count:
+            last = ((self._start + self._count - 1) % self.capacity) * fields
+            if timestamp // SAMPLE_INTERVAL == self._samples[last] // SAMPLE_INTERVAL:
+                # keep the max demand in the interval
+                if pending + running > self._samples[last + 1] + self._samples[last + 2]:
+                    self._samples[last + 1] = pending
+                    self._samples[last + 2] = running
+                self._samples[last + 3] = max(self._samples[last + 3], desired)
+                return False
+
+        if self._count < self.capacity:
+            index = (self._start + self._count) % self.capacity
+            self._count += 1
+        else:
+            index = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._samples[index * fields:(index + 1) * fields] = array.array("d", [timestamp, pending, running, desired])
+        return True
+
+    def samples(self):
+        """
+        Get the samples, oldest first.
+
+        :return: a generator of tuples (time, pending, running, desired)
+        """
+        fields = len(_FIELDS)
+        for i in range(self._count):
+            offset = ((self._start + i) % self.capacity) * fields
+            yield tuple(self._samples[offset:offset + fields])
+
+    def save(self):
+        """Write the history file."""
+        if not self.path:
+            return
+        folder = os.path.dirname(self.path)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=folder or ".", prefix=".history")
+            try:
+                with os.fdopen(fd, "wb") as history_file:
+                    history_file.write(
+                        struct.pack(_HEADER_FORMAT, _HISTORY_VERSION, self.capacity, self._count, self._start)
+                    )
+                    self._samples.tofile(history_file)
+                os.chmod(tmp_path, 0o644)
+                os.rename(tmp_path, self.path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:
+            log.warning("Unable to write demand history file %s. Failed with exception: %s", self.path, e)
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as history_file:
+                header = history_file.read(_HEADER_SIZE)
+                if len(header) != _HEADER_SIZE:
+                    return
+                version, capacity, count, start = struct.unpack(_HEADER_FORMAT, header)
+                if version != _HISTORY_VERSION or capacity != self.capacity or count > capacity or start >= capacity:
+                    log.info("Discarding demand history file %s, saved with a different format", self.path)
+                    return
+                samples = array.array("d")
+                samples.fromfile(history_file, capacity * len(_FIELDS))
+        except (IOError, EOFError) as e:
+            log.info("No demand history loaded from %s: %s", self.path, e)
+            return
+        self._samples = samples
+        self._count = count
+        self._start = start
+        log.info("Loaded %d demand samples from %s", count, self.path)
+
+
+class ForecastPolicy(object):
+    """Speculative scale-up from the daily demand pattern."""
+
+    def __init__(self, history, lead_time, max_nodes):
+        """
+        Initialize the policy.
+
+        :param history: DemandHistory object
+        :param lead_time: seconds ahead the demand is forecast, e.g. the time to boot a compute node
+        :param max_nodes: max number of nodes requested in addition to the ones required by the jobs
+        """
+        self.history = history
+        self.lead_time = lead_time
+        self.max_nodes = max_nodes
+
+    def record(self, timestamp, pending, running, desired):
+        """
+        Add a demand sample to the history, saving it when a new sample interval starts.
+
+        :param timestamp: sample time, in seconds since the epoch
+        :param pending: nodes required by the pending jobs
+        :param running: nodes running jobs
+        :param desired: desired capacity of the ASG
+        """
+        if self.history.add(timestamp, pending, running, desired):
+            self.history.save()
+
+    def forecast(self, timestamp):
+        """
+        Estimate the peak demand in the next lead time seconds from the same time window of the previous days.
+
+        The peaks of the previous days are averaged with exponentially decreasing weights for the older days.
+
+        :param timestamp: current time, in seconds since the epoch
+        :return: the estimated nodes, None without history for the window
+        """
+        # peak demand in the window [timestamp - days * DAY, timestamp - days * DAY + lead_time] of every day
+        peaks = {}
+        for sample_time, pending, running, _ in self.history.samples():
+            age = timestamp - sample_time
+            days = int(-(-age // DAY))
+            if 1 <= days <= HISTORY_DAYS and age >= days * DAY - self.lead_time:
+                peaks[days] = max(peaks.get(days, 0), pending + running)
+        if not peaks:
+            return None
+
+        estimate = None
+        for days in sorted(peaks.keys(), reverse=True):
+            if estimate is None:
+                estimate = peaks[days]
+            else:
+                estimate = SMOOTHING_FACTOR * peaks[days] + (1 - SMOOTHING_FACTOR) * estimate
+        return int(-(-estimate // 1))
+
+    def get_required_nodes(self, timestamp, required):
+        """
+        Get the nodes to request, including the nodes forecast to be required in the next lead time seconds.
+
+        :param timestamp: current time, in seconds since the epoch
+        :param required: nodes required by the running and pending jobs
+        :return: the nodes to request, between required and required + max_nodes
+        """
+        estimate = self.forecast(timestamp)
+        if estimate is None or estimate <= required:
+            return required
+        return min(estimate, required + self.max_nodes)
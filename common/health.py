@@ -0,0 +1,372 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Health status of the daemon loops.
+
+Every daemon loop publishes its status to HEALTH_DIR/<daemon>.json: current phase, last successful iteration,
+iteration duration percentiles and the time the next iteration is expected to start, from which the loop lag is
+computed. An optional watchdog restarts a loop whose lag exceeds a threshold.
+"""
+
+import argparse
+import collections
+import ctypes
+import errno
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+HEALTH_DIR = "/var/run/parallelcluster/health/"
+
+# number of iterations used for the duration percentiles
+DURATION_SAMPLES = 100
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+class WatchdogTimeout(BaseException):
+    """
+    Raised in a loop thread whose lag exceeded the watchdog threshold, to restart the daemon main.
+
+    It is not an Exception, so that the error handlers of the loop do not swallow it.
+    """
+
+    pass
+
+
+def get_health_monitor(daemon_name, period, max_lag=0, health_dir=HEALTH_DIR):
+    """
+    Get the health monitor of the given daemon, creating it the first time.
+
+    The monitor survives the restarts of the daemon main, so does the history of the iterations.
+
+    :param daemon_name: daemon name
+    :param period: seconds between the end of an iteration and the start of the next one
+    :param max_lag: lag in seconds after which the watchdog restarts the loop, 0 to disable the watchdog
+    :param health_dir: directory of the status files
+    :return: the HealthMonitor object
+    """
+    with _monitors_lock:
+        monitor = _monitors.get(daemon_name)
+        if monitor is None:
+            monitor = _monitors[daemon_name] = HealthMonitor(daemon_name, period, health_dir)
+    monitor.set_watchdog(max_lag)
+    return monitor
+
+
+class HealthMonitor(object):
+    """Track the iterations of a daemon loop and publish its status."""
+
+    def __init__(self, daemon_name, period, health_dir=HEALTH_DIR):
+        self.daemon_name = daemon_name
+        self.period = period
+        self.status_file = os.path.join(health_dir, daemon_name + ".json")
+        self._lock = threading.Lock()
+        self._durations = collections.deque(maxlen=DURATION_SAMPLES)
+        self._loop_thread_id = None
+        self._phase = "startup"
+        self._phase_start = time.time()
+        self._iteration_start = None
+        self._last_success = None
+        self._expected_start = time.time() + period
+        self._iterations = 0
+        self._failures = 0
+        self._max_lag = 0
+        self._watchdog = None
+        self._watchdog_restarts = 0
+
+    def start_iteration(self):
+        """Notify the start of a loop iteration, to be called by the loop thread."""
+        now = time.time()
+        with self._lock:
+            if self._iteration_start is not None:
+                # the previous iteration did not complete, i.e. the loop has been restarted
+                self._failures += 1
+            self._loop_thread_id = threading.current_thread().ident
+            self._iteration_start = now
+            self._set_phase("iteration", now)
+
+    def end_iteration(self, next_wait=None):
+        """
+        Notify the successful completion of the current loop iteration, if any.
+
+        :param next_wait: seconds the loop waits before the next iteration, the period by default
+        """
+        self.wait(self.period if next_wait is None else next_wait, completed_iteration=True)
+
+    def set_phase(self, phase):
+        """
+        Set the current phase of the loop.
+
+        :param phase: phase name
+        """
+        with self._lock:
+            self._set_phase(phase)
+
+    def wait(self, seconds, phase="sleep", completed_iteration=False):
+        """
+        Notify that the loop is going to wait, the next iteration is expected to start after the given time.
+
+        :param seconds: seconds the loop waits
+        :param phase: phase name while waiting
+        :param completed_iteration: True if the loop just completed an iteration successfully
+        """
+        now = time.time()
+        with self._lock:
+            if completed_iteration and self._iteration_start is not None:
+                self._durations.append(now - self._iteration_start)
+                self._iterations += 1
+                self._last_success = now
+            self._iteration_start = None
+            self._expected_start = now + seconds
+            self._set_phase(phase, now)
+
+    def get_lag(self, now=None):
+        """
+        Get the loop lag, i.e. how late the loop is with respect to the expected end of the current iteration.
+
+        :return: the lag in seconds, 0 if not late
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            expected_end = self._expected_start
+            if self._iteration_start is not None:
+                # the current iteration is expected to last at most one period
+                expected_end = max(expected_end, self._iteration_start) + self.period
+        return max(now - expected_end, 0)
+
+    def get_status(self):
+        """
+        Get the status of the loop.
+
+        :return: a dictionary with the status
+        """
+        with self._lock:
+            return self._build_status()
+
+    def _build_status(self):
+        durations = sorted(self._durations)
+        return {
+            "daemon": self.daemon_name,
+            "pid": os.getpid(),
+            "period": self.period,
+            "phase": self._phase,
+            "phase_start": self._phase_start,
+            "iteration_start": self._iteration_start,
+            "last_success": self._last_success,
+            "expected_start": self._expected_start,
+            "iterations": self._iterations,
+            "failures": self._failures,
+            "durations": {
+                "p50": _percentile(durations, 50),
+                "p90": _percentile(durations, 90),
+                "p99": _percentile(durations, 99),
+                "max": durations[-1] if durations else None,
+            },
+            "watchdog_max_lag": self._max_lag,
+            "watchdog_restarts": self._watchdog_restarts,
+            "updated": time.time(),
+        }
+
+    def set_watchdog(self, max_lag):
+        """
+        Enable the watchdog, restarting the loop when its lag exceeds max_lag seconds.
+
+        The loop is restarted by raising WatchdogTimeout in the loop thread, handled by the daemon main
+        retry. An exception can only be raised while the thread runs Python code, so if the loop does not
+        recover within another max_lag seconds, e.g. because blocked in a system call, the whole process
+        exits and it is restarted by the process supervisor.
+
+        :param max_lag: lag in seconds, 0 to disable the watchdog
+        """
+        self._max_lag = max_lag
+        if max_lag > 0 and not self._watchdog:
+            self._watchdog = threading.Thread(target=self._run_watchdog, name=self.daemon_name + "-watchdog")
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def _set_phase(self, phase, now=None):
+        self._phase = phase
+        self._phase_start = now or time.time()
+        try:
+            _write_status(self.status_file, self._build_status())
+        except Exception as e:
+            log.debug("Unable to write health status to %s: %s", self.status_file, e)
+
+    def _run_watchdog(self):
+        restarted_at = None
+        while True:
+            if self._max_lag <= 0:
+                time.sleep(10)
+                continue
+            time.sleep(min(10, self._max_lag / 2.0))
+            lag = self.get_lag()
+            if lag <= self._max_lag:
+                continue
+
+            if restarted_at is not None and (self._last_success or 0) < restarted_at:
+                log.critical(
+                    "%s loop did not recover after a restart, lag %.0f seconds. Exiting.", self.daemon_name, lag
+                )
+                os._exit(1)
+
+            log.critical(
+                "%s loop lag %.0f seconds exceeds %d seconds in phase %s. Restarting the loop.",
+                self.daemon_name,
+                lag,
+                self._max_lag,
+                self._phase,
+            )
+            restarted_at = time.time()
+            with self._lock:
+                self._watchdog_restarts += 1
+                # give the restarted loop max_lag seconds to complete an iteration
+                self._expected_start = restarted_at
+                self._iteration_start = None
+            _raise_in_thread(self._loop_thread_id, WatchdogTimeout)
+
+
+def _raise_in_thread(thread_id, exception_class):
+    if thread_id is None:
+        return
+    modified = ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(thread_id), ctypes.py_object(exception_class))
+    if modified > 1:
+        # more than one thread state modified, revert
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(thread_id), None)
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    index = int(round((len(sorted_values) - 1) * percentile / 100.0))
+    return sorted_values[index]
+
+
+def _write_status(path, status):
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".health")
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(status, tmp_file, separators=(",", ":"))
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def read_statuses(health_dir=HEALTH_DIR):
+    """
+    Read the status of all the daemons of the node.
+
+    :param health_dir: directory of the status files
+    :return: a list of status dictionaries, with the additional keys lag and state
+    """
+    statuses = []
+    try:
+        file_names = sorted(os.listdir(health_dir))
+    except OSError:
+        return statuses
+
+    now = time.time()
+    for file_name in file_names:
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(health_dir, file_name)) as status_file:
+                status = json.load(status_file)
+        except (IOError, ValueError):
+            continue
+
+        expected_end = status["expected_start"]
+        if status["iteration_start"] is not None:
+            expected_end = max(expected_end, status["iteration_start"]) + status["period"]
+        status["lag"] = max(now - expected_end, 0)
+        if not _is_process_running(status["pid"]):
+            status["state"] = "DEAD"
+        elif status["lag"] > status["period"]:
+            status["state"] = "LAGGING"
+        else:
+            status["state"] = "OK"
+        statuses.append(status)
+    return statuses
+
+
+def _is_process_running(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+
+def _format_age(timestamp, now):
+    if timestamp is None:
+        return "never"
+    return "{0:.0f}s ago".format(now - timestamp)
+
+
+def _format_seconds(value):
+    return "-" if value is None else "{0:.1f}s".format(value)
+
+
+def main():
+    """Print the health status of the daemons running on the node."""
+    parser = argparse.ArgumentParser(description="Print the health status of the ParallelCluster daemons.")
+    parser.add_argument("--json", action="store_true", help="print the status in JSON format")
+    parser.add_argument("--health-dir", default=HEALTH_DIR, help="directory of the daemon status files")
+    args = parser.parse_args()
+
+    statuses = read_statuses(args.health_dir)
+    if args.json:
+        print(json.dumps(statuses, indent=2, sort_keys=True))
+        return
+
+    if not statuses:
+        print("No daemon status found in {0}".format(args.health_dir))
+        return
+
+    now = time.time()
+    row_format = "{0:<12} {1:<8} {2:>7} {3:<24} {4:>14} {5:>8} {6:>8} {7:>8} {8:>8} {9:>9}"
+    print(row_format.format("DAEMON", "STATE", "PID", "PHASE", "LAST SUCCESS", "LAG", "P50", "P90", "P99", "FAILURES"))
+    for status in statuses:
+        phase = "{0} ({1:.0f}s)".format(status["phase"], now - status["phase_start"])
+        print(
+            row_format.format(
+                status["daemon"],
+                status["state"],
+                status["pid"],
+                phase,
+                _format_age(status["last_success"], now),
+                _format_seconds(status["lag"]),
+                _format_seconds(status["durations"]["p50"]),
+                _format_seconds(status["durations"]["p90"]),
+                _format_seconds(status["durations"]["p99"]),
+                status["failures"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Local catalog of the EC2 instance types.
+
+The instances.json file of the cluster S3 bucket is downloaded only when changed, and converted once to a catalog
+file of lines "<instance type>\t<vcpus>\t<memory>\t<gpus>" sorted by instance type. Instance types are looked up
+with a binary search on the file, without reading it whole. The first line of the file keeps the ETag and the
+Last-Modified date of the downloaded instances.json.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+from common.utils import get_boto3_client
+
+log = logging.getLogger(__name__)
+
+INSTANCES_KEY = "instances/instances.json"
+
+_HEADER_MARKER = "#"
+
+
+class InstanceCatalog(object):
+    """Instance types of a catalog file."""
+
+    def __init__(self, path):
+        """
+        Initialize the catalog, the file is not read until the first lookup.
+
+        :param path: catalog file path
+        """
+        self.path = path
+
+    def get_metadata(self):
+        """
+        Get the ETag and Last-Modified date of the instances.json the catalog was converted from.
+
+        :return: a tuple (etag, last_modified), (None, None) if the catalog file is not available
+        """
+        try:
+            with open(self.path, "rb") as catalog_file:
+                header = _to_text(catalog_file.readline()).rstrip("\n").split("\t")
+        except IOError:
+            return None, None
+        if len(header) != 3 or header[0] != _HEADER_MARKER:
+            return None, None
+        return header[1] or None, header[2] or None
+
+    def get(self, instance_type):
+        """
+        Look up an instance type.
+
+        :param instance_type: instance type, e.g. c5.xlarge
+        :return: a dictionary with the vcpus, memory (GiB) and gpus of the instance type, None if not found
+        :raise IOError: if the catalog file cannot be read
+        """
+        with open(self.path, "rb") as catalog_file:
+            catalog_file.readline()
+            start = catalog_file.tell()
+            catalog_file.seek(0, os.SEEK_END)
+            line = _find_line(catalog_file, instance_type, start, catalog_file.tell())
+
+        if line is None:
+            return None
+        _, vcpus, memory, gpus = line.split("\t")
+        return {"vcpus": int(vcpus), "memory": float(memory), "gpus": int(gpus)}
+
+
+def update_instance_catalog(path, region, proxy_config):
+    """
+    Download the instances.json file of the cluster bucket if changed, and convert it to the catalog file.
+
+    If the download fails and a catalog file is available, e.g. because S3 is unreachable, the catalog file is used.
+
+    :param path: catalog file path
+    :param region: AWS region
+    :param proxy_config: proxy configuration
+    :return: the InstanceCatalog object
+    :raise: the download exception, if the catalog file is not available
+    """
+    from botocore.exceptions import ClientError
+
+    catalog = InstanceCatalog(path)
+    etag, last_modified = catalog.get_metadata()
+    bucket_name = "{0}-aws-parallelcluster".format(region)
+    kwargs = {"Bucket": bucket_name, "Key": INSTANCES_KEY}
+    if etag:
+        kwargs["IfNoneMatch"] = etag
+    if last_modified:
+        kwargs["IfModifiedSince"] = last_modified
+
+    try:
+        response = get_boto3_client("s3", region, proxy_config).get_object(**kwargs)
+        instances = json.loads(_to_text(response["Body"].read()))
+        write_instance_catalog(path, instances, response.get("ETag"), response.get("LastModified"))
+        log.info("Saved instance catalog %s from S3 bucket %s", path, bucket_name)
+    except Exception as e:
+        if isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+            log.info("Instance catalog %s is up to date", path)
+        elif os.path.isfile(path):
+            log.warning(
+                "Could not download %s from S3 bucket %s, using instance catalog %s. Failed with exception: %s",
+                INSTANCES_KEY,
+                bucket_name,
+                path,
+                e,
+            )
+        else:
+            log.critical(
+                "Could not download %s from S3 bucket %s. Failed with exception: %s", INSTANCES_KEY, bucket_name, e
+            )
+            raise
+    return catalog
+
+
+def write_instance_catalog(path, instances, etag=None, last_modified=None):
+    """
+    Write the catalog file.
+
+    :param path: catalog file path
+    :param instances: content of the instances.json file, a dictionary instance type -> properties
+    :param etag: ETag of the instances.json file
+    :param last_modified: Last-Modified date of the instances.json file, a datetime or a string
+    """
+    if hasattr(last_modified, "isoformat"):
+        last_modified = last_modified.isoformat()
+    folder = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder or ".", prefix=".instances")
+    try:
+        with os.fdopen(fd, "wb") as catalog_file:
+            header = "\t".join([_HEADER_MARKER, etag or "", last_modified or ""])
+            catalog_file.write((header + "\n").encode("utf-8"))
+            for instance_type in sorted(instances.keys()):
+                properties = instances[instance_type]
+                line = "{0}\t{1}\t{2}\t{3}\n".format(
+                    instance_type,
+                    _to_number(properties.get("vcpus"), int),
+                    _to_number(properties.get("memory"), float),
+                    _to_number(properties.get("gpu"), int),
+                )
+                catalog_file.write(line.encode("utf-8"))
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _find_line(catalog_file, key, start, end):
+    """
+    Binary search of the line of the given key in a file of lines sorted by key.
+
+    :param catalog_file: file opened in binary mode
+    :param key: key of the line, i.e. the text before the first tab
+    :param start: offset of the first line
+    :param end: offset of the end of the last line
+    :return: the line, without the trailing newline, None if not found
+    """
+    low, high = start, end
+    # the line of the key, if any, starts in [low, high) and low is always the start of a line
+    while low < high:
+        middle = (low + high) // 2
+        # move to the first line starting at or after middle
+        catalog_file.seek(middle - 1)
+        catalog_file.readline()
+        line_start = catalog_file.tell()
+        if line_start >= high:
+            high = middle
+            continue
+        line = _to_text(catalog_file.readline()).rstrip("\n")
+        line_key = line.split("\t", 1)[0]
+        if line_key == key:
+            return line
+        if line_key < key:
+            low = catalog_file.tell()
+        else:
+            high = middle
+    return None
+
+
+def _to_number(value, number_type):
+    # a malformed value of an instance type must not prevent the conversion of the other ones
+    try:
+        return number_type(value or 0)
+    except (TypeError, ValueError):
+        return number_type(0)
+
+
+def _to_text(data):
+    if not isinstance(data, str):
+        data = data.decode("utf-8")
+    return data
@@ -0,0 +1,130 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import logging
+import os
+import random
+import threading
+
+# max number of records logged per call site in a loop iteration
+DEFAULT_LOG_RATE_LIMIT = 100
+
+# fraction of the records logged, after the rate limit
+DEFAULT_LOG_SAMPLE_RATE = 1.0
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limit the records logged by every call site in a loop iteration of a daemon.
+
+    Only records of level INFO or lower are limited, warnings and errors are always logged.
+    A call site is identified by source file and line, the counters are kept per thread so that loops running
+    in the same process, e.g. in masterwatcher, do not share them. Only the loop threads, i.e. the threads that
+    ended a cycle, are limited: the records of the other threads, e.g. SSH workers, are always logged since their
+    counters would never be reset. Records beyond rate_limit are dropped, the others are sampled with probability
+    sample_rate. Since the filter is applied before formatting, the message of a dropped record is never built.
+    """
+
+    def __init__(self, rate_limit=DEFAULT_LOG_RATE_LIMIT, sample_rate=DEFAULT_LOG_SAMPLE_RATE):
+        """
+        Initialize the filter.
+
+        :param rate_limit: max number of records per call site per iteration, 0 for no limit
+        :param sample_rate: fraction of the records to log, between 0 and 1
+        """
+        logging.Filter.__init__(self)
+        self.rate_limit = rate_limit
+        self.sample_rate = sample_rate
+        # (thread id, file, line) -> [logged records, dropped records]
+        self._counters = {}
+        # ids of the threads calling end_cycle
+        self._loop_threads = set()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or record.thread not in self._loop_threads:
+            return True
+
+        key = (record.thread, record.pathname, record.lineno)
+        with self._lock:
+            counters = self._counters.get(key)
+            if counters is None:
+                counters = self._counters[key] = [0, 0]
+            if (self.rate_limit and counters[0] >= self.rate_limit) or (
+                self.sample_rate < 1 and random.random() >= self.sample_rate
+            ):
+                counters[1] += 1
+                return False
+            counters[0] += 1
+            return True
+
+    def end_cycle(self, log):
+        """
+        Log the number of records dropped by every call site of the current thread and reset its counters.
+
+        :param log: logger used for the summary
+        """
+        thread_id = threading.current_thread().ident
+        with self._lock:
+            self._loop_threads.add(thread_id)
+            keys = [key for key in self._counters if key[0] == thread_id]
+            dropped = []
+            for key in keys:
+                if self._counters[key][1]:
+                    dropped.append((key[1], key[2], self._counters[key][1]))
+                del self._counters[key]
+
+        for pathname, lineno, count in sorted(dropped):
+            log.info("Suppressed %d log messages from %s:%d", count, os.path.basename(pathname), lineno)
+
+
+def configure_log_rate_limit(config, section):
+    """
+    Install the rate limit filter on the handlers of the root logger, configured with the given config section.
+
+    The options are log_rate_limit and log_sample_rate. Calling the function again reconfigures the installed filter.
+
+    :param config: the ConfigParser object of the daemon
+    :param section: the config section of the daemon
+    """
+    global _filter
+
+    rate_limit = DEFAULT_LOG_RATE_LIMIT
+    if config.has_option(section, "log_rate_limit"):
+        rate_limit = config.getint(section, "log_rate_limit")
+    sample_rate = DEFAULT_LOG_SAMPLE_RATE
+    if config.has_option(section, "log_sample_rate"):
+        sample_rate = config.getfloat(section, "log_sample_rate")
+
+    with _filter_lock:
+        if _filter is None:
+            _filter = RateLimitFilter()
+        _filter.rate_limit = rate_limit
+        _filter.sample_rate = sample_rate
+        for handler in logging.getLogger().handlers:
+            if _filter not in handler.filters:
+                handler.addFilter(_filter)
+
+
+def end_log_cycle(log):
+    """
+    Notify the end of a loop iteration to the rate limit filter, if installed.
+
+    :param log: logger used for the summary of the suppressed messages
+    """
+    if _filter:
+        _filter.end_cycle(log)
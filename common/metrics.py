@@ -0,0 +1,324 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+log = logging.getLogger(__name__)
+
+# upper bounds, in seconds, of the buckets of the duration histograms
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Get the metrics registry shared by all the daemon loops of the process.
+
+    :return: the MetricsRegistry object
+    """
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+class MetricsRegistry(object):
+    """
+    Collect the metrics of the daemons and render them in the Prometheus text format.
+
+    Metrics can be created at any time, but they are updated only after the registry is enabled,
+    until then every update is a single attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._metrics = {}
+        self._lock = threading.Lock()
+        # metrics textfile of every daemon of the process
+        self._textfiles = {}
+        self._server = None
+
+    def counter(self, name, description):
+        """
+        Get or create a counter.
+
+        :param name: metric name
+        :param description: help text of the metric
+        :return: the Counter object
+        """
+        return self._get_metric(Counter, name, description)
+
+    def gauge(self, name, description):
+        """
+        Get or create a gauge.
+
+        :param name: metric name
+        :param description: help text of the metric
+        :return: the Gauge object
+        """
+        return self._get_metric(Gauge, name, description)
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        """
+        Get or create a histogram with fixed buckets.
+
+        :param name: metric name
+        :param description: help text of the metric
+        :param buckets: sorted upper bounds of the buckets, the +Inf bucket is implicit
+        :return: the Histogram object
+        """
+        return self._get_metric(Histogram, name, description, buckets)
+
+    def render(self):
+        """
+        Render all the metrics in the Prometheus text exposition format.
+
+        :return: the metrics text
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP {0} {1}".format(metric.name, metric.description))
+            lines.append("# TYPE {0} {1}".format(metric.name, metric.metric_type))
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port, address="127.0.0.1"):
+        """
+        Expose the metrics on http://<address>:<port>/metrics, served by a background thread.
+
+        :param port: TCP port
+        :param address: address to bind to, local only by default
+        """
+        if self._server:
+            return
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("Metrics request from %s: %s", self.client_address[0], format % args)
+
+        self._server = HTTPServer((address, port), MetricsHandler)
+        thread = threading.Thread(target=self._server.serve_forever, name="metrics-server")
+        thread.daemon = True
+        thread.start()
+        log.info("Serving metrics on http://%s:%d/metrics", address, port)
+
+    def set_textfile(self, daemon, path):
+        """
+        Write the metrics to the given file at every publish, e.g. for the node exporter textfile collector.
+
+        The daemons running in the same process set their own file, the metrics are written to all of them.
+
+        :param daemon: name of the daemon the file is configured by
+        :param path: file path, it should end with .prom, None to stop writing it
+        """
+        with self._lock:
+            if path:
+                self._textfiles[daemon] = path
+            else:
+                self._textfiles.pop(daemon, None)
+
+    def has_textfile(self):
+        """Tell whether the metrics are written to a file by any daemon."""
+        return bool(self._textfiles)
+
+    def is_serving(self):
+        """Tell whether the metrics are served over HTTP."""
+        return self._server is not None
+
+    def publish(self):
+        """Write the metrics to the textfile, if configured."""
+        if not self.enabled or not self._textfiles:
+            return
+        with self._lock:
+            textfiles = set(self._textfiles.values())
+        content = self.render()
+        for textfile in sorted(textfiles):
+            try:
+                _write_file(textfile, content)
+            except Exception as e:
+                log.warning("Unable to write metrics to %s. Failed with exception: %s", textfile, e)
+
+    def _get_metric(self, metric_class, name, description, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(self, name, description, *args)
+            return metric
+
+
+class Counter(object):
+    """Monotonic counter."""
+
+    metric_type = "counter"
+
+    def __init__(self, registry, name, description):
+        self.name = name
+        self.description = description
+        self._registry = registry
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, value=1):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._value += value
+
+    def render(self):
+        return ["{0} {1}".format(self.name, _format_value(self._value))]
+
+
+class Gauge(object):
+    """Value that can go up and down."""
+
+    metric_type = "gauge"
+
+    def __init__(self, registry, name, description):
+        self.name = name
+        self.description = description
+        self._registry = registry
+        self._value = 0
+
+    def set(self, value):
+        if not self._registry.enabled:
+            return
+        self._value = value
+
+    def render(self):
+        return ["{0} {1}".format(self.name, _format_value(self._value))]
+
+
+class Histogram(object):
+    """Distribution of observed values in fixed buckets."""
+
+    metric_type = "histogram"
+
+    def __init__(self, registry, name, description, buckets):
+        self.name = name
+        self.description = description
+        self._registry = registry
+        self._buckets = tuple(buckets)
+        # not cumulative, the last one is +Inf
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if not self._registry.enabled:
+            return
+        index = 0
+        while index < len(self._buckets) and value > self._buckets[index]:
+            index += 1
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the duration in seconds of the wrapped block."""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start_time)
+
+    def render(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for upper_bound, count in zip(self._buckets + ("+Inf",), counts):
+            cumulative += count
+            lines.append('{0}_bucket{{le="{1}"}} {2}'.format(self.name, upper_bound, cumulative))
+        lines.append("{0}_sum {1}".format(self.name, _format_value(total)))
+        lines.append("{0}_count {1}".format(self.name, cumulative))
+        return lines
+
+
+def configure_metrics(config, section):
+    """
+    Enable the metrics registry according to the given config section.
+
+    The options are metrics_port, to serve the metrics over HTTP on localhost, and metrics_textfile,
+    to write them to a file at the end of every loop iteration. The settings of the daemons running in the same
+    process, e.g. under masterwatcher, are merged: metrics are disabled only if none of them sets an option.
+
+    :param config: the ConfigParser object of the daemon
+    :param section: the config section of the daemon
+    """
+    registry = get_registry()
+    textfile = None
+    if config.has_option(section, "metrics_textfile"):
+        textfile = config.get(section, "metrics_textfile")
+    registry.set_textfile(section, textfile)
+    registry.enabled = registry.has_textfile() or registry.is_serving()
+    if config.has_option(section, "metrics_port"):
+        try:
+            registry.start_http_server(config.getint(section, "metrics_port"))
+            registry.enabled = True
+        except Exception as e:
+            log.error("Unable to start the metrics server. Failed with exception: %s", e)
+
+
+def publish_metrics():
+    """Write the metrics to the configured textfile, if any."""
+    get_registry().publish()
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _write_file(path, content):
+    folder = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".metrics")
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            tmp_file.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,101 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Adaptive polling period of the daemon loops.
+
+The loop polls every min_interval seconds while the polled value changes, and doubles the wait at every poll
+finding the value unchanged, up to max_interval. The wait can be interrupted by touching a trigger file, e.g.
+from a scheduler job submission hook, to poll immediately.
+"""
+
+import logging
+import os
+
+from common import clock
+
+log = logging.getLogger(__name__)
+
+# seconds between two checks of the trigger file while waiting
+TRIGGER_CHECK_INTERVAL = 1
+
+_UNSET = object()
+
+
+class AdaptivePoller(object):
+    """Wait between the iterations of a polling loop."""
+
+    def __init__(self, min_interval, max_interval, trigger_file=None):
+        """
+        Initialize the poller.
+
+        :param min_interval: seconds between polls while the polled value changes
+        :param max_interval: max seconds between polls while the polled value does not change
+        :param trigger_file: path of the file interrupting the wait when touched, None to disable
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.trigger_file = trigger_file
+        self.interval = min_interval
+        self._last_value = _UNSET
+        self._trigger_mtime = self._get_trigger_mtime()
+
+    def update(self, value):
+        """
+        Compute the wait before the next poll from the value found by the last one.
+
+        :param value: polled value, e.g. the number of pending nodes
+        :return: the seconds to wait
+        """
+        if value != self._last_value:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        self._last_value = value
+        return self.interval
+
+    def wait(self, seconds=None):
+        """
+        Wait for the next poll, stopping early if the trigger file is touched.
+
+        :param seconds: seconds to wait, the current interval by default
+        :return: True if the wait was interrupted by the trigger file
+        """
+        if seconds is None:
+            seconds = self.interval
+        if not self.trigger_file:
+            clock.sleep(seconds)
+            return False
+
+        deadline = clock.now() + seconds
+        remaining = seconds
+        while remaining > 0:
+            clock.sleep(min(remaining, TRIGGER_CHECK_INTERVAL))
+            mtime = self._get_trigger_mtime()
+            if mtime != self._trigger_mtime:
+                self._trigger_mtime = mtime
+                if mtime is not None:
+                    log.info("Polling triggered by %s", self.trigger_file)
+                    self.interval = self.min_interval
+                    return True
+            remaining = deadline - clock.now()
+        return False
+
+    def _get_trigger_mtime(self):
+        if not self.trigger_file:
+            return None
+        try:
+            return os.stat(self.trigger_file).st_mtime
+        except OSError:
+            return None
@@ -0,0 +1,193 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Host-wide rate limit of the AWS API calls.
+
+Every AWS API family, i.e. service, has a token bucket shared by all the daemons of the host through a memory
+mapped file, locked with flock. Every boto3 call takes a token from the bucket of its service, waiting for it
+if the bucket is empty. Calls changing resources, e.g. update_auto_scaling_group, have priority over polling
+calls (Describe*, List*, Get*, Receive*), which leave a reserve of tokens in the bucket.
+"""
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from common.metrics import get_registry
+
+log = logging.getLogger(__name__)
+
+TOKENS_FILE = "/var/run/parallelcluster/aws_api_tokens.v1"
+
+# (calls per second, bucket size) of every API family, shared by all the daemons of the host
+API_FAMILY_LIMITS = {
+    "autoscaling": (5, 20),
+    "cloudformation": (2, 10),
+    "dynamodb": (25, 50),
+    "ec2": (10, 50),
+    "s3": (25, 50),
+    "sqs": (25, 50),
+}
+# limits of the services not listed above
+DEFAULT_LIMITS = (10, 20)
+
+# fraction of the bucket polling calls leave to the calls changing resources
+POLLING_RESERVE = 0.25
+POLLING_OPERATION_PREFIXES = ("Describe", "List", "Get", "Receive")
+
+# maximum seconds between two checks of an empty bucket
+MAX_WAIT_STEP = 1
+
+# bucket layout in the tokens file: available tokens and time of the last update
+_BUCKET_FORMAT = "dd"
+_BUCKET_SIZE = struct.calcsize(_BUCKET_FORMAT)
+# the position of a bucket in the file is the index of its family, the last one is for the other services
+_FAMILIES = sorted(API_FAMILY_LIMITS.keys())
+
+metrics = get_registry()
+WAIT_SECONDS = metrics.histogram("aws_rate_limit_wait_seconds", "Time AWS calls waited for the host rate limit")
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Get the AWS rate limiter of the process.
+
+    :return: the RateLimiter object
+    """
+    global _rate_limiter
+
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(TOKENS_FILE)
+        return _rate_limiter
+
+
+def limit_aws_client(client):
+    """
+    Make every call of the given boto3 client take a token from the host rate limiter.
+
+    :param client: boto3 client
+    """
+    client.meta.events.register("before-call", _before_aws_call)
+
+
+def is_polling_operation(operation_name):
+    """
+    Tell whether the given API operation only reads, so that it is served after the ones changing resources.
+
+    :param operation_name: API operation name, e.g. DescribeAutoScalingGroups
+    :return: True for polling operations
+    """
+    return operation_name.startswith(POLLING_OPERATION_PREFIXES)
+
+
+class RateLimiter(object):
+    """Token buckets of the AWS API families, shared by the processes using the same tokens file."""
+
+    def __init__(self, tokens_file):
+        """
+        Initialize the rate limiter.
+
+        If the tokens file cannot be opened, e.g. because of permissions, buckets are shared only by the threads
+        of the process.
+
+        :param tokens_file: path of the tokens file
+        """
+        self.tokens_file = tokens_file
+        self._lock = threading.Lock()
+        self._fd = None
+        size = (len(_FAMILIES) + 1) * _BUCKET_SIZE
+        try:
+            self._buckets = self._map_file(tokens_file, size)
+        except Exception as e:
+            log.warning("Unable to map %s, AWS calls are rate limited per process. Exception: %s", tokens_file, e)
+            self._buckets = bytearray(size)
+
+    def acquire(self, family, polling=False):
+        """
+        Take a token from the bucket of the given API family, waiting for it if not available.
+
+        :param family: API family, i.e. the AWS service name
+        :param polling: True for polling calls, which leave a reserve of tokens in the bucket
+        :return: the seconds waited
+        """
+        rate, burst = API_FAMILY_LIMITS.get(family, DEFAULT_LIMITS)
+        reserve = burst * POLLING_RESERVE if polling else 0
+        offset = (_FAMILIES.index(family) if family in API_FAMILY_LIMITS else len(_FAMILIES)) * _BUCKET_SIZE
+        start_time = time.time()
+        while True:
+            with self._locked():
+                now = time.time()
+                tokens, updated = struct.unpack_from(_BUCKET_FORMAT, self._buckets, offset)
+                if updated <= 0 or updated > now:
+                    # new bucket or clock moved backwards
+                    tokens = burst
+                else:
+                    tokens = min(burst, tokens + (now - updated) * rate)
+                if tokens >= reserve + 1:
+                    struct.pack_into(_BUCKET_FORMAT, self._buckets, offset, tokens - 1, now)
+                    break
+                struct.pack_into(_BUCKET_FORMAT, self._buckets, offset, tokens, now)
+            time.sleep(min(MAX_WAIT_STEP, (reserve + 1 - tokens) / rate))
+
+        waited = time.time() - start_time
+        if waited > 0.001:
+            WAIT_SECONDS.observe(waited)
+            log.debug("%s call waited %.3f seconds for the rate limit", family, waited)
+        return waited
+
+    @contextmanager
+    def _locked(self):
+        # flock excludes the other processes, the threads of the process share the file descriptor
+        with self._lock:
+            if self._fd is None:
+                yield
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _map_file(self, tokens_file, size):
+        folder = os.path.dirname(tokens_file)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        fd = os.open(tokens_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            buckets = mmap.mmap(fd, size)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return buckets
+
+
+def _before_aws_call(model, **kwargs):
+    get_rate_limiter().acquire(model.service_model.service_name, is_polling_operation(model.name))
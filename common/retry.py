@@ -0,0 +1,264 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Retries with decorrelated jitter backoff and per-dependency circuit breakers.
+
+Retry delays are randomized so that the nodes of a cluster hitting the same throttled service do not retry
+in lockstep. A circuit breaker opens after consecutive failures of a dependency and fails fast the calls to it,
+until a trial call succeeds after the reset timeout.
+"""
+
+import functools
+import logging
+import random
+import threading
+from contextlib import contextmanager
+
+from common import clock
+from common.health import WatchdogTimeout
+from common.metrics import get_registry
+
+log = logging.getLogger(__name__)
+
+# dependencies protected by a circuit breaker
+DYNAMODB = "dynamodb"
+SQS = "sqs"
+AUTOSCALING = "autoscaling"
+SCHEDULER = "scheduler"
+
+# consecutive failures opening a circuit breaker
+FAILURE_THRESHOLD = 5
+# seconds a circuit breaker stays open before letting a trial call through
+RESET_TIMEOUT = 60
+
+# error codes of the AWS throttling errors
+THROTTLING_ERROR_CODES = frozenset(
+    ["RequestLimitExceeded", "Throttling", "ThrottlingException", "ProvisionedThroughputExceededException"]
+)
+
+RETRIES_TOTAL = get_registry().counter("retries_total", "Retries of failed calls")
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    pass
+
+
+def get_circuit_breaker(name):
+    """
+    Get the circuit breaker of the given dependency, shared by all the daemon loops of the process.
+
+    :param name: dependency name, e.g. DYNAMODB
+    :return: the CircuitBreaker object
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of a dependency.
+
+    The breaker is closed until FAILURE_THRESHOLD consecutive failures, then it stays open for reset_timeout
+    seconds, failing fast all the calls. After that a single trial call is let through, closing the breaker
+    if it succeeds or opening it again if it fails.
+    """
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+        metrics = get_registry()
+        self._retries_total = metrics.counter(
+            "{0}_retries_total".format(name), "Retries of failed calls to {0}".format(name)
+        )
+        self._trips_total = metrics.counter(
+            "{0}_circuit_breaker_trips_total".format(name), "Times the {0} circuit breaker opened".format(name)
+        )
+        self._open_gauge = metrics.gauge(
+            "{0}_circuit_breaker_open".format(name), "1 if the {0} circuit breaker is open".format(name)
+        )
+
+    def allow_request(self):
+        """
+        Tell whether a call to the dependency can be made, to be followed by record_success or record_failure.
+
+        :return: True if the breaker is closed or if the call is the trial call of an open breaker
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or clock.now() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        """Record a successful call, closing the breaker."""
+        with self._lock:
+            if self._opened_at is not None:
+                log.info("%s circuit breaker closed", self.name)
+                self._open_gauge.set(0)
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        """Record a failed call, opening the breaker if the failure threshold is reached."""
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is None and self._failures < self.failure_threshold:
+                return
+            if self._opened_at is None:
+                log.warning(
+                    "%s circuit breaker opened after %d consecutive failures, failing fast for %d seconds",
+                    self.name,
+                    self._failures,
+                    self.reset_timeout,
+                )
+            else:
+                log.warning("%s trial call failed, circuit breaker open for %d seconds", self.name, self.reset_timeout)
+            self._opened_at = clock.now()
+            self._trial_running = False
+            self._trips_total.inc()
+            self._open_gauge.set(1)
+
+    def release_trial(self):
+        """Release the trial call of an open breaker without recording its outcome, e.g. for an unrelated error."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_retry(self):
+        self._retries_total.inc()
+
+    @contextmanager
+    def guard(self, is_failure=None):
+        """
+        Protect the wrapped call to the dependency.
+
+        :param is_failure: function telling whether an exception is a failure of the dependency, all by default.
+                           The other exceptions leave the breaker state unchanged
+        :raise CircuitOpenError: if the breaker is open
+        """
+        if not self.allow_request():
+            raise CircuitOpenError("{0} circuit breaker is open".format(self.name))
+        try:
+            yield
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure()
+            else:
+                self.release_trial()
+            raise
+        except BaseException:
+            # the call was interrupted, e.g. by the watchdog, a later call will be the trial
+            self.release_trial()
+            raise
+        self.record_success()
+
+
+def circuit_breaker(name):
+    """
+    Protect a call to the given dependency with its circuit breaker, without retrying it.
+
+    :param name: dependency name, e.g. AUTOSCALING
+    :raise CircuitOpenError: if the breaker is open
+    """
+    return get_circuit_breaker(name).guard()
+
+
+def retry(attempts=None, base_delay=1, max_delay=60, retry_on=None, breaker=None):
+    """
+    Decorate a function to retry it on exceptions, waiting a decorrelated jitter backoff between the attempts.
+
+    Every delay is random between base_delay and three times the previous delay, capped to max_delay.
+
+    :param attempts: maximum number of attempts, None to retry forever, also when a circuit breaker is open or
+                     the watchdog restarts the loop
+    :param base_delay: minimum seconds between two attempts
+    :param max_delay: maximum seconds between two attempts
+    :param retry_on: function telling whether an exception has to be retried, all by default. With a breaker,
+                     only the exceptions to retry count as failures of the dependency
+    :param breaker: name of the circuit breaker protecting the calls, None for no breaker
+    :return: the decorator
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            circuit = get_circuit_breaker(breaker) if breaker else None
+            attempt = 0
+            delay = base_delay
+            while True:
+                attempt += 1
+                try:
+                    if circuit:
+                        with circuit.guard(retry_on):
+                            return func(*args, **kwargs)
+                    return func(*args, **kwargs)
+                except (Exception, WatchdogTimeout) as e:
+                    if isinstance(e, (CircuitOpenError, WatchdogTimeout)):
+                        # an open breaker or a stuck loop fails fast the bounded retries, the endless ones, i.e. the
+                        # daemon mains, wait and restart
+                        if attempts:
+                            raise
+                    elif (retry_on and not retry_on(e)) or (attempts and attempt >= attempts):
+                        raise
+                    delay = decorrelated_jitter(base_delay, max_delay, delay)
+                    log.warning("%s failed with exception %s, retrying in %.1f seconds", func.__name__, e, delay)
+                    RETRIES_TOTAL.inc()
+                    if circuit:
+                        circuit.record_retry()
+                    clock.sleep(delay)
+
+        return wrapper
+
+    return decorator
+
+
+def decorrelated_jitter(base_delay, max_delay, previous_delay):
+    """
+    Get the delay before the next attempt.
+
+    :param base_delay: minimum delay
+    :param max_delay: maximum delay
+    :param previous_delay: delay before the previous attempt, base_delay for the first one
+    :return: the delay
+    """
+    return min(max_delay, random.uniform(base_delay, previous_delay * 3))
+
+
+def is_throttling_error(exception):
+    """
+    Tell whether the given exception is an AWS throttling error.
+
+    :param exception: the exception
+    :return: True if the exception is a botocore ClientError with a throttling error code
+    """
+    response = getattr(exception, "response", None)
+    if not isinstance(response, dict):
+        return False
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
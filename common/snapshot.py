@@ -0,0 +1,104 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import logging
+import threading
+
+from common import clock
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotPublisher(object):
+    """
+    Periodically build a snapshot of the cluster state in a background thread, for the checks of the polling loop.
+
+    The loop uses the last snapshot instead of querying the scheduler, so the scheduler is queried once per
+    refresh interval, whatever the polling interval. A snapshot older than the refresh interval, e.g. because the
+    last refresh failed, is never used.
+
+    The snapshot is a dictionary with the following keys:
+    - timestamp: time of the snapshot
+    - pending_jobs: pending jobs in submission order, as a list of [nodes, slots, count],
+      where count is the number of consecutive identical jobs, followed by [memory, gpus, exclusive]
+      for the jobs requesting other resources
+    - nodes: dictionary node name -> {"state": <state>, "used_slots": <n>, "total_slots": <n>, "busy": <bool>}
+    """
+
+    def __init__(self, build_snapshot, interval):
+        """
+        Initialize the publisher.
+
+        :param build_snapshot: function returning a new snapshot dictionary
+        :param interval: seconds between two refreshes
+        """
+        self.interval = interval
+        self._build_snapshot = build_snapshot
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start refreshing the snapshot in a background thread."""
+        self._thread = threading.Thread(target=self._run, name="snapshot-publisher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh."""
+        self._stop_event.set()
+
+    def get(self, max_age=None):
+        """
+        Get the last snapshot built by this publisher.
+
+        :param max_age: max age in seconds of a valid snapshot, the refresh interval by default
+        :return: the snapshot dictionary or None if not available or too old
+        """
+        if max_age is None:
+            max_age = self.interval
+        with self._lock:
+            snapshot = self._snapshot
+        if snapshot is None or clock.now() - snapshot["timestamp"] > max_age:
+            return None
+        return snapshot
+
+    def refresh(self):
+        """Build a new snapshot."""
+        start_time = clock.now()
+        snapshot = self._build_snapshot()
+        snapshot["timestamp"] = clock.now()
+        with self._lock:
+            self._snapshot = snapshot
+        log.debug(
+            "Scheduler snapshot with %d pending job groups and %d nodes built in %.2f seconds",
+            len(snapshot["pending_jobs"]),
+            len(snapshot["nodes"]),
+            snapshot["timestamp"] - start_time,
+        )
+
+    def _run(self):
+        wait = self.interval
+        while not self._stop_event.is_set():
+            self._stop_event.wait(wait)
+            if self._stop_event.is_set():
+                break
+            start_time = clock.now()
+            try:
+                self.refresh()
+            except Exception as e:
+                log.error("Failed when building scheduler snapshot with exception %s", e)
+            # a new snapshot every interval, whatever the time to build it
+            wait = max(self.interval - (clock.now() - start_time), 0)
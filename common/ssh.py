@@ -0,0 +1,304 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import collections
+import errno
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from common.tracing import get_current_span, span
+
+log = logging.getLogger(__name__)
+
+SSH_PORT = 22
+
+# bytes read from a channel at a time
+_RECV_SIZE = 32768
+# max seconds between two checks of the exit status of a command
+_POLL_INTERVAL = 1
+
+SSHResult = collections.namedtuple("SSHResult", ["hostname", "success", "exit_code", "output", "duration", "error"])
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_ssh_executor(cluster_user):
+    """
+    Get the SSH executor shared by all the plugins for the given user.
+
+    :param cluster_user: the user to connect as
+    :return: the SSHExecutor object
+    """
+    with _executors_lock:
+        if cluster_user not in _executors:
+            _executors[cluster_user] = SSHExecutor(cluster_user)
+        return _executors[cluster_user]
+
+
+class SSHExecutor(object):
+    """
+    Run commands on multiple hosts concurrently over SSH.
+
+    Connections are cached per host and closed after being idle for idle_timeout seconds.
+    The known_hosts file is read once and kept in memory, new host keys are written only by flush_host_keys.
+    """
+
+    def __init__(self, cluster_user, parallelism=10, idle_timeout=300, connect_timeout=10):
+        """
+        Initialize the executor.
+
+        :param cluster_user: the user to connect as
+        :param parallelism: max number of hosts processed at the same time
+        :param idle_timeout: seconds after which an unused connection is closed
+        :param connect_timeout: timeout of the TCP connection and of the SSH handshake
+        """
+        # paramiko (and cryptography) are imported only by the daemons actually using SSH
+        import paramiko
+
+        user_home = os.path.expanduser("~" + cluster_user)
+        self._cluster_user = cluster_user
+        self._user_key_file = user_home + "/.ssh/id_rsa"
+        self._known_hosts_file = user_home + "/.ssh/known_hosts"
+        self._idle_timeout = idle_timeout
+        self._connect_timeout = connect_timeout
+        self._pool = ThreadPool(parallelism)
+        self._lock = threading.Lock()
+        # hostname -> (SSHClient, last use time)
+        self._connections = {}
+        self._host_keys = paramiko.HostKeys()
+        self._host_keys_changed = False
+        try:
+            self._host_keys.load(self._known_hosts_file)
+        except IOError:
+            log.debug("Known hosts file %s not found", self._known_hosts_file)
+
+    def run(self, hostnames, command, command_timeout=None, reachability_timeout=60, attempts=3):
+        """
+        Run the given command on all the given hosts.
+
+        :param hostnames: hosts to run the command on
+        :param command: the command to run, None to just open the connection
+        :param command_timeout: max seconds to wait for the command to complete, None to wait forever
+        :param reachability_timeout: max seconds to wait for the SSH port of each host to be open
+        :param attempts: number of connection attempts per host
+        :return: a dictionary hostname -> SSHResult
+        """
+        if not hostnames:
+            return {}
+
+        self._evict_idle_connections()
+        with span("ssh", hosts=len(hostnames), command=command) as ssh_span:
+            # the hosts are processed by the pool threads, on behalf of the current span
+            parent = get_current_span()
+            results = self._pool.map(
+                lambda hostname: self._run_on_host(
+                    hostname, command, command_timeout, reachability_timeout, attempts, parent
+                ),
+                hostnames,
+            )
+            ssh_span.set_attribute("failures", len([result for result in results if not result.success]))
+        return dict((result.hostname, result) for result in results)
+
+    def flush_host_keys(self):
+        """Write the known_hosts file, if new host keys were collected since the last flush."""
+        with self._lock:
+            if not self._host_keys_changed:
+                return
+            try:
+                self._host_keys.save(self._known_hosts_file)
+                self._host_keys_changed = False
+            except IOError as e:
+                log.warning("Unable to save known hosts file %s. Failed with exception: %s", self._known_hosts_file, e)
+
+    def close(self):
+        """Close all the cached connections."""
+        with self._lock:
+            connections = self._connections
+            self._connections = {}
+        for client, _ in connections.values():
+            client.close()
+
+    def add_host_key(self, hostname, key):
+        with self._lock:
+            if self._host_keys.check(hostname, key):
+                return
+            self._host_keys.add(hostname, key.get_name(), key)
+            self._host_keys_changed = True
+
+    def _run_on_host(self, hostname, command, command_timeout, reachability_timeout, attempts, parent=None):
+        with span("ssh " + hostname, parent=parent, hostname=hostname) as host_span:
+            result = self._run_on_host_attempts(hostname, command, command_timeout, reachability_timeout, attempts)
+            host_span.set_attribute("exit_code", result.exit_code)
+            if result.error:
+                host_span.set_attribute("error", result.error)
+        return result
+
+    def _run_on_host_attempts(self, hostname, command, command_timeout, reachability_timeout, attempts):
+        start_time = time.time()
+        exit_code = None
+        output = None
+        error = None
+        for attempt in range(attempts):
+            if not wait_for_port(hostname, SSH_PORT, reachability_timeout):
+                error = "Host {0} is not reachable on port {1}".format(hostname, SSH_PORT)
+                break
+            try:
+                log.info("Connecting to host: %s attempt: %d", hostname, attempt)
+                client = self._get_connection(hostname)
+                if command is not None:
+                    exit_code, output = self._exec_command(client, command, command_timeout)
+                else:
+                    exit_code = 0
+                error = None
+                break
+            except Exception as e:
+                error = "Failed when running command on host {0} with error: {1}".format(hostname, e)
+                log.warning(error)
+                self._drop_connection(hostname)
+
+        duration = time.time() - start_time
+        if error:
+            log.error(error)
+        log.debug("SSH command on host %s completed in %.2f seconds with exit code %s", hostname, duration, exit_code)
+        return SSHResult(hostname, exit_code == 0, exit_code, output, duration, error)
+
+    def _exec_command(self, client, command, command_timeout):
+        _, stdout, _ = client.exec_command(command)
+        channel = stdout.channel
+        deadline = time.time() + command_timeout if command_timeout is not None else None
+        output = []
+        # stdout and stderr are drained while waiting, the remote command blocks when the channel window is full
+        while True:
+            while channel.recv_ready():
+                output.append(channel.recv(_RECV_SIZE))
+            while channel.recv_stderr_ready():
+                channel.recv_stderr(_RECV_SIZE)
+            # the exit status is received after all the output
+            if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                return channel.recv_exit_status(), b"".join(output)
+            wait = _POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    channel.close()
+                    raise socket.timeout("command timed out after {0} seconds".format(command_timeout))
+            select.select([channel], [], [], wait)
+
+    def _get_connection(self, hostname):
+        import paramiko
+
+        with self._lock:
+            client, _ = self._connections.pop(hostname, (None, None))
+
+        transport = client.get_transport() if client else None
+        if not transport or not transport.is_active():
+            client = paramiko.SSHClient()
+            # the known keys of the host are verified by paramiko, the policy is called only for unknown hosts
+            with self._lock:
+                known_keys = self._host_keys.lookup(hostname) or {}
+                for key_type, key in known_keys.items():
+                    client.get_host_keys().add(hostname, key_type, key)
+            client.set_missing_host_key_policy(_SharedHostKeysPolicy(self))
+            client.connect(
+                hostname,
+                username=self._cluster_user,
+                key_filename=self._user_key_file,
+                timeout=self._connect_timeout,
+            )
+
+        with self._lock:
+            self._connections[hostname] = (client, time.time())
+        return client
+
+    def _drop_connection(self, hostname):
+        with self._lock:
+            client, _ = self._connections.pop(hostname, (None, None))
+        if client:
+            client.close()
+
+    def _evict_idle_connections(self):
+        now = time.time()
+        with self._lock:
+            idle_hosts = [
+                hostname
+                for hostname, (_, last_used) in self._connections.items()
+                if now - last_used > self._idle_timeout
+            ]
+        for hostname in idle_hosts:
+            log.debug("Closing idle connection to host %s", hostname)
+            self._drop_connection(hostname)
+
+
+class _SharedHostKeysPolicy(object):
+    """
+    Accept unknown host keys and collect them in the executor in-memory known hosts.
+
+    Implements the paramiko.MissingHostKeyPolicy interface, without inheriting from it to import paramiko lazily.
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+
+    def missing_host_key(self, client, hostname, key):
+        self._executor.add_host_key(hostname, key)
+
+
+def wait_for_port(hostname, port, timeout):
+    """
+    Wait for the given TCP port to accept connections.
+
+    :param hostname: host to probe
+    :param port: TCP port to probe
+    :param timeout: max seconds to wait
+    :return: True if the port accepts connections before the timeout
+    """
+    deadline = time.time() + timeout
+    delay = 0.1
+    while True:
+        remaining = deadline - time.time()
+        if _is_port_open(hostname, port, max(min(remaining, 2), 0.1)):
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 2)
+
+
+def _is_port_open(hostname, port, timeout):
+    try:
+        family, socktype, proto, _, address = socket.getaddrinfo(hostname, port, 0, socket.SOCK_STREAM)[0]
+    except socket.error:
+        return False
+
+    sock = socket.socket(family, socktype, proto)
+    try:
+        sock.setblocking(0)
+        error = sock.connect_ex(address)
+        if error == 0:
+            return True
+        if error not in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            return False
+        _, writable, _ = select.select([], [sock], [], timeout)
+        return bool(writable) and sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+    except socket.error:
+        return False
+    finally:
+        sock.close()
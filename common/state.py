@@ -0,0 +1,155 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Warm-start state of the daemons.
+
+Facts discovered at startup, e.g. the ASG name, are saved to a local state file and reused by the next starts
+of the daemon, which verify them in background. A fact found changed is updated in the state file and makes
+the daemon loop restart with the new value.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+STATE_DIR = "/var/run/parallelcluster/state/"
+
+# to be incremented when the meaning of the saved values changes, state files of other versions are discarded
+STATE_VERSION = 1
+
+
+class StaleStateError(Exception):
+    """Raised in the daemon loop when a value of the warm-start state was found changed."""
+
+    pass
+
+
+class WarmState(object):
+    """Values discovered by a daemon, saved to a state file to be reused at the next start."""
+
+    def __init__(self, daemon_name, key, state_dir=STATE_DIR):
+        """
+        Load the state file of the daemon.
+
+        :param daemon_name: daemon name
+        :param key: dictionary of the config parameters the values depend on, e.g. the stack name.
+                    The saved values are discarded if the key changed
+        :param state_dir: directory of the state files
+        """
+        self.path = os.path.join(state_dir, daemon_name + "-state.json")
+        self.key = key
+        self._lock = threading.Lock()
+        self._values = self._load()
+        self._stale_values = []
+
+    def get(self, name, default=None):
+        """
+        Get a saved value.
+
+        :param name: value name
+        :param default: value returned if not saved
+        :return: the saved value
+        """
+        with self._lock:
+            return self._values.get(name, default)
+
+    def set(self, name, value):
+        """
+        Save a value.
+
+        :param name: value name
+        :param value: JSON serializable value
+        """
+        with self._lock:
+            self._values[name] = value
+            state = {"version": STATE_VERSION, "key": self.key, "values": self._values, "updated": time.time()}
+            try:
+                _write_state(self.path, state)
+            except Exception as e:
+                log.warning("Unable to write state file %s. Failed with exception: %s", self.path, e)
+
+    def discover(self, name, discover_function):
+        """
+        Get a value from the state, if saved, verifying it in background. Otherwise discover and save it.
+
+        :param name: value name
+        :param discover_function: function returning the current value
+        :return: the value
+        """
+        value = self.get(name)
+        if value is None:
+            value = discover_function()
+            self.set(name, value)
+            return value
+
+        log.info("Using %s %s from %s", name, value, self.path)
+        thread = threading.Thread(target=self._verify, args=(name, value, discover_function), name="verify-" + name)
+        thread.daemon = True
+        thread.start()
+        return value
+
+    def check(self):
+        """
+        Check that the values in use are still valid, to be called by the daemon loop at every iteration.
+
+        :raise StaleStateError: if a value in use was found changed by the background verification
+        """
+        if self._stale_values:
+            raise StaleStateError("Saved values changed: {0}".format(", ".join(self._stale_values)))
+
+    def _verify(self, name, value, discover_function):
+        try:
+            current_value = discover_function()
+        except Exception as e:
+            log.warning("Unable to verify saved %s. Failed with exception: %s", name, e)
+            return
+        if current_value == value:
+            log.debug("Saved %s verified", name)
+            return
+        log.warning("Saved %s %s changed to %s", name, value, current_value)
+        self.set(name, current_value)
+        with self._lock:
+            self._stale_values.append(name)
+
+    def _load(self):
+        try:
+            with open(self.path) as state_file:
+                state = json.load(state_file)
+        except (IOError, ValueError):
+            return {}
+        if state.get("version") != STATE_VERSION or state.get("key") != self.key:
+            log.info("Discarding state file %s, saved for a different version or configuration", self.path)
+            return {}
+        return state.get("values", {})
+
+
+def _write_state(path, state):
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".state")
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(state, tmp_file, separators=(",", ":"))
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
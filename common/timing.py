@@ -0,0 +1,113 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import threading
+import time
+
+# names of the daemons whose import time has already been reported by this process
+_reported_imports = set()
+_reported_imports_lock = threading.Lock()
+
+
+class StartupTimer(object):
+    """
+    Measure the duration of the startup phases of a daemon and log them once the first loop iteration is complete.
+
+    The import phase goes from the start of the process to the creation of the timer, so it is reported only
+    the first time, restarts of main after a failure do not pay it again.
+    """
+
+    def __init__(self, name, log):
+        """
+        Initialize the timer.
+
+        :param name: daemon name
+        :param log: logger used for the report
+        """
+        self._name = name
+        self._log = log
+        self._last_time = time.time()
+        self._start_time = self._last_time
+        self._phases = []
+        self._completed = False
+
+        with _reported_imports_lock:
+            first_start = name not in _reported_imports
+            _reported_imports.add(name)
+        process_start_time = _get_process_start_time() if first_start else None
+        if process_start_time is not None:
+            self._start_time = process_start_time
+            self._phases.append(("import", max(self._last_time - process_start_time, 0.0)))
+
+    def mark(self, phase):
+        """
+        Record the end of a startup phase, started at the end of the previous one.
+
+        :param phase: name of the phase just completed
+        """
+        if self._completed:
+            return
+        now = time.time()
+        self._phases.append((phase, now - self._last_time))
+        self._last_time = now
+
+    def complete(self, phase):
+        """
+        Record the end of the last startup phase and log the report, only the first time it is called.
+
+        :param phase: name of the phase just completed
+        """
+        if self._completed:
+            return
+        self.mark(phase)
+        self._completed = True
+        self._log.info(
+            "%s startup completed in %.3f seconds (%s)",
+            self._name,
+            self._last_time - self._start_time,
+            ", ".join("{0} {1:.3f}s".format(name, duration) for name, duration in self._phases),
+        )
+
+    def get_phases(self):
+        """
+        Get the phases recorded so far.
+
+        :return: a list of (phase name, seconds)
+        """
+        return list(self._phases)
+
+
+def _get_process_start_time():
+    """
+    Get the start time of the current process from procfs.
+
+    :return: start time as seconds since the epoch, None if not available
+    """
+    try:
+        with open("/proc/self/stat") as stat_file:
+            # the command name, in parentheses, can contain spaces
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        # starttime is the 22nd field, the 20th after the command name and the state
+        start_ticks = int(fields[19])
+        with open("/proc/stat") as system_stat_file:
+            for line in system_stat_file:
+                if line.startswith("btime "):
+                    boot_time = int(line.split()[1])
+                    break
+            else:
+                return None
+        return boot_time + float(start_ticks) / os.sysconf("SC_CLK_TCK")
+    except (IOError, OSError, ValueError, IndexError):
+        return None
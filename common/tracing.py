@@ -0,0 +1,312 @@
+#!/usr/bin/env python2.6
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Span based tracing of the daemon loops.
+
+Every loop iteration is a root span, scheduler commands, AWS calls and SSH operations run during the iteration
+are recorded as its children. Spans are written in the Trace Event Format, one event per line, so that trace
+files can be loaded as they are in chrome://tracing or Perfetto.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+TRACE_DIR = "/var/log/parallelcluster/"
+
+# the trace file is rotated when bigger than this size, keeping TRACE_FILE_BACKUPS old files
+TRACE_FILE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_FILE_BACKUPS = 3
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+# stack of the active spans of every thread
+_local = threading.local()
+
+
+class Span(object):
+    """An operation of a traced loop iteration."""
+
+    def __init__(self, name, root, attributes):
+        self.name = name
+        self.root = root or self
+        self.attributes = attributes
+        self.start_time = time.time()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class _NullSpan(object):
+    """Span of an iteration not traced."""
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """Buffer the completed spans and write them to the trace file at the end of every root span."""
+
+    def __init__(self, path, sample_rate=1.0):
+        """
+        Initialize the tracer.
+
+        :param path: trace file path
+        :param sample_rate: fraction of the loop iterations to trace
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self._events = []
+        self._named_threads = set()
+        self._lock = threading.Lock()
+
+    def add(self, span, end_time=None):
+        """
+        Add a completed span to the buffer.
+
+        :param span: the Span object
+        :param end_time: end time of the span, now by default
+        """
+        if end_time is None:
+            end_time = time.time()
+        thread = threading.current_thread()
+        event = {
+            "name": span.name,
+            "ph": "X",
+            "ts": int(span.start_time * 1000000),
+            "dur": int((end_time - span.start_time) * 1000000),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": span.attributes,
+        }
+        with self._lock:
+            if thread.ident not in self._named_threads:
+                self._named_threads.add(thread.ident)
+                self._events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": os.getpid(),
+                        "tid": thread.ident,
+                        "args": {"name": thread.name},
+                    }
+                )
+            self._events.append(event)
+
+    def flush(self):
+        """Write the buffered spans to the trace file."""
+        with self._lock:
+            events = self._events
+            self._events = []
+        if not events:
+            return
+        try:
+            self._rotate()
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a") as trace_file:
+                if new_file:
+                    trace_file.write("[\n")
+                for event in events:
+                    trace_file.write(json.dumps(event, separators=(",", ":"), default=str))
+                    trace_file.write(",\n")
+        except Exception as e:
+            log.warning("Unable to write trace file %s. Failed with exception: %s", self.path, e)
+
+    def _rotate(self):
+        try:
+            if os.path.getsize(self.path) < TRACE_FILE_MAX_BYTES:
+                return
+        except OSError:
+            folder = os.path.dirname(self.path)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            return
+
+        for index in range(TRACE_FILE_BACKUPS - 1, 0, -1):
+            backup = "{0}.{1}".format(self.path, index)
+            if os.path.exists(backup):
+                os.rename(backup, "{0}.{1}".format(self.path, index + 1))
+        os.rename(self.path, self.path + ".1")
+        # threads are named again in every file
+        with self._lock:
+            self._named_threads.clear()
+
+
+def configure_tracing(config, section):
+    """
+    Enable tracing according to the given config section.
+
+    The options are tracing (true/false, false by default), tracing_sample_rate, the fraction of the loop
+    iterations to trace, and tracing_file, /var/log/parallelcluster/<section>-trace.json by default.
+
+    :param config: the ConfigParser object of the daemon
+    :param section: the config section of the daemon
+    """
+    global _tracer
+
+    if not config.has_option(section, "tracing") or not config.getboolean(section, "tracing"):
+        with _tracer_lock:
+            if _tracer is not None:
+                log.info("Tracing disabled")
+            _tracer = None
+        return
+
+    path = TRACE_DIR + section + "-trace.json"
+    if config.has_option(section, "tracing_file"):
+        path = config.get(section, "tracing_file")
+    sample_rate = 1.0
+    if config.has_option(section, "tracing_sample_rate"):
+        sample_rate = config.getfloat(section, "tracing_sample_rate")
+
+    with _tracer_lock:
+        if _tracer is None or _tracer.path != path:
+            _tracer = Tracer(path, sample_rate)
+        else:
+            _tracer.sample_rate = sample_rate
+    log.info("Tracing %d%% of the loop iterations to %s", sample_rate * 100, path)
+
+
+def get_current_span():
+    """
+    Get the innermost active span of the current thread.
+
+    :return: the Span object, None if the current thread is not running a traced iteration
+    """
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def root_span(name, **attributes):
+    """
+    Trace a loop iteration, if tracing is enabled and the iteration is sampled.
+
+    :param name: span name
+    :param attributes: span attributes
+    :return: the Span object, or a span doing nothing if the iteration is not traced
+    """
+    tracer = _tracer
+    if tracer is None or random.random() >= tracer.sample_rate:
+        yield _NULL_SPAN
+        return
+
+    try:
+        with _active_span(tracer, Span(name, None, attributes)) as current_span:
+            yield current_span
+    finally:
+        tracer.flush()
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Trace an operation as a child of the given span.
+
+    :param name: span name
+    :param parent: parent span, the current span of the thread by default. Threads working on behalf of
+                   a traced iteration have to pass it explicitly
+    :param attributes: span attributes
+    :return: the Span object, or a span doing nothing if the iteration is not traced
+    """
+    tracer = _tracer
+    if parent is None:
+        parent = get_current_span()
+    if tracer is None or parent is None:
+        yield _NULL_SPAN
+        return
+
+    with _active_span(tracer, Span(name, parent.root, attributes)) as current_span:
+        yield current_span
+
+
+def record_span(name, start_time, parent=None, **attributes):
+    """
+    Record an operation already completed as a child of the given span.
+
+    :param name: span name
+    :param start_time: start time of the operation
+    :param parent: parent span, the current span of the thread by default
+    :param attributes: span attributes
+    """
+    tracer = _tracer
+    if parent is None:
+        parent = get_current_span()
+    if tracer is None or parent is None:
+        return
+
+    completed_span = Span(name, parent.root, attributes)
+    completed_span.start_time = start_time
+    tracer.add(completed_span)
+
+
+def instrument_aws_client(client):
+    """
+    Record every call made with the given boto3 client as a span, AWS retries included.
+
+    :param client: boto3 client
+    """
+    client.meta.events.register("before-call", _before_aws_call)
+    client.meta.events.register("after-call", _after_aws_call)
+    client.meta.events.register("after-call-error", _after_aws_call_error)
+
+
+@contextmanager
+def _active_span(tracer, current_span):
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    _local.stack.append(current_span)
+    try:
+        yield current_span
+    except Exception as e:
+        current_span.set_attribute("error", str(e))
+        raise
+    finally:
+        _local.stack.pop()
+        tracer.add(current_span)
+
+
+def _before_aws_call(model, context, **kwargs):
+    if _tracer is not None and get_current_span() is not None:
+        context["trace_span"] = Span(
+            "aws {0}.{1}".format(model.service_model.service_name, model.name), get_current_span().root, {}
+        )
+
+
+def _after_aws_call(http_response, parsed, context, **kwargs):
+    aws_span = context.get("trace_span")
+    if aws_span and _tracer:
+        aws_span.set_attribute("status_code", http_response.status_code)
+        aws_span.set_attribute("retries", parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0))
+        error_code = parsed.get("Error", {}).get("Code")
+        if error_code:
+            aws_span.set_attribute("error", error_code)
+        _tracer.add(aws_span)
+
+
+def _after_aws_call_error(exception, context, **kwargs):
+    aws_span = context.get("trace_span")
+    if aws_span and _tracer:
+        aws_span.set_attribute("error", str(exception))
+        _tracer.add(aws_span)
@@ -12,14 +12,31 @@
 # This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
 # See the License for the specific language governing permissions and limitations under the License.
 
-import os
-import shlex
 import subprocess
 import sys
+import threading
+from contextlib import contextmanager
 
-import boto3
-from future.moves.subprocess import check_output
-from retrying import retry
+
+from common import clock
+from common.commands import get_command_executor
+from common.rate_limit import limit_aws_client
+from common.retry import AUTOSCALING, circuit_breaker, retry
+from common.tracing import instrument_aws_client
+
+
+# max number of HTTP connections kept open by each boto3 client
+BOTO3_MAX_POOL_CONNECTIONS = 20
+
+# seconds after which the cached ASG settings are retrieved again
+DEFAULT_ASG_SETTINGS_TTL = 60
+
+_boto3_session = None
+_boto3_objects = {}
+_boto3_lock = threading.Lock()
+
+_asg_settings_caches = {}
+_asg_settings_caches_lock = threading.Lock()
 
 
 class CriticalError(Exception):
@@ -41,12 +58,80 @@ def load_module(module):
     return scheduler_module
 
 
-@retry(
-    stop_max_attempt_number=5,
-    wait_exponential_multiplier=10000,
-    wait_exponential_max=80000,
-    retry_on_exception=lambda exception: isinstance(exception, IndexError)
-)
+def get_boto3_client(service, region, proxy_config):
+    """
+    Get a boto3 client, shared by all the callers using the same service, region and proxy.
+
+    :param service: AWS service name, e.g. autoscaling
+    :param region: AWS region
+    :param proxy_config: Proxy configuration
+    :return: the boto3 client
+    """
+    return _get_boto3_object("client", service, region, proxy_config)
+
+
+def get_boto3_resource(service, region, proxy_config):
+    """
+    Get a boto3 resource, shared by the callers running in the same thread and using the same service, region and proxy.
+
+    Resources are not thread safe, so every thread gets its own instance.
+
+    :param service: AWS service name, e.g. sqs
+    :param region: AWS region
+    :param proxy_config: Proxy configuration
+    :return: the boto3 service resource
+    """
+    return _get_boto3_object("resource", service, region, proxy_config)
+
+
+def get_proxy_config(proxy):
+    """
+    Build the botocore configuration for the given proxy.
+
+    :param proxy: the proxy URL, NONE for no proxy
+    :return: the botocore Config object
+    """
+    from botocore.config import Config
+
+    if proxy != "NONE":
+        return Config(proxies={"https": proxy})
+    return Config()
+
+
+def _get_boto3_object(kind, service, region, proxy_config):
+    global _boto3_session
+
+    proxies = getattr(proxy_config, "proxies", None) or {}
+    key = (kind, service, region, tuple(sorted(proxies.items())))
+    if kind == "resource":
+        key += (threading.current_thread().ident,)
+
+    with _boto3_lock:
+        if key not in _boto3_objects:
+            # boto3 is imported on first use, the import takes a significant part of the daemons startup time
+            import boto3
+            from botocore.config import Config
+
+            # sessions are not thread safe, all the objects are created under the lock
+            if _boto3_session is None:
+                _boto3_session = boto3.session.Session()
+            config = Config(max_pool_connections=BOTO3_MAX_POOL_CONNECTIONS)
+            if proxy_config:
+                config = proxy_config.merge(config)
+            if kind == "client":
+                boto3_object = _boto3_session.client(service, region_name=region, config=config)
+                aws_client = boto3_object
+            else:
+                boto3_object = _boto3_session.resource(service, region_name=region, config=config)
+                aws_client = boto3_object.meta.client
+            limit_aws_client(aws_client)
+            instrument_aws_client(aws_client)
+            _boto3_objects[key] = boto3_object
+        return _boto3_objects[key]
+
+
+# the ASG may not be tagged yet, this is not a failure of the service
+@retry(attempts=5, base_delay=10, max_delay=80, retry_on=lambda exception: isinstance(exception, IndexError))
 def get_asg_name(stack_name, region, proxy_config, log):
     """
     Get autoscaling group name associated to the given stack.
@@ -58,7 +143,7 @@ def get_asg_name(stack_name, region, proxy_config, log):
     :raise ASGNotFoundError if the ASG is not found (after the timeout) or if an unexpected error occurs
     :return: the ASG name
     """
-    asg_client = boto3.client("autoscaling", region_name=region, config=proxy_config)
+    asg_client = get_boto3_client("autoscaling", region, proxy_config)
     try:
         response = asg_client.describe_tags(Filters=[{"Name": "Value", "Values": [stack_name]}])
         asg_name = response.get("Tags")[0].get("ResourceId")
@@ -73,20 +158,107 @@ def get_asg_name(stack_name, region, proxy_config, log):
 
 def get_asg_settings(region, proxy_config, asg_name, log):
     try:
-        asg_client = boto3.client("autoscaling", region_name=region, config=proxy_config)
-        asg = asg_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name]).get('AutoScalingGroups')[0]
+        asg_client = get_boto3_client("autoscaling", region, proxy_config)
+        with circuit_breaker(AUTOSCALING):
+            response = asg_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])
+        # a missing ASG is not a failure of the service
+        asg = response.get("AutoScalingGroups")[0]
         min_size = asg.get('MinSize')
         desired_capacity = asg.get('DesiredCapacity')
         max_size = asg.get('MaxSize')
 
-        log.info("min/desired/max %d/%d/%d" % (min_size, desired_capacity, max_size))
+        log.info("min/desired/max %d/%d/%d", min_size, desired_capacity, max_size)
         return min_size, desired_capacity, max_size
     except Exception as e:
         log.error("Failed when retrieving data for ASG %s with exception %s", asg_name, e)
         raise
 
 
-def check_command_output(command, log, env=None, raise_on_error=True):
+def get_asg_settings_cache(region, proxy_config, asg_name, log, ttl=DEFAULT_ASG_SETTINGS_TTL):
+    """
+    Get the ASG settings cache shared by all the callers in the process for the given ASG.
+
+    :param region: AWS region
+    :param proxy_config: Proxy configuration
+    :param asg_name: ASG name
+    :param log: logger
+    :param ttl: seconds after which the cached settings expire, applied to the shared cache
+    :return: the AsgSettingsCache object, with the given proxy and ttl
+    """
+    key = (region, asg_name)
+    with _asg_settings_caches_lock:
+        if key not in _asg_settings_caches:
+            _asg_settings_caches[key] = AsgSettingsCache(region, proxy_config, asg_name, log, ttl)
+        cache = _asg_settings_caches[key]
+        cache.proxy_config = proxy_config
+        cache.ttl = ttl
+        return cache
+
+
+class AsgSettingsCache(object):
+    """
+    Cache of the ASG min/desired/max settings, expiring after ttl seconds.
+
+    Concurrent callers finding the cache expired wait for a single describe_auto_scaling_groups call.
+    The cache must be invalidated after any call changing the ASG capacity.
+    """
+
+    def __init__(self, region, proxy_config, asg_name, log, ttl=DEFAULT_ASG_SETTINGS_TTL):
+        self.region = region
+        self.proxy_config = proxy_config
+        self.asg_name = asg_name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._log = log
+        self._settings = None
+        self._timestamp = 0
+        # incremented by every invalidation, to discard results retrieved before it
+        self._generation = 0
+        self._fetching = False
+        self._condition = threading.Condition()
+
+    def get(self):
+        """
+        Get the ASG settings, from the cache if not expired.
+
+        :return: a tuple (min_size, desired_capacity, max_size)
+        """
+        with self._condition:
+            while True:
+                if self._settings is not None and clock.now() - self._timestamp < self.ttl:
+                    self.hits += 1
+                    return self._settings
+                if not self._fetching:
+                    break
+                self._condition.wait()
+            self._fetching = True
+            self.misses += 1
+            generation = self._generation
+
+        settings = None
+        try:
+            settings = get_asg_settings(self.region, self.proxy_config, self.asg_name, self._log)
+            return settings
+        finally:
+            with self._condition:
+                if settings is not None and generation == self._generation:
+                    self._settings = settings
+                    self._timestamp = clock.now()
+                self._fetching = False
+                self._condition.notify_all()
+
+    def invalidate(self):
+        """Discard the cached settings, the next get will query the ASG."""
+        with self._condition:
+            self._settings = None
+            self._generation += 1
+
+    def log_stats(self):
+        self._log.debug("ASG settings cache for %s: %d hits, %d misses", self.asg_name, self.hits, self.misses)
+
+
+def check_command_output(command, log, env=None, raise_on_error=True, timeout=None):
     """
     Execute shell command and retrieve command output.
 
@@ -94,11 +266,12 @@ def check_command_output(command, log, env=None, raise_on_error=True):
     :param env: a dictionary containing environment variables
     :param log: logger
     :param raise_on_error: True to raise subprocess.CalledProcessError on errors
+    :param timeout: seconds after which the command is killed, None for the default timeout
     :return: the command output
     :raise: subprocess.CalledProcessError if the command fails
     """
     return _run_command(
-        lambda _command, _env: check_output(_command, env=_env, stderr=subprocess.STDOUT, universal_newlines=True),
+        lambda _command, _env: get_command_executor().check_output(_command, _env, timeout),
         command,
         log,
         env,
@@ -106,7 +279,7 @@ def check_command_output(command, log, env=None, raise_on_error=True):
     )
 
 
-def run_command(command, log, env=None, raise_on_error=True):
+def run_command(command, log, env=None, raise_on_error=True, timeout=None):
     """
     Execute shell command.
 
@@ -114,20 +287,71 @@ def run_command(command, log, env=None, raise_on_error=True):
     :param env: a dictionary containing environment variables
     :param log: logger
     :param raise_on_error: True to raise subprocess.CalledProcessError on errors
+    :param timeout: seconds after which the command is killed, None for the default timeout
     :raise: subprocess.CalledProcessError if the command fails
     """
-    _run_command(lambda _command, _env: subprocess.check_call(_command, env=_env), command, log, env, raise_on_error)
+    _run_command(
+        lambda _command, _env: get_command_executor().call(_command, _env, timeout),
+        command,
+        log,
+        env,
+        raise_on_error,
+    )
+
+
+@contextmanager
+def command_output_stream(command, log, env=None, timeout=None):
+    """
+    Execute shell command and expose its standard output as a file-like stream.
 
+    The output is never buffered whole in memory, so the caller can parse it incrementally.
+    Standard error is not captured and goes to the daemon stderr.
 
-def _run_command(command_function, command, log, env=None, raise_on_error=True):
+    :param command: command to execute
+    :param log: logger
+    :param env: a dictionary containing environment variables
+    :param timeout: seconds after which the command is killed, None for the default timeout
+    :return: the stdout stream of the running command
+    :raise: subprocess.CalledProcessError if the command fails
+    """
+    log.debug("Executing command: %s", command)
+    try:
+        with get_command_executor().stream(command, env, timeout) as output:
+            yield output
+    except subprocess.CalledProcessError as e:
+        log.error(e)
+        raise
+    except OSError as e:
+        log.error("Unable to execute the command %s. Failed with exception: %s", command, e)
+        raise
+
+
+def command_output_lines(command, log, env=None, timeout=None):
+    """
+    Execute shell command and yield its output line by line, while the command is running.
+
+    :param command: command to execute
+    :param log: logger
+    :param env: a dictionary containing environment variables
+    :param timeout: seconds after which the command is killed, None for the default timeout
+    :return: a generator of output lines, without the trailing newline
+    :raise: subprocess.CalledProcessError if the command fails
+    """
+    log.debug("Executing command: %s", command)
     try:
-        if isinstance(command, str) or isinstance(command, unicode):
-            command = shlex.split(command.encode("ascii"))
-        if env is None:
-            env = {}
+        for line in get_command_executor().iter_lines(command, env, timeout):
+            yield line
+    except subprocess.CalledProcessError as e:
+        log.error(e)
+        raise
+    except OSError as e:
+        log.error("Unable to execute the command %s. Failed with exception: %s", command, e)
+        raise
+
 
-        env.update(os.environ.copy())
-        log.debug("Executing command: %s" % command)
+def _run_command(command_function, command, log, env=None, raise_on_error=True):
+    try:
+        log.debug("Executing command: %s", command)
         return command_function(command, env)
     except subprocess.CalledProcessError as e:
         # CalledProcessError.__str__ already produces a significant error message
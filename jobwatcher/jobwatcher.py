@@ -14,20 +14,71 @@
 
 import ConfigParser
 import collections
-import json
 import logging
 import os
 import time
 
-import boto3
-from botocore.config import Config
-from botocore.exceptions import ClientError
-from retrying import retry
-
-from common.utils import CriticalError, get_asg_name, load_module, get_asg_settings
+from common import clock
+from common.commands import get_command_executor
+from common.config_reload import get_config_reloader, install_reload_handler
+from common.diagnostics import diagnostics_checkpoint, install_diagnostics_handlers
+from common.forecast import DemandHistory, ForecastPolicy
+from common.health import get_health_monitor
+from common.instance_catalog import update_instance_catalog
+from common.log_utils import configure_log_rate_limit, end_log_cycle
+from common.metrics import configure_metrics, get_registry, publish_metrics
+from common.poller import AdaptivePoller
+from common.retry import AUTOSCALING, circuit_breaker, retry
+from common.snapshot import SnapshotPublisher
+from common.state import WarmState
+from common.timing import StartupTimer
+from common.tracing import configure_tracing, root_span
+from common.utils import (
+    DEFAULT_ASG_SETTINGS_TTL,
+    CriticalError,
+    get_asg_name,
+    get_asg_settings_cache,
+    get_boto3_client,
+    get_proxy_config,
+    load_module,
+)
 
 log = logging.getLogger(__name__)
 
+CONFIG_FILE = "/etc/jobwatcher.cfg"
+# catalog of the instance types, in the pcluster_dir
+INSTANCE_CATALOG_FILE = "instances.tsv"
+# history of the demand for the forecast policy, in the pcluster_dir
+DEMAND_HISTORY_FILE = "demand_history.bin"
+# fraction of the instance memory left to the OS and the scheduler daemons, with multi_resource_packing
+RESERVED_MEMORY_FRACTION = 0.05
+
+# options applied on reload, mapped to the config fields
+LIVE_OPTIONS = {
+    "proxy": "proxy_config",
+    "asg_settings_ttl": "asg_settings_ttl",
+    "watchdog_max_lag": "watchdog_max_lag",
+    "poll_min_interval": "poll_min_interval",
+    "poll_max_interval": "poll_max_interval",
+    "trigger_file": "trigger_file",
+    "asg_update_interval": "asg_update_interval",
+}
+
+metrics = get_registry()
+PENDING_NODES = metrics.gauge("jobwatcher_pending_nodes", "Nodes required by the pending jobs")
+BUSY_NODES = metrics.gauge("jobwatcher_busy_nodes", "Nodes running jobs")
+REQUIRED_NODES = metrics.gauge("jobwatcher_required_nodes", "Nodes required by the running and pending jobs")
+DESIRED_CAPACITY = metrics.gauge("jobwatcher_desired_capacity", "Desired capacity of the ASG")
+SCALE_UP_TOTAL = metrics.counter("jobwatcher_scale_up_total", "Requests to increase the ASG desired capacity")
+FORECAST_NODES = metrics.gauge("jobwatcher_forecast_nodes", "Nodes forecast to be required within the lead time")
+SCALE_UP_DEFERRED_TOTAL = metrics.counter(
+    "jobwatcher_scale_up_deferred_total", "Increases of the ASG desired capacity deferred by asg_update_interval"
+)
+POLL_INTERVAL = metrics.gauge("jobwatcher_poll_interval_seconds", "Seconds to the next check of the pending jobs")
+DECISION_SECONDS = metrics.histogram(
+    "jobwatcher_decision_seconds", "Time spent computing the required nodes and updating the ASG"
+)
+
 
 def _read_cfnconfig():
     """
@@ -45,23 +96,22 @@ def _read_cfnconfig():
     return cfnconfig_params
 
 
-@retry(stop_max_attempt_number=3, wait_fixed=5000)
-def _get_vcpus_from_pricing_file(config):
+@retry(attempts=3, base_delay=5, max_delay=20)
+def _get_instance_type_from_catalog(config):
     """
-    Read pricing file and get number of vcpus for the given instance type.
+    Read the instance catalog and get vcpus, memory and GPUs of the given instance type.
+
+    The instances.json file is downloaded from S3 only if changed since the last start.
 
     :param config: JobwatcherConfiguration object
-    :return: the number of vcpus or -1 if the instance type cannot be found
+    :return: a dictionary with the vcpus, memory (GiB) and gpus of the instance type
     """
     _create_data_dir(config.pcluster_dir)
 
-    folder = config.pcluster_dir
-    if not folder.endswith("/"):
-        folder += "/"
-    pricing_file = folder + "instances.json"
-    _fetch_pricing_file(pricing_file, config.region, config.proxy_config)
-
-    return _get_vcpus_by_instance_type(pricing_file, config.instance_type)
+    catalog = update_instance_catalog(
+        os.path.join(config.pcluster_dir, INSTANCE_CATALOG_FILE), config.region, config.proxy_config
+    )
+    return _get_instance_type(catalog, config.instance_type)
 
 
 def _get_instance_properties(config):
@@ -69,10 +119,12 @@ def _get_instance_properties(config):
     Get instance properties for the given instance type, according to the cfn_scheduler_slots configuration parameter.
 
     :param config: JobwatcherConfiguration object
-    :return: a dictionary containing the instance properties. E.g. {'slots': <slots>}
+    :return: a dictionary containing the instance properties. E.g. {'slots': <slots>}, with multi_resource_packing
+             {'slots': <slots>, 'memory': <MiB>, 'gpus': <gpus>}
     """
-    # get vcpus from the pricing file
-    vcpus = _get_vcpus_from_pricing_file(config)
+    # get vcpus from the instance catalog
+    instance_type = _get_instance_type_from_catalog(config)
+    vcpus = instance_type["vcpus"]
 
     try:
         cfnconfig_params = _read_cfnconfig()
@@ -82,16 +134,16 @@ def _get_instance_properties(config):
         cfn_scheduler_slots = "vcpus"
 
     if cfn_scheduler_slots == "cores":
-        log.info("Instance %s will use number of cores as slots based on configuration." % config.instance_type)
+        log.info("Instance %s will use number of cores as slots based on configuration.", config.instance_type)
         slots = -(-vcpus//2)
 
     elif cfn_scheduler_slots == "vcpus":
-        log.info("Instance %s will use number of vcpus as slots based on configuration." % config.instance_type)
+        log.info("Instance %s will use number of vcpus as slots based on configuration.", config.instance_type)
         slots = vcpus
 
     elif cfn_scheduler_slots.isdigit():
         slots = int(cfn_scheduler_slots)
-        log.info("Instance %s will use %s slots based on configuration." % (config.instance_type, slots))
+        log.info("Instance %s will use %s slots based on configuration.", config.instance_type, slots)
 
         if slots <= 0:
             log.error(
@@ -101,10 +153,23 @@ def _get_instance_properties(config):
             )
             slots = vcpus
     else:
-        log.error("cfn_scheduler_slots config parameter '%s' is invalid. Assuming 'vcpus'" % cfn_scheduler_slots)
+        log.error("cfn_scheduler_slots config parameter '%s' is invalid. Assuming 'vcpus'", cfn_scheduler_slots)
         slots = vcpus
 
-    return {'slots': slots}
+    instance_properties = {'slots': slots}
+    if config.multi_resource_packing:
+        if instance_type["memory"] > 0:
+            instance_properties['memory'] = int(instance_type["memory"] * 1024 * (1 - RESERVED_MEMORY_FRACTION))
+            instance_properties['gpus'] = instance_type["gpus"]
+            log.info(
+                "Instance %s will pack jobs by slots, %s MiB of memory and %s GPUs.",
+                config.instance_type,
+                instance_properties['memory'],
+                instance_properties['gpus'],
+            )
+        else:
+            log.error("Memory of instance %s is unknown, jobs will be packed by slots only", config.instance_type)
+    return instance_properties
 
 
 def _create_data_dir(pcluster_dir):
@@ -122,56 +187,53 @@ def _create_data_dir(pcluster_dir):
         raise
 
 
-def _fetch_pricing_file(pricing_file, region, proxy_config):
+def _get_instance_type(catalog, instance_type):
     """
-    Download pricing file.
+    Get vcpus, memory and GPUs for the given instance type from the instance catalog.
 
-    :param pricing_file: pricing file path
-    :param region: AWS Region
-    :param proxy_config: Proxy Configuration
-    :raise ClientError if unable to download the pricing file.
-    """
-    bucket_name = '%s-aws-parallelcluster' % region
-    try:
-        s3 = boto3.resource('s3', region_name=region, config=proxy_config)
-        s3.Bucket(bucket_name).download_file('instances/instances.json', pricing_file)
-    except ClientError as e:
-        log.critical("Could not save instance mapping file {0} from S3 bucket {1}. Failed with exception: {2}".format(
-            pricing_file, bucket_name, e)
-        )
-        raise
-
-
-def _get_vcpus_by_instance_type(pricing_file, instance_type):
-    """
-    Get vcpus for the given instance type from the pricing file.
-
-    :param pricing_file: pricing file path
+    :param catalog: InstanceCatalog object
     :param instance_type: The instance type to search for
-    :return: the number of vcpus for the given instance type
+    :return: a dictionary with the vcpus, memory (GiB) and gpus of the instance type
     :raise CriticalError if unable to find the given instance or whatever error.
     """
     try:
-        # read vcpus value from file
-        with open(pricing_file) as f:
-            instances = json.load(f)
-            vcpus = int(instances[instance_type]["vcpus"])
-            log.info("Instance %s has %s vcpus." % (instance_type, vcpus))
-            return vcpus
-    except KeyError:
-        error_msg = "Unable to get vcpus from file {0}. Instance type {1} not found.".format(
-            pricing_file, instance_type
-        )
+        instance = catalog.get(instance_type)
+    except Exception:
+        error_msg = "Unable to get vcpus for the instance type {0} from file {1}".format(instance_type, catalog.path)
         log.critical(error_msg)
         raise CriticalError(error_msg)
-    except Exception:
-        error_msg = "Unable to get vcpus for the instance type {0} from file {1}".format(instance_type, pricing_file)
+
+    if not instance or instance["vcpus"] <= 0:
+        error_msg = "Unable to get vcpus from file {0}. Instance type {1} not found.".format(
+            catalog.path, instance_type
+        )
         log.critical(error_msg)
         raise CriticalError(error_msg)
 
+    log.info("Instance %s has %s vcpus.", instance_type, instance["vcpus"])
+    return instance
+
 
 JobwatcherConfig = collections.namedtuple(
-    "JobwatcherConfig", ["region", "scheduler", "stack_name", "instance_type", "pcluster_dir", "proxy_config"]
+    "JobwatcherConfig",
+    [
+        "region",
+        "scheduler",
+        "stack_name",
+        "instance_type",
+        "pcluster_dir",
+        "proxy_config",
+        "asg_settings_ttl",
+        "snapshot_interval",
+        "watchdog_max_lag",
+        "poll_min_interval",
+        "poll_max_interval",
+        "trigger_file",
+        "asg_update_interval",
+        "forecast_lead_time",
+        "forecast_max_nodes",
+        "multi_resource_packing",
+    ],
 )
 
 
@@ -181,34 +243,118 @@ def _get_config():
 
     :return: configuration parameters
     """
-    config_file = "/etc/jobwatcher.cfg"
-    log.info("Reading %s", config_file)
+    log.info("Reading %s", CONFIG_FILE)
 
     config = ConfigParser.RawConfigParser()
-    config.read(config_file)
+    config.read(CONFIG_FILE)
     if config.has_option("jobwatcher", "loglevel"):
         lvl = logging._levelNames[config.get("jobwatcher", "loglevel")]
         logging.getLogger().setLevel(lvl)
+    configure_log_rate_limit(config, "jobwatcher")
+    configure_metrics(config, "jobwatcher")
+    configure_tracing(config, "jobwatcher")
 
     region = config.get("jobwatcher", "region")
     scheduler = config.get("jobwatcher", "scheduler")
     stack_name = config.get("jobwatcher", "stack_name")
     instance_type = config.get("jobwatcher", "compute_instance_type")
     pcluster_dir = config.get("jobwatcher", "cfncluster_dir")
+    asg_settings_ttl = DEFAULT_ASG_SETTINGS_TTL
+    if config.has_option("jobwatcher", "asg_settings_ttl"):
+        asg_settings_ttl = int(config.get("jobwatcher", "asg_settings_ttl"))
+    # 0 disables the scheduler snapshot, the scheduler is queried directly by the polling loop
+    snapshot_interval = 0
+    if config.has_option("jobwatcher", "snapshot_interval"):
+        snapshot_interval = int(config.get("jobwatcher", "snapshot_interval"))
+    # 0 disables the watchdog
+    watchdog_max_lag = 0
+    if config.has_option("jobwatcher", "watchdog_max_lag"):
+        watchdog_max_lag = int(config.get("jobwatcher", "watchdog_max_lag"))
+    # pending jobs are checked every poll_min_interval seconds while they change, then the period doubles
+    # at every check up to poll_max_interval
+    poll_min_interval = 10
+    if config.has_option("jobwatcher", "poll_min_interval"):
+        poll_min_interval = int(config.get("jobwatcher", "poll_min_interval"))
+    poll_max_interval = 60
+    if config.has_option("jobwatcher", "poll_max_interval"):
+        poll_max_interval = int(config.get("jobwatcher", "poll_max_interval"))
+    # file touched e.g. by a scheduler submission hook to check pending jobs immediately
+    trigger_file = None
+    if config.has_option("jobwatcher", "trigger_file"):
+        trigger_file = config.get("jobwatcher", "trigger_file")
+    # min seconds between two updates of the ASG desired capacity
+    asg_update_interval = 30
+    if config.has_option("jobwatcher", "asg_update_interval"):
+        asg_update_interval = int(config.get("jobwatcher", "asg_update_interval"))
+    # seconds ahead the demand is forecast from the previous days, 0 disables the forecast
+    forecast_lead_time = 0
+    if config.has_option("jobwatcher", "forecast_lead_time"):
+        forecast_lead_time = int(config.get("jobwatcher", "forecast_lead_time"))
+    # max nodes requested in addition to the ones required by the jobs, because of the forecast
+    forecast_max_nodes = 10
+    if config.has_option("jobwatcher", "forecast_max_nodes"):
+        forecast_max_nodes = int(config.get("jobwatcher", "forecast_max_nodes"))
+    # pack pending jobs by slots, memory and GPUs instead of slots only, Slurm only
+    multi_resource_packing = False
+    if config.has_option("jobwatcher", "multi_resource_packing"):
+        multi_resource_packing = config.getboolean("jobwatcher", "multi_resource_packing")
 
     _proxy = config.get("jobwatcher", "proxy")
-    proxy_config = Config()
-    if _proxy != "NONE":
-        proxy_config = Config(proxies={"https": _proxy})
+    proxy_config = get_proxy_config(_proxy)
 
     log.info(
-        "Configured parameters: region=%s scheduler=%s stack_name=%s instance_type=%s pcluster_dir=%s proxy=%s",
-        region, scheduler, stack_name, instance_type, pcluster_dir, _proxy
+        "Configured parameters: region=%s scheduler=%s stack_name=%s instance_type=%s pcluster_dir=%s proxy=%s "
+        "asg_settings_ttl=%s snapshot_interval=%s watchdog_max_lag=%s poll_min_interval=%s poll_max_interval=%s "
+        "trigger_file=%s asg_update_interval=%s forecast_lead_time=%s forecast_max_nodes=%s "
+        "multi_resource_packing=%s",
+        region,
+        scheduler,
+        stack_name,
+        instance_type,
+        pcluster_dir,
+        _proxy,
+        asg_settings_ttl,
+        snapshot_interval,
+        watchdog_max_lag,
+        poll_min_interval,
+        poll_max_interval,
+        trigger_file,
+        asg_update_interval,
+        forecast_lead_time,
+        forecast_max_nodes,
+        multi_resource_packing,
+    )
+    return JobwatcherConfig(
+        region,
+        scheduler,
+        stack_name,
+        instance_type,
+        pcluster_dir,
+        proxy_config,
+        asg_settings_ttl,
+        snapshot_interval,
+        watchdog_max_lag,
+        poll_min_interval,
+        poll_max_interval,
+        trigger_file,
+        asg_update_interval,
+        forecast_lead_time,
+        forecast_max_nodes,
+        multi_resource_packing,
     )
-    return JobwatcherConfig(region, scheduler, stack_name, instance_type, pcluster_dir, proxy_config)
 
 
-def _poll_scheduler_status(config, asg_name, scheduler_module, instance_properties):
+def _poll_scheduler_status(
+    config,
+    asg_name,
+    scheduler_module,
+    instance_properties,
+    snapshot_publisher=None,
+    startup_timer=None,
+    config_reloader=None,
+    warm_state=None,
+    forecast_policy=None,
+):
     """
     Verify scheduler status and ask the ASG new nodes, if required.
 
@@ -216,61 +362,188 @@ def _poll_scheduler_status(config, asg_name, scheduler_module, instance_properti
     :param asg_name: ASG name
     :param scheduler_module: scheduler module
     :param instance_properties: instance properties
+    :param snapshot_publisher: SnapshotPublisher object, None to query the scheduler directly
+    :param startup_timer: StartupTimer object to complete at the end of the first iteration
+    :param config_reloader: ConfigReloader object applying the requested config reloads between iterations
+    :param warm_state: WarmState object the ASG name and the instance properties come from
+    :param forecast_policy: ForecastPolicy object to request nodes ahead of the demand, None to disable
     """
+    asg_settings = get_asg_settings_cache(
+        config.region, config.proxy_config, asg_name, log, config.asg_settings_ttl
+    )
+    health = get_health_monitor("jobwatcher", 60, config.watchdog_max_lag)
+    poller = AdaptivePoller(config.poll_min_interval, config.poll_max_interval, config.trigger_file)
+    # time of the last update of the ASG desired capacity
+    last_update_time = None
+    # ASG max size read by the last iteration with pending jobs, pending jobs beyond it are not placed
+    max_size = None
     while True:
-        # Get number of nodes requested
-        pending = scheduler_module.get_required_nodes(instance_properties)
-
-        if pending < 0:
-            log.critical("Error detecting number of required nodes. The cluster will not scale up.")
-
-        elif pending == 0:
-            log.info("There are no pending jobs. Noop.")
-
-        else:
-            # Get current number of nodes
-            running = scheduler_module.get_busy_nodes(instance_properties)
-            log.info("%d nodes requested, %d nodes running", pending, running)
-
-            # get current limits
-            _, current_desired, max_size = get_asg_settings(config.region, config.proxy_config, asg_name, log)
+        if config_reloader:
+            new_config = config_reloader.reload(config)
+            if new_config is not config:
+                config = new_config
+                asg_settings = get_asg_settings_cache(
+                    config.region, config.proxy_config, asg_name, log, config.asg_settings_ttl
+                )
+                health.set_watchdog(config.watchdog_max_lag)
+                poller = AdaptivePoller(config.poll_min_interval, config.poll_max_interval, config.trigger_file)
+        if warm_state:
+            warm_state.check()
+        health.start_iteration()
+        start_time = time.time()
+        # seconds to the end of the asg_update_interval, if an update of the ASG has been deferred
+        update_wait = None
+        with root_span("jobwatcher iteration") as iteration_span:
+            # Use the same view of the cluster for all the checks of this iteration, if available
+            snapshot = snapshot_publisher.get() if snapshot_publisher else None
+
+            # Get number of nodes requested
+            health.set_phase("required_nodes")
+            pending = scheduler_module.get_required_nodes(instance_properties, snapshot, max_size)
+            PENDING_NODES.set(pending)
+            iteration_span.set_attribute("pending_nodes", pending)
+
+            if pending < 0:
+                log.critical("Error detecting number of required nodes. The cluster will not scale up.")
+
+            elif pending == 0 and not forecast_policy:
+                log.info("There are no pending jobs. Noop.")
 
-            # Check to make sure requested number of instances is within ASG limits
-            required = running + pending
-            if required <= current_desired:
-                log.info("%d nodes required, %d nodes in asg. Noop" % (required, current_desired))
             else:
-                if required > max_size:
-                    log.info(
-                        "The number of required nodes %d is greater than max %d. Requesting max %d."
-                        % (required, max_size, max_size)
-                    )
-                else:
-                    log.info(
-                        "Setting desired to %d nodes, requesting %d more nodes from asg."
-                        % (required, required - current_desired)
-                    )
+                # get current limits
+                _, current_desired, max_size = asg_settings.get()
+
+                # Get current number of nodes
+                health.set_phase("busy_nodes")
+                running = scheduler_module.get_busy_nodes(instance_properties, snapshot)
+                log.info("%d nodes requested, %d nodes running", pending, running)
+
+                # Check to make sure requested number of instances is within ASG limits
+                required = running + pending
+                if forecast_policy:
+                    forecast_policy.record(clock.now(), pending, running, current_desired)
+                    forecast = forecast_policy.get_required_nodes(clock.now(), required)
+                    FORECAST_NODES.set(forecast)
+                    if forecast > required:
+                        log.info(
+                            "%d nodes forecast to be required in the next %d seconds, %d nodes required by the jobs",
+                            forecast,
+                            forecast_policy.lead_time,
+                            required,
+                        )
+                        required = forecast
+                BUSY_NODES.set(running)
+                REQUIRED_NODES.set(required)
+                DESIRED_CAPACITY.set(current_desired)
+                iteration_span.set_attribute("required_nodes", required)
                 requested = min(required, max_size)
-
-                # update ASG
-                asg_client = boto3.client('autoscaling', region_name=config.region, config=config.proxy_config)
-                asg_client.update_auto_scaling_group(AutoScalingGroupName=asg_name, DesiredCapacity=requested)
-
-        time.sleep(60)
-
-
-@retry(wait_fixed=60000)
+                if required <= current_desired:
+                    log.info("%d nodes required, %d nodes in asg. Noop", required, current_desired)
+                elif requested <= current_desired:
+                    log.info("%d nodes required, asg already at max %d. Noop", required, current_desired)
+                elif last_update_time is not None and clock.now() - last_update_time < config.asg_update_interval:
+                    # coalesce the updates of a burst of submissions
+                    update_wait = config.asg_update_interval - (clock.now() - last_update_time)
+                    log.info("Deferring update of desired to %d nodes by %.0f seconds", requested, update_wait)
+                    SCALE_UP_DEFERRED_TOTAL.inc()
+                else:
+                    if required > max_size:
+                        log.info(
+                            "The number of required nodes %d is greater than max %d. Requesting max %d.",
+                            required,
+                            max_size,
+                            max_size,
+                        )
+                    else:
+                        log.info(
+                            "Setting desired to %d nodes, requesting %d more nodes from asg.",
+                            required,
+                            required - current_desired,
+                        )
+
+                    # update ASG
+                    health.set_phase("asg_update")
+                    asg_client = get_boto3_client('autoscaling', config.region, config.proxy_config)
+                    with circuit_breaker(AUTOSCALING):
+                        asg_client.update_auto_scaling_group(AutoScalingGroupName=asg_name, DesiredCapacity=requested)
+                    last_update_time = clock.now()
+                    asg_settings.invalidate()
+                    SCALE_UP_TOTAL.inc()
+                    DESIRED_CAPACITY.set(requested)
+
+        DECISION_SECONDS.observe(time.time() - start_time)
+
+        get_command_executor().log_stats(log)
+        end_log_cycle(log)
+        diagnostics_checkpoint()
+        publish_metrics()
+        if startup_timer:
+            startup_timer.complete("first_iteration")
+        next_wait = poller.update(pending)
+        if update_wait is not None:
+            next_wait = min(next_wait, update_wait)
+        POLL_INTERVAL.set(next_wait)
+        health.end_iteration(next_wait)
+        poller.wait(next_wait)
+
+
+@retry(base_delay=60, max_delay=240)
 def main():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(module)s:%(funcName)s] %(message)s")
     log.info("jobwatcher startup")
+    install_diagnostics_handlers("jobwatcher")
+    install_reload_handler()
+    startup_timer = StartupTimer("jobwatcher", log)
     try:
         config = _get_config()
-        asg_name = get_asg_name(config.stack_name, config.region, config.proxy_config, log)
-        instance_properties = _get_instance_properties(config)
+        startup_timer.mark("config")
+        warm_state = WarmState(
+            "jobwatcher",
+            {
+                "region": config.region,
+                "stack_name": config.stack_name,
+                "instance_type": config.instance_type,
+                "multi_resource_packing": config.multi_resource_packing,
+            },
+        )
+        asg_name = warm_state.discover(
+            "asg_name", lambda: get_asg_name(config.stack_name, config.region, config.proxy_config, log)
+        )
+        instance_properties = warm_state.discover("instance_properties", lambda: _get_instance_properties(config))
+        startup_timer.mark("aws_discovery")
 
         scheduler_module = load_module("jobwatcher.plugins." + config.scheduler)
 
-        _poll_scheduler_status(config, asg_name, scheduler_module, instance_properties)
+        snapshot_publisher = None
+        if config.snapshot_interval > 0:
+            snapshot_publisher = SnapshotPublisher(scheduler_module.get_cluster_snapshot, config.snapshot_interval)
+            snapshot_publisher.refresh()
+            snapshot_publisher.start()
+
+        forecast_policy = None
+        if config.forecast_lead_time > 0:
+            forecast_policy = ForecastPolicy(
+                DemandHistory(os.path.join(config.pcluster_dir, DEMAND_HISTORY_FILE)),
+                config.forecast_lead_time,
+                config.forecast_max_nodes,
+            )
+
+        config_reloader = get_config_reloader("jobwatcher", CONFIG_FILE, _get_config, LIVE_OPTIONS)
+        try:
+            _poll_scheduler_status(
+                config,
+                asg_name,
+                scheduler_module,
+                instance_properties,
+                snapshot_publisher,
+                startup_timer,
+                config_reloader,
+                warm_state,
+                forecast_policy,
+            )
+        finally:
+            if snapshot_publisher:
+                snapshot_publisher.stop()
     except Exception as e:
         log.critical("An unexpected error occurred: %s", e)
         raise
@@ -1,37 +1,80 @@
 import logging
 
 from common.sge import check_sge_command_output
+from utils import add_pending_job, count_array_tasks, count_busy_nodes
 
 log = logging.getLogger(__name__)
 
 
 # get nodes requested from pending jobs
-def get_required_nodes(instance_properties):
-    command = "qstat -g d -s p -u '*'"
-    _output = check_sge_command_output(command, log)
+def get_required_nodes(instance_properties, snapshot=None, max_nodes=None):
+    pending_jobs = snapshot["pending_jobs"] if snapshot else _get_pending_jobs()
     slots = 0
+    for _, job_slots, count in pending_jobs:
+        slots += job_slots * count
+    vcpus = instance_properties.get('slots')
+    nodes = -(-slots // vcpus)
+    return nodes if max_nodes is None else min(nodes, max_nodes)
+
+
+# get nodes reserved by running jobs
+# if a host has 1 or more job running on it, it'll be marked busy
+def get_busy_nodes(instance_properties, snapshot=None):
+    if snapshot:
+        return count_busy_nodes(snapshot)
+
+    return count_busy_nodes({"nodes": _get_nodes()})
+
+
+def get_cluster_snapshot():
+    """
+    Get pending jobs and node states of the cluster.
+
+    :return: the snapshot dictionary, see common.snapshot.SnapshotPublisher
+    """
+    return {"pending_jobs": _get_pending_jobs(), "nodes": _get_nodes()}
+
+
+def _get_pending_jobs():
+    # without -g d the pending tasks of a job array are listed in a single line
+    command = "qstat -s p -u '*'"
+    # Example output
+    # job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID
+    # -----------------------------------------------------------------------------------------------------------------
+    #      12 0.55500 job.sh     centos       qw    06/10/2019 09:21:07                                    2
+    #      13 0.55500 array.sh   centos       qw    06/10/2019 09:21:12                                    1 5-50000:1
+    _output = check_sge_command_output(command, log)
+    pending_jobs = []
     output = _output.split("\n")[2:]
     for line in output:
         line_arr = line.split()
         if len(line_arr) >= 8:
-            slots += int(line_arr[7])
-    vcpus = instance_properties.get('slots')
-    return -(-slots // vcpus)
+            count = count_array_tasks(line_arr[8]) if len(line_arr) >= 9 else 1
+            add_pending_job(pending_jobs, 1, int(line_arr[7]), count)
+    return pending_jobs
 
 
-# get nodes reserved by running jobs
-# if a host has 1 or more job running on it, it'll be marked busy
-def get_busy_nodes(instance_properties):
+def _get_nodes():
     command = "qstat -f"
+    # Example output
+    # queuename                      qtype resv/used/tot. load_avg arch          states
+    # ---------------------------------------------------------------------------------
+    # all.q@ip-10-0-0-166.ec2.intern BIP   0/2/4          0.01     lx-amd64
+    # ---------------------------------------------------------------------------------
+    # all.q@ip-10-0-0-52.ec2.interna BIP   0/0/4          0.01     lx-amd64      d
     _output = check_sge_command_output(command, log)
-    nodes = 0
+    nodes = {}
     output = _output.split("\n")[2:]
     for line in output:
         line_arr = line.split()
-        if len(line_arr) == 5:
+        if len(line_arr) in (5, 6) and line_arr[2].count("/") == 2:
             # resv/used/tot.
             (resv, used, total) = line_arr[2].split('/')
-            if int(used) > 0 or int(resv) > 0:
-                nodes += 1
+            nodes[line_arr[0]] = {
+                "state": line_arr[5] if len(line_arr) == 6 else "",
+                "used_slots": int(resv) + int(used),
+                "total_slots": int(total),
+                # hosts with a state (e.g. disabled or unreachable) are not counted as busy
+                "busy": len(line_arr) == 5 and (int(used) > 0 or int(resv) > 0),
+            }
     return nodes
-
@@ -1,39 +1,38 @@
 import logging
 
 from common.slurm import PENDING_RESOURCES_REASONS
-from common.utils import check_command_output
-from utils import get_optimal_nodes
+from common.utils import check_command_output, command_output_lines
+from utils import (
+    PendingJobsPacker,
+    add_pending_job,
+    count_array_tasks,
+    count_busy_nodes,
+    get_optimal_nodes_for_pending_jobs,
+)
 
 log = logging.getLogger(__name__)
 
+BUSY_STATES = ["mix", "alloc", "drain", "drain*"]
+
 
 # get nodes requested from pending jobs
-def get_required_nodes(instance_properties):
+def get_required_nodes(instance_properties, snapshot=None, max_nodes=None):
     log.info("Computing number of required nodes for submitted jobs")
-    command = "/opt/slurm/bin/squeue -r -h -o '%i-%t-%D-%C-%r'"
-    # Example output of squeue
-    # 1-PD-1-24-Nodes required for job are DOWN, DRAINED or reserved for jobs in higher priority partitions
-    # 2-PD-1-24-Licenses
-    # 3-PD-1-24-PartitionNodeLimit
-    # 4-R-1-24-
-    output = check_command_output(command, log)
-    slots_requested = []
-    nodes_requested = []
-    output = output.split("\n")
-    for line in output:
-        line_arr = line.split("-")
-        if len(line_arr) == 5 and line_arr[1] == 'PD':
-            if line_arr[4] in PENDING_RESOURCES_REASONS:
-                slots_requested.append(int(line_arr[3]))
-                nodes_requested.append(int(line_arr[2]))
-            else:
-                log.info("Skipping pending job %s due to pending reason: %s", line_arr[0], line_arr[4])
+    if snapshot:
+        return get_optimal_nodes_for_pending_jobs(snapshot["pending_jobs"], instance_properties, max_nodes)
 
-    return get_optimal_nodes(nodes_requested, slots_requested, instance_properties)
+    # jobs are placed while squeue output is read, memory usage does not depend on the number of pending jobs
+    packer = PendingJobsPacker(instance_properties, max_nodes)
+    for job in _iter_pending_jobs():
+        packer.add(*job)
+    return packer.get_required_nodes()
 
 
 # get nodes reserved by running jobs
-def get_busy_nodes(instance_properties):
+def get_busy_nodes(instance_properties, snapshot=None):
+    if snapshot:
+        return count_busy_nodes(snapshot)
+
     command = "/opt/slurm/bin/sinfo -r -h -o '%D %t'"
     # Sample output:
     # 2 mix
@@ -44,6 +43,126 @@ def get_busy_nodes(instance_properties):
     output = output.split("\n")
     for line in output:
         line_arr = line.split()
-        if len(line_arr) == 2 and (line_arr[1] in ['mix', 'alloc', 'drain', 'drain*']):
+        if len(line_arr) == 2 and (line_arr[1] in BUSY_STATES):
             nodes += int(line_arr[0])
     return nodes
+
+
+def get_cluster_snapshot():
+    """
+    Get pending jobs and node states of the cluster.
+
+    :return: the snapshot dictionary, see common.snapshot.SnapshotPublisher
+    """
+    command = "/opt/slurm/bin/sinfo -N -r -h -o '%N %t %C'"
+    # Sample output, a node is listed once per partition:
+    # ip-10-0-0-30 mix 8/8/0/16
+    # ip-10-0-0-31 idle 0/16/0/16
+    nodes = {}
+    for line in check_command_output(command, log).split("\n"):
+        line_arr = line.split()
+        if len(line_arr) == 3:
+            # allocated/idle/other/total
+            cpus = line_arr[2].split("/")
+            nodes[line_arr[0]] = {
+                "state": line_arr[1],
+                "used_slots": int(cpus[0]),
+                "total_slots": int(cpus[3]),
+                "busy": line_arr[1] in BUSY_STATES,
+            }
+
+    return {"pending_jobs": _get_pending_jobs(), "nodes": nodes}
+
+
+def _get_pending_jobs():
+    pending_jobs = []
+    for job in _iter_pending_jobs():
+        add_pending_job(pending_jobs, *job)
+
+    return pending_jobs
+
+
+def _iter_pending_jobs():
+    """
+    Read the jobs pending for resources from the squeue output, while squeue is running.
+
+    :return: a generator of tuples (nodes, slots, count, memory, gpus, exclusive), in submission order
+    """
+    # without -r the pending tasks of a job array are listed in a single line
+    command = "/opt/slurm/bin/squeue -h -o '%i|%t|%D|%C|%r|%m|%h|%b'"
+    return _parse_pending_jobs(command_output_lines(command, log))
+
+
+def _parse_pending_jobs(lines):
+    """
+    Parse the squeue output lines, see _iter_pending_jobs.
+
+    :param lines: iterable of squeue output lines
+    :return: a generator of tuples (nodes, slots, count, memory, gpus, exclusive), nodes, slots, memory (MiB per
+             node) and gpus (per node) are the ones of every job of the array
+    """
+    # Example output of squeue, nodes and CPUs of job arrays are the ones of every task.
+    # Memory is taken as per node, OverSubscribe NO means exclusive nodes. squeue shows the memory of the jobs
+    # submitted with --mem-per-cpu without telling it apart, so these jobs are packed as needing the memory of a
+    # single CPU on every node
+    # 1|PD|1|24|Nodes required for job are DOWN, DRAINED or reserved for jobs in higher priority partitions|0|OK|N/A
+    # 2|PD|1|24|Licenses|0|OK|N/A
+    # 3_[4-50000%100]|PD|1|2|Resources|2000M|OK|N/A
+    # 3_1|R|1|2||2000M|OK|N/A
+    # 4|R|1|24||0|NO|gpu:2
+    for line in lines:
+        line_arr = line.split("|")
+        if len(line_arr) == 8 and line_arr[1] == 'PD':
+            if line_arr[4] in PENDING_RESOURCES_REASONS:
+                _, _, task_ids = line_arr[0].partition("_")
+                count = count_array_tasks(task_ids) if task_ids.startswith("[") else 1
+                yield (
+                    int(line_arr[2]),
+                    int(line_arr[3]),
+                    count,
+                    _parse_memory(line_arr[5]),
+                    _parse_gpus(line_arr[7]),
+                    line_arr[6] == "NO",
+                )
+            else:
+                log.info("Skipping pending job %s due to pending reason: %s", line_arr[0], line_arr[4])
+
+
+def _parse_memory(memory):
+    """
+    Parse the memory requested by a job.
+
+    :param memory: memory as shown by squeue, e.g. 2000M or 4G, MiB if without unit
+    :return: the memory in MiB
+    """
+    if memory in ("0", "0M"):
+        return 0
+    units = {"K": 1.0 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+    try:
+        if memory[-1:] in units:
+            return int(-(-float(memory[:-1]) * units[memory[-1]] // 1))
+        return int(memory)
+    except ValueError:
+        log.warning("Unable to parse memory %s, ignoring it", memory)
+        return 0
+
+
+def _parse_gpus(gres):
+    """
+    Count the GPUs requested by a job.
+
+    :param gres: generic resources as shown by squeue, e.g. gpu:2, gres:gpu:tesla:2 or N/A
+    :return: the number of GPUs per node
+    """
+    if "gpu" not in gres:
+        return 0
+    gpus = 0
+    for resource in gres.split(","):
+        fields = resource.replace("gres/", "").split(":")
+        if fields[0] == "gres":
+            fields = fields[1:]
+        if fields and fields[0] == "gpu":
+            # the count is the last field, e.g. gpu:tesla:2 or gpu:2(IDX:0-1), a GPU if missing
+            count = fields[-1].split("(")[0] if len(fields) > 1 else ""
+            gpus += int(count) if count.isdigit() else 1
+    return gpus
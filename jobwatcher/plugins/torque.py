@@ -1,14 +1,19 @@
 import logging
 from xml.etree import ElementTree
 
-from common.utils import check_command_output
-from utils import get_optimal_nodes
+from common.utils import check_command_output, command_output_stream
+from utils import add_pending_job, count_busy_nodes, get_optimal_nodes_for_pending_jobs
 
 log = logging.getLogger(__name__)
 
 
 # get nodes requested from pending jobs
-def get_required_nodes(instance_properties):
+def get_required_nodes(instance_properties, snapshot=None, max_nodes=None):
+    pending_jobs = snapshot["pending_jobs"] if snapshot else _get_pending_jobs()
+    return get_optimal_nodes_for_pending_jobs(pending_jobs, instance_properties, max_nodes)
+
+
+def _get_pending_jobs():
     command = "/opt/torque/bin/qstat -at"
 
     # Example output of torque
@@ -22,20 +27,21 @@ def get_required_nodes(instance_properties):
     status = ['Q']
     _output = check_command_output(command, log)
     output = _output.split("\n")[5:]
-    slots_requested = []
-    nodes_requested = []
+    pending_jobs = []
     for line in output:
         line_arr = line.split()
         if len(line_arr) >= 10 and line_arr[9] in status:
             # if a job has been looked at to account for pending nodes, don't look at it again
-            slots_requested.append(int(line_arr[6]))
-            nodes_requested.append(int(line_arr[5]))
+            add_pending_job(pending_jobs, int(line_arr[5]), int(line_arr[6]))
 
-    return get_optimal_nodes(nodes_requested, slots_requested, instance_properties)
+    return pending_jobs
 
 
 # get nodes reserved by running jobs
-def get_busy_nodes(instance_properties):
+def get_busy_nodes(instance_properties, snapshot=None):
+    if snapshot:
+        return count_busy_nodes(snapshot)
+
     command = "/opt/torque/bin/pbsnodes -x"
     # The output of the command
     #<?xml version="1.0" encoding="UTF-8"?>
@@ -52,11 +58,94 @@ def get_busy_nodes(instance_properties):
     #       <mom_manager_port>15003</mom_manager_port>
     #    </Node>
     # </Data>
-    _output = check_command_output(command, log)
-    root = ElementTree.fromstring(_output)
-    count = 0
-    # See how many nodes have jobs
-    for node in root.findall('Node'):
-        if len(node.findall('jobs')) != 0:
-            count += 1
-    return count
+    with command_output_stream(command, log) as output:
+        busy_nodes, free_slots = _count_busy_nodes(output)
+
+    log.info("%d nodes have running jobs, %d slots are free", busy_nodes, free_slots)
+    return busy_nodes
+
+
+def get_cluster_snapshot():
+    """
+    Get pending jobs and node states of the cluster.
+
+    :return: the snapshot dictionary, see common.snapshot.SnapshotPublisher
+    """
+    nodes = {}
+    with command_output_stream("/opt/torque/bin/pbsnodes -x", log) as output:
+        for name, state, total_slots, used_slots, busy in _iter_pbsnodes(output):
+            nodes[name] = {"state": state, "used_slots": used_slots, "total_slots": total_slots, "busy": busy}
+
+    return {"pending_jobs": _get_pending_jobs(), "nodes": nodes}
+
+
+def _count_busy_nodes(stream):
+    """
+    Count busy nodes and free slots from the pbsnodes -x output.
+
+    :param stream: file-like object containing the pbsnodes -x XML output
+    :return: a tuple (busy_nodes, free_slots)
+    """
+    busy_nodes = 0
+    free_slots = 0
+    for _, state, total_slots, used_slots, busy in _iter_pbsnodes(stream):
+        if busy:
+            busy_nodes += 1
+        if not _is_node_down(state):
+            free_slots += max(total_slots - used_slots, 0)
+
+    return busy_nodes, free_slots
+
+
+def _iter_pbsnodes(stream):
+    """
+    Parse the pbsnodes -x output incrementally.
+
+    Every Node element is discarded as soon as it has been processed, so memory usage does not depend on the number
+    of nodes in the cluster.
+
+    :param stream: file-like object containing the pbsnodes -x XML output
+    :return: a generator of tuples (name, state, total_slots, used_slots, busy)
+    """
+    context = iter(ElementTree.iterparse(stream, events=("start", "end")))
+    # the first event is the start of the root element (i.e. Data)
+    _, root = next(context)
+    for event, element in context:
+        if event != "end" or element.tag != "Node":
+            continue
+
+        jobs = element.find("jobs")
+        yield (
+            element.findtext("name"),
+            element.findtext("state"),
+            int(element.findtext("np") or 0),
+            _count_used_slots(jobs),
+            jobs is not None,
+        )
+        # drop the processed nodes from the tree
+        root.clear()
+
+
+def _is_node_down(state):
+    return str(state).startswith(("down", "offline", "unknown"))
+
+
+def _count_used_slots(jobs):
+    """
+    Count the slots in use from the content of a jobs element.
+
+    :param jobs: jobs element, e.g. <jobs>0/12.master,1/12.master,2-3/13.master</jobs>
+    :return: the number of slots in use
+    """
+    if jobs is None or not jobs.text:
+        return 0
+
+    used_slots = 0
+    for job in jobs.text.split(","):
+        slots = job.strip().split("/")[0]
+        try:
+            first, last = slots.split("-", 1)
+            used_slots += int(last) - int(first) + 1
+        except ValueError:
+            used_slots += 1
+    return used_slots
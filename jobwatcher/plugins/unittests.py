@@ -1,9 +1,26 @@
+import random
 import utils
 import unittest
 
 instance_properties = {'slots': 8}
 
 
+def first_fit_nodes(nodes_requested, slots_requested, vcpus):
+    """Place the jobs one by one scanning all the allocated nodes, as reference for get_optimal_nodes."""
+    slots_remaining_per_node = []
+    for num_of_nodes, slots in zip(nodes_requested, slots_requested):
+        slots_required_per_node = -(-slots // num_of_nodes)
+        if slots_required_per_node > vcpus:
+            num_of_nodes = -(-slots // vcpus)
+            slots_required_per_node = -(-slots // num_of_nodes)
+        for slot_idx, slots_available in enumerate(slots_remaining_per_node):
+            if num_of_nodes > 0 and slots_available >= slots_required_per_node:
+                slots_remaining_per_node[slot_idx] -= slots_required_per_node
+                num_of_nodes -= 1
+        slots_remaining_per_node.extend([vcpus - slots_required_per_node] * num_of_nodes)
+    return len(slots_remaining_per_node)
+
+
 class optimal_node_count_tests(unittest.TestCase):
     def test_empty_lists(self):
         nodes = utils.get_optimal_nodes([], [], instance_properties)
@@ -35,6 +52,117 @@ class optimal_node_count_tests(unittest.TestCase):
         expected = 6
         self.assertEqual(nodes, expected, "test_each_node_partial_capacity failed: Got %s; Expected: %s" % (nodes, expected))
 
+    def test_same_as_first_fit(self):
+        rng = random.Random(42)
+        for vcpus in [1, 2, 8, 36]:
+            for _ in range(25):
+                nodes_requested = []
+                slots_requested = []
+                for _ in range(rng.randint(1, 100)):
+                    # runs of identical jobs, like job arrays
+                    nodes = rng.choice([1, 1, 1, 2, 3])
+                    slots = rng.randint(nodes, 3 * vcpus)
+                    repeat = rng.choice([1, 1, 3, 10])
+                    nodes_requested.extend([nodes] * repeat)
+                    slots_requested.extend([slots] * repeat)
+                nodes = utils.get_optimal_nodes(nodes_requested, slots_requested, {'slots': vcpus})
+                expected = first_fit_nodes(nodes_requested, slots_requested, vcpus)
+                self.assertEqual(nodes, expected)
+
+    def test_pending_jobs_packer(self):
+        rng = random.Random(7)
+        jobs = [(rng.choice([1, 1, 2]), rng.choice([1, 4, 16, 40])) for _ in range(500)]
+        packer = utils.PendingJobsPacker({'slots': 16})
+        for nodes, slots in jobs:
+            packer.add(nodes, slots)
+        expected = first_fit_nodes([job[0] for job in jobs], [job[1] for job in jobs], 16)
+        self.assertEqual(packer.get_required_nodes(), expected)
+        self.assertEqual(packer.jobs, len(jobs))
+
+    def test_job_arrays(self):
+        rng = random.Random(3)
+        arrays = [(rng.choice([1, 1, 2]), rng.choice([1, 4, 16, 40]), rng.randint(1, 500)) for _ in range(50)]
+        aggregated = utils.PendingJobsPacker({'slots': 16})
+        expanded = utils.PendingJobsPacker({'slots': 16})
+        for nodes, slots, tasks in arrays:
+            aggregated.add(nodes, slots, tasks)
+            for _ in range(tasks):
+                expanded.add(nodes, slots)
+        self.assertEqual(aggregated.get_required_nodes(), expanded.get_required_nodes())
+
+    def test_max_nodes(self):
+        pending_jobs = [[1, 1, 10 ** 9], [2, 32, 10]]
+        self.assertEqual(utils.get_optimal_nodes_for_pending_jobs(pending_jobs, {'slots': 16}, 100), 100)
+        self.assertEqual(utils.get_optimal_nodes_for_pending_jobs([[2, 32, 10]], {'slots': 16}, 100), 20)
+        self.assertEqual(utils.get_optimal_nodes_for_pending_jobs([[2, 32, 10]], {'slots': 16}, 15), 15)
+
+    def test_count_array_tasks(self):
+        self.assertEqual(utils.count_array_tasks("7"), 1)
+        self.assertEqual(utils.count_array_tasks("1-50000:1"), 50000)
+        self.assertEqual(utils.count_array_tasks("1-10:2,15"), 6)
+        self.assertEqual(utils.count_array_tasks("[4-50000%100]"), 49997)
+        self.assertEqual(utils.count_array_tasks("[1,3,5-7]"), 5)
+
+    def test_free_slots_index(self):
+        free_slots = utils.FreeSlotsIndex()
+        for free in [3, 0, 5, 1, 5, 2]:
+            free_slots.append(free)
+        self.assertEqual(len(free_slots), 6)
+        self.assertEqual(free_slots.find_first(4), 2)
+        self.assertEqual(free_slots.find_first(4, 3), 4)
+        self.assertEqual(free_slots.find_first(6), -1)
+        free_slots[2] = 0
+        self.assertEqual(free_slots.find_first(4), 4)
+        self.assertEqual(free_slots.find_first(1, 5), 5)
+        self.assertEqual(free_slots.find_first(1, 6), -1)
+
+    def test_free_resources_index(self):
+        rng = random.Random(5)
+        free_resources = utils.FreeResourcesIndex(3)
+        nodes = []
+        for _ in range(300):
+            free = (rng.randint(0, 8), rng.randint(0, 4096), rng.randint(0, 2))
+            free_resources.append(free)
+            nodes.append(free)
+        self.assertEqual(free_resources[7], nodes[7])
+        for _ in range(300):
+            required = (rng.randint(0, 8), rng.randint(0, 4096), rng.randint(0, 2))
+            start = rng.randint(0, 310)
+            expected = -1
+            for position in range(start, len(nodes)):
+                if all(free >= req for free, req in zip(nodes[position], required)):
+                    expected = position
+                    break
+            self.assertEqual(free_resources.find_first(required, start), expected)
+
+    def test_resources_packing(self):
+        slots_only = {'slots': 16}
+        resources = {'slots': 16, 'memory': 61440, 'gpus': 0}
+        pending_jobs = [[1, 4, 8], [2, 24, 3], [1, 16, 1]]
+        self.assertEqual(
+            utils.get_optimal_nodes_for_pending_jobs(pending_jobs, resources),
+            utils.get_optimal_nodes_for_pending_jobs(pending_jobs, slots_only),
+        )
+        # 4 slots each would fit 4 jobs per node, the memory only 2
+        self.assertEqual(utils.get_optimal_nodes_for_pending_jobs([[1, 4, 8]], slots_only), 2)
+        self.assertEqual(utils.get_optimal_nodes_for_pending_jobs([[1, 4, 8, 30000, 0, False]], resources), 4)
+        self.assertEqual(utils.get_optimal_nodes_for_pending_jobs([[1, 4, 8, 30000, 0, False]], slots_only), 2)
+        # exclusive jobs get whole nodes
+        self.assertEqual(utils.get_optimal_nodes_for_pending_jobs([[1, 1, 5, 0, 0, True], [1, 1, 5]], resources), 6)
+        # jobs requesting more than a node has are not placed
+        self.assertEqual(utils.get_optimal_nodes_for_pending_jobs([[1, 1, 5, 0, 1, False], [1, 1, 5]], resources), 1)
+        gpu_node = {'slots': 4, 'memory': 4096, 'gpus': 4}
+        self.assertEqual(utils.get_optimal_nodes_for_pending_jobs([[2, 8, 10, 1024, 1, False]], gpu_node), 20)
+
+    def test_add_pending_job(self):
+        pending_jobs = []
+        utils.add_pending_job(pending_jobs, 1, 2)
+        utils.add_pending_job(pending_jobs, 1, 2, 3)
+        utils.add_pending_job(pending_jobs, 1, 2, memory=1024)
+        utils.add_pending_job(pending_jobs, 1, 2, memory=1024)
+        utils.add_pending_job(pending_jobs, 1, 2, exclusive=True)
+        self.assertEqual(pending_jobs, [[1, 2, 4], [1, 2, 2, 1024, 0, False], [1, 2, 1, 0, 0, True]])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -12,36 +12,476 @@ def get_optimal_nodes(nodes_requested, slots_requested, instance_properties):
     :param instance_properties: instance properties, i.e. number of slots available per node
     :return: The optimal number of nodes required to satisfy the input queue.
     """
-    vcpus = instance_properties.get('slots')
-    slots_remaining_per_node = []
-
-    for node_idx, num_of_nodes in enumerate(nodes_requested):
-        log.info("Requested %s nodes and %s slots" % (num_of_nodes, slots_requested[node_idx]))
-        # For simplicity, uniformly distribute the numbers of cpus requested across all the requested nodes
-        slots_required_per_node = -(-slots_requested[node_idx] // num_of_nodes)
-
-        if slots_required_per_node > vcpus:
-            # If slots required per node is greater than vcpus, add additional nodes
-            # and recalculate slots_required_per_node
-            log.info("Slots required per node is greater than vcpus, recalculating")
-            num_of_nodes = -(-slots_requested[node_idx] // vcpus)
-            slots_required_per_node = -(-slots_requested[node_idx] // num_of_nodes)
-            log.info("Recalculated: %s nodes and %s slots required per node" % (num_of_nodes, slots_required_per_node))
-
-        # Verify if there are enough available slots in the nodes allocated in the previous rounds
-        for slot_idx, slots_available in enumerate(slots_remaining_per_node):
-            if num_of_nodes > 0 and slots_available >= slots_required_per_node:
-                log.info("Slot available in existing node")
-                # The node represented by slot_idx can be used to run this job
-                slots_remaining_per_node[slot_idx] -= slots_required_per_node
-                num_of_nodes -= 1
-
-        log.info("After looking at already allocated nodes, %s more nodes are needed" % num_of_nodes)
-
-        # Since the number of available slots were unable to run this job entirely, only add the necessary nodes.
-        for i in range(num_of_nodes):
-            log.info("Adding node. Using %s slots" % slots_required_per_node)
-            slots_remaining_per_node.append(vcpus - slots_required_per_node)
-
-    # return the number of nodes added
-    return len(slots_remaining_per_node)
+    pending_jobs = []
+    for nodes, slots in zip(nodes_requested, slots_requested):
+        add_pending_job(pending_jobs, nodes, slots)
+
+    return get_optimal_nodes_for_pending_jobs(pending_jobs, instance_properties)
+
+
+def add_pending_job(pending_jobs, nodes, slots, count=1, memory=0, gpus=0, exclusive=False):
+    """
+    Append jobs to the given list of pending jobs, merging them with the previous jobs if identical.
+
+    :param pending_jobs: list of [nodes, slots, count] in submission order, followed by [memory, gpus, exclusive]
+                         for the jobs requesting other resources
+    :param nodes: number of nodes requested by every job
+    :param slots: number of slots requested by every job
+    :param count: number of jobs, e.g. the tasks of a job array
+    :param memory: memory per node requested by every job, in MiB
+    :param gpus: GPUs per node requested by every job
+    :param exclusive: True if every job requires whole nodes
+    """
+    resources = [memory, gpus, exclusive] if memory or gpus or exclusive else []
+    if pending_jobs and pending_jobs[-1][0] == nodes and pending_jobs[-1][1] == slots:
+        if pending_jobs[-1][3:] == resources:
+            pending_jobs[-1][2] += count
+            return
+    pending_jobs.append([nodes, slots, count] + resources)
+
+
+def count_array_tasks(task_ids):
+    """
+    Count the tasks of a job array from the scheduler compressed notation of their ids.
+
+    :param task_ids: task ids, e.g. 1-10:2,15 or with the Slurm brackets and throttle limit [1-10:2,15%4]
+    :return: the number of tasks
+    """
+    count = 0
+    for task_range in task_ids.strip("[]").split("%")[0].split(","):
+        bounds, _, step = task_range.partition(":")
+        first, _, last = bounds.partition("-")
+        count += (int(last or first) - int(first)) // int(step or 1) + 1
+    return count
+
+
+def get_optimal_nodes_for_pending_jobs(pending_jobs, instance_properties, max_nodes=None):
+    """
+    Get the optimal number of nodes required to satisfy the given pending jobs.
+
+    Every job is placed first-fit: each of its nodes goes to a different node among the ones allocated by the
+    previous jobs, the leftmost ones with enough free slots, and new nodes are allocated for the rest.
+    Consecutive identical single node jobs are placed together, filling one node at a time.
+
+    :param pending_jobs: list of pending jobs in submission order, see add_pending_job
+    :param instance_properties: instance properties, i.e. number of slots available per node
+    :param max_nodes: max number of nodes that can be added, None for no limit
+    :return: The optimal number of nodes required to satisfy the pending jobs, at most max_nodes.
+    """
+    packer = PendingJobsPacker(instance_properties, max_nodes)
+    for job in pending_jobs:
+        packer.add(*job)
+
+    return packer.get_required_nodes()
+
+
+class PendingJobsPacker(object):
+    """
+    Incremental placement of pending jobs, in submission order.
+
+    Jobs can be added while they are read from the scheduler, only the current run of identical jobs and the free
+    slots of the allocated nodes are kept in memory. Once max_nodes nodes are allocated, i.e. the most the cluster can
+    ever scale to, the following jobs are not placed.
+
+    Only slots are packed, unless the instance properties include the memory of the nodes: jobs are then packed by
+    slots, memory and GPUs, and jobs requiring exclusive nodes get whole nodes.
+    """
+
+    def __init__(self, instance_properties, max_nodes=None):
+        """
+        Initialize the packer.
+
+        :param instance_properties: instance properties, i.e. number of slots available per node, and optionally
+                                    memory (MiB) and gpus available per node
+        :param max_nodes: max number of nodes that can be added, None for no limit
+        """
+        self.vcpus = instance_properties.get('slots')
+        self.max_nodes = max_nodes
+        # resources of a node: slots, memory and GPUs, None to pack slots only
+        self.capacity = None
+        if instance_properties.get('memory') is not None:
+            self.capacity = (self.vcpus, instance_properties['memory'], instance_properties.get('gpus', 0))
+            self.free_slots = FreeResourcesIndex(len(self.capacity))
+        else:
+            self.free_slots = FreeSlotsIndex()
+        self.jobs = 0
+        # jobs requesting more resources than a node has, they are never placed
+        self.unschedulable_jobs = 0
+        # [job, count] of the last jobs added, not placed yet
+        self._run = None
+        # checked once, the per-job messages are too many to be even created when not logged
+        self._debug = log.isEnabledFor(logging.DEBUG)
+
+    def add(self, nodes, slots, count=1, memory=0, gpus=0, exclusive=False):
+        """
+        Add pending jobs, merging them with the previous ones if identical.
+
+        :param nodes: number of nodes requested by every job
+        :param slots: number of slots requested by every job
+        :param count: number of jobs, e.g. the tasks of a job array
+        :param memory: memory per node requested by every job, in MiB
+        :param gpus: GPUs per node requested by every job
+        :param exclusive: True if every job requires whole nodes
+        """
+        job = (nodes, slots, memory, gpus, exclusive) if self.capacity else (nodes, slots)
+        run = self._run
+        if run and run[0] == job:
+            run[1] += count
+        else:
+            self._place_run()
+            self._run = [job, count]
+
+    def get_required_nodes(self):
+        """
+        Get the number of nodes required by the jobs added so far.
+
+        :return: the number of nodes added
+        """
+        self._place_run()
+        if self.unschedulable_jobs:
+            log.info("%d jobs request more resources than a node has and cannot run", self.unschedulable_jobs)
+        if self._is_full():
+            log.info("Processed %d jobs, max %d nodes added", self.jobs, len(self.free_slots))
+        else:
+            log.info("Processed %d jobs, %d nodes added", self.jobs, len(self.free_slots))
+        return len(self.free_slots)
+
+    def _is_full(self):
+        return self.max_nodes is not None and len(self.free_slots) >= self.max_nodes
+
+    def _place_run(self):
+        if not self._run:
+            return
+        job, count = self._run
+        nodes, slots = job[:2]
+        self._run = None
+        self.jobs += count
+        if self._is_full():
+            return
+        num_of_nodes, slots_required_per_node = _get_nodes_and_slots_per_node(nodes, slots, self.vcpus)
+        if self._debug:
+            log.debug(
+                "Requested %s nodes and %s slots by %s jobs. Placing %s nodes with %s slots each",
+                nodes,
+                slots,
+                count,
+                num_of_nodes,
+                slots_required_per_node,
+            )
+
+        if self.capacity:
+            self._place_resources(num_of_nodes, (slots_required_per_node,) + job[2:4], job[4], count)
+        elif num_of_nodes == 1:
+            _place_single_node_jobs(self.free_slots, slots_required_per_node, count, self.vcpus, self.max_nodes)
+        else:
+            for _ in range(count):
+                if self._is_full():
+                    break
+                _place_job(self.free_slots, num_of_nodes, slots_required_per_node, self.vcpus, self.max_nodes)
+
+    def _place_resources(self, num_of_nodes, required, exclusive, count):
+        for resource_required, resource_capacity in zip(required, self.capacity):
+            if resource_required > resource_capacity:
+                if self._debug:
+                    log.debug("%s jobs request %s per node, a node has %s", count, required, self.capacity)
+                self.unschedulable_jobs += count
+                return
+
+        if exclusive:
+            required = self.capacity
+        if num_of_nodes == 1:
+            _place_single_node_jobs_resources(self.free_slots, required, count, self.capacity, self.max_nodes)
+        else:
+            for _ in range(count):
+                if self._is_full():
+                    break
+                _place_job_resources(self.free_slots, num_of_nodes, required, self.capacity, self.max_nodes)
+
+
+def _get_nodes_and_slots_per_node(nodes, slots, vcpus):
+    # For simplicity, uniformly distribute the numbers of cpus requested across all the requested nodes
+    slots_required_per_node = -(-slots // nodes)
+
+    if slots_required_per_node > vcpus:
+        # If slots required per node is greater than vcpus, add additional nodes
+        # and recalculate slots_required_per_node
+        nodes = -(-slots // vcpus)
+        slots_required_per_node = -(-slots // nodes)
+
+    return nodes, slots_required_per_node
+
+
+def _place_job(free_slots, num_of_nodes, slots_required_per_node, vcpus, max_nodes=None):
+    # Use the available slots in the nodes allocated by the previous jobs, one node of the job per node
+    position = free_slots.find_first(slots_required_per_node)
+    while num_of_nodes > 0 and position >= 0:
+        free_slots[position] -= slots_required_per_node
+        num_of_nodes -= 1
+        position = free_slots.find_first(slots_required_per_node, position + 1)
+
+    # Only add the nodes needed by the rest of the job
+    _add_nodes(free_slots, num_of_nodes, vcpus - slots_required_per_node, max_nodes)
+
+
+def _place_single_node_jobs(free_slots, slots_required_per_node, count, vcpus, max_nodes=None):
+    # Placing the jobs one by one, every job would go to the leftmost node with enough free slots until full
+    if slots_required_per_node == 0:
+        if len(free_slots) == 0:
+            _add_nodes(free_slots, 1, vcpus, max_nodes)
+        return
+
+    position = free_slots.find_first(slots_required_per_node)
+    while count > 0 and position >= 0:
+        jobs = min(count, free_slots[position] // slots_required_per_node)
+        free_slots[position] -= jobs * slots_required_per_node
+        count -= jobs
+        position = free_slots.find_first(slots_required_per_node, position + 1)
+
+    jobs_per_node = vcpus // slots_required_per_node
+    full_nodes, jobs_in_last_node = divmod(count, jobs_per_node)
+    _add_nodes(free_slots, full_nodes, vcpus - jobs_per_node * slots_required_per_node, max_nodes)
+    if jobs_in_last_node:
+        _add_nodes(free_slots, 1, vcpus - jobs_in_last_node * slots_required_per_node, max_nodes)
+
+
+def _place_job_resources(free_resources, num_of_nodes, required, capacity, max_nodes=None):
+    # Same as _place_job, with vectors of resources
+    position = free_resources.find_first(required)
+    while num_of_nodes > 0 and position >= 0:
+        free_resources[position] = _subtract_resources(free_resources[position], required)
+        num_of_nodes -= 1
+        position = free_resources.find_first(required, position + 1)
+
+    _add_nodes(free_resources, num_of_nodes, _subtract_resources(capacity, required), max_nodes)
+
+
+def _place_single_node_jobs_resources(free_resources, required, count, capacity, max_nodes=None):
+    # Same as _place_single_node_jobs, with vectors of resources
+    if not any(required):
+        if len(free_resources) == 0:
+            _add_nodes(free_resources, 1, capacity, max_nodes)
+        return
+
+    position = free_resources.find_first(required)
+    while count > 0 and position >= 0:
+        free = free_resources[position]
+        jobs = min(count, _count_fitting_jobs(free, required))
+        free_resources[position] = _subtract_resources(free, required, jobs)
+        count -= jobs
+        position = free_resources.find_first(required, position + 1)
+
+    jobs_per_node = _count_fitting_jobs(capacity, required)
+    full_nodes, jobs_in_last_node = divmod(count, jobs_per_node)
+    _add_nodes(free_resources, full_nodes, _subtract_resources(capacity, required, jobs_per_node), max_nodes)
+    if jobs_in_last_node:
+        _add_nodes(free_resources, 1, _subtract_resources(capacity, required, jobs_in_last_node), max_nodes)
+
+
+def _count_fitting_jobs(free, required):
+    return min([resource_free // resource_required for resource_free, resource_required in zip(free, required)
+                if resource_required > 0])
+
+
+def _subtract_resources(free, required, jobs=1):
+    return tuple([resource_free - resource_required * jobs for resource_free, resource_required in zip(free, required)])
+
+
+def _add_nodes(free_slots, num_of_nodes, free, max_nodes):
+    # Nodes beyond max_nodes could never be added, the tasks of a large job array would only waste time and memory
+    if max_nodes is not None:
+        num_of_nodes = min(num_of_nodes, max_nodes - len(free_slots))
+    for _ in range(num_of_nodes):
+        free_slots.append(free)
+
+
+class FreeSlotsIndex(object):
+    """
+    Free slots of the allocated nodes, in allocation order.
+
+    A segment tree keeps the maximum free slots of every range of nodes, so that the leftmost node with at least
+    the given free slots is found in O(log n).
+    """
+
+    def __init__(self):
+        self._length = 0
+        self._capacity = 1
+        # tree[1] is the root, the leaves start at capacity. Leaves of nodes not allocated are -1
+        self._tree = [-1, -1]
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, position):
+        return self._tree[self._capacity + position]
+
+    def __setitem__(self, position, free):
+        tree = self._tree
+        index = self._capacity + position
+        tree[index] = free
+        index >>= 1
+        while index:
+            left = tree[2 * index]
+            right = tree[2 * index + 1]
+            tree[index] = left if left > right else right
+            index >>= 1
+
+    def append(self, free):
+        """
+        Add a node.
+
+        :param free: free slots of the node
+        """
+        if self._length == self._capacity:
+            self._grow()
+        self._length += 1
+        self[self._length - 1] = free
+
+    def find_first(self, required, start=0):
+        """
+        Find the leftmost node with at least the given free slots.
+
+        :param required: free slots required
+        :param start: position of the first node to consider
+        :return: the position of the node, -1 if not found
+        """
+        if start >= self._length:
+            return -1
+        tree = self._tree
+        index = self._capacity + start
+        # move right to the first subtree containing a node with enough free slots
+        while tree[index] < required:
+            while index & 1:
+                index >>= 1
+            if index == 0:
+                return -1
+            index += 1
+        # descend to its leftmost node with enough free slots
+        while index < self._capacity:
+            index <<= 1
+            if tree[index] < required:
+                index += 1
+        return index - self._capacity
+
+    def _grow(self):
+        leaves = self._tree[self._capacity:self._capacity + self._length]
+        self._capacity *= 2
+        self._tree = [-1] * (2 * self._capacity)
+        self._tree[self._capacity:self._capacity + self._length] = leaves
+        for index in range(self._capacity - 1, 0, -1):
+            left = self._tree[2 * index]
+            right = self._tree[2 * index + 1]
+            self._tree[index] = left if left > right else right
+
+
+class FreeResourcesIndex(object):
+    """
+    Free resources of the allocated nodes, e.g. (slots, memory, GPUs), in allocation order.
+
+    Multi-dimensional version of FreeSlotsIndex: a segment tree per resource keeps the maximum free amount of every
+    range of nodes. A range is searched only if it has enough of every resource, e.g. a node with enough slots and
+    a node with enough memory, so the leftmost node with all the required resources is usually found without
+    visiting the nodes missing one of them.
+    """
+
+    def __init__(self, resources):
+        """
+        Initialize the index.
+
+        :param resources: number of resources of every node
+        """
+        self._length = 0
+        self._capacity = 1
+        # one tree per resource, like FreeSlotsIndex
+        self._trees = [[-1, -1] for _ in range(resources)]
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, position):
+        index = self._capacity + position
+        return tuple([tree[index] for tree in self._trees])
+
+    def __setitem__(self, position, free):
+        for tree, resource_free in zip(self._trees, free):
+            index = self._capacity + position
+            tree[index] = resource_free
+            index >>= 1
+            while index:
+                left = tree[2 * index]
+                right = tree[2 * index + 1]
+                tree[index] = left if left > right else right
+                index >>= 1
+
+    def append(self, free):
+        """
+        Add a node.
+
+        :param free: free resources of the node
+        """
+        if self._length == self._capacity:
+            self._grow()
+        self._length += 1
+        self[self._length - 1] = free
+
+    def find_first(self, required, start=0):
+        """
+        Find the leftmost node with at least the given free resources.
+
+        :param required: free resources required
+        :param start: position of the first node to consider
+        :return: the position of the node, -1 if not found
+        """
+        if start >= self._length:
+            return -1
+        index = self._capacity + start
+        if self._has_resources(index, required):
+            return start
+        # search the subtrees right of the start node, from the nearest one
+        while index > 1:
+            if not index & 1:
+                position = self._find_first_in_subtree(index + 1, required)
+                if position >= 0:
+                    return position
+            index >>= 1
+        return -1
+
+    def _find_first_in_subtree(self, root, required):
+        # depth first, left subtrees first, skipping the subtrees missing any of the resources
+        stack = [root]
+        while stack:
+            index = stack.pop()
+            if not self._has_resources(index, required):
+                continue
+            if index >= self._capacity:
+                return index - self._capacity
+            stack.append(2 * index + 1)
+            stack.append(2 * index)
+        return -1
+
+    def _has_resources(self, index, required):
+        for tree, resource_required in zip(self._trees, required):
+            if tree[index] < resource_required:
+                return False
+        return True
+
+    def _grow(self):
+        for resource, tree in enumerate(self._trees):
+            leaves = tree[self._capacity:self._capacity + self._length]
+            tree = [-1] * (4 * self._capacity)
+            tree[2 * self._capacity:2 * self._capacity + self._length] = leaves
+            for index in range(2 * self._capacity - 1, 0, -1):
+                left = tree[2 * index]
+                right = tree[2 * index + 1]
+                tree[index] = left if left > right else right
+            self._trees[resource] = tree
+        self._capacity *= 2
+
+
+def count_busy_nodes(snapshot):
+    """
+    Count the nodes marked as busy in the given cluster snapshot.
+
+    :param snapshot: cluster snapshot, see common.snapshot.SnapshotPublisher
+    :return: the number of busy nodes
+    """
+    return len([node for node in snapshot["nodes"].values() if node["busy"]])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the
+# License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+import jobwatcher.jobwatcher as jobwatcher
+import sqswatcher.sqswatcher as sqswatcher
+from common import clock
+from common.config_reload import install_reload_handler
+from common.diagnostics import install_diagnostics_handlers
+
+log = logging.getLogger(__name__)
+
+# daemons hosted by the masterwatcher, as (name, main function, seconds to wait before a restart)
+DAEMONS = [
+    ("sqswatcher", sqswatcher.main, 30),
+    ("jobwatcher", jobwatcher.main, 60),
+]
+
+
+def _run_daemon(name, daemon_main, restart_wait):
+    """
+    Run the given daemon main function forever.
+
+    Every daemon main already restarts itself on exceptions. This is a last resort in case it ever returns.
+
+    :param name: daemon name
+    :param daemon_main: daemon main function
+    :param restart_wait: seconds to wait before restarting the daemon
+    """
+    while True:
+        try:
+            daemon_main()
+            log.error("%s loop exited, restarting it", name)
+        except BaseException as e:
+            log.critical("%s loop failed with exception %s, restarting it", name, e)
+        clock.sleep(restart_wait)
+
+
+def main():
+    """
+    Run sqswatcher and jobwatcher in a single process, one thread per daemon polling loop.
+
+    AWS clients, the ASG settings cache, the command executor and the SSH executor are shared by the daemons,
+    while a failure of a loop only restarts that loop.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(module)s:%(funcName)s] %(message)s")
+    log.info("masterwatcher startup")
+    # the daemon loops run in other threads and cannot install the signal handlers
+    install_diagnostics_handlers("masterwatcher")
+    install_reload_handler()
+
+    threads = []
+    for name, daemon_main, restart_wait in DAEMONS:
+        thread = threading.Thread(target=_run_daemon, args=(name, daemon_main, restart_wait), name=name)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    # keep the main thread responsive to signals
+    while any(thread.is_alive() for thread in threads):
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
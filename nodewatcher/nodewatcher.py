@@ -17,24 +17,64 @@ import collections
 import json
 import logging
 import os
-import time
 import urllib2
 
-import boto3
-from botocore.config import Config
-from botocore.exceptions import ClientError
-from retrying import retry
-
-from common.utils import CriticalError, get_asg_name, load_module
+from common import clock
+from common.commands import get_command_executor
+from common.config_reload import get_config_reloader, install_reload_handler
+from common.diagnostics import diagnostics_checkpoint, install_diagnostics_handlers
+from common.health import get_health_monitor
+from common.log_utils import configure_log_rate_limit, end_log_cycle
+from common.metrics import configure_metrics, get_registry, publish_metrics
+from common.retry import retry
+from common.state import WarmState
+from common.timing import StartupTimer
+from common.tracing import configure_tracing, root_span
+from common.utils import (
+    CriticalError,
+    get_asg_name,
+    get_asg_settings_cache,
+    get_boto3_client,
+    get_proxy_config,
+    load_module,
+)
 
 log = logging.getLogger(__name__)
 
+CONFIG_FILE = "/etc/nodewatcher.cfg"
+
+# options applied on reload, mapped to the config fields
+LIVE_OPTIONS = {
+    "scaledown_idletime": "scaledown_idletime",
+    "proxy": "proxy_config",
+    "asg_settings_ttl": "asg_settings_ttl",
+    "watchdog_max_lag": "watchdog_max_lag",
+}
+
+metrics = get_registry()
+IDLE_MINUTES = metrics.gauge("nodewatcher_idle_minutes", "Minutes since the instance last ran a job")
+SCHEDULER_QUERY_SECONDS = metrics.histogram(
+    "nodewatcher_scheduler_query_seconds", "Time spent querying the scheduler for running and pending jobs"
+)
+
 DATA_DIR = "/var/run/nodewatcher/"
 IDLETIME_FILE = DATA_DIR + "node_idletime.json"
 
 
+# nodes query the ASG every minute, the cache is refreshed anyway before self terminating
+DEFAULT_ASG_SETTINGS_TTL = 300
+
 NodewatcherConfig = collections.namedtuple(
-    "NodewatcherConfig", ["region", "scheduler", "stack_name", "scaledown_idletime", "proxy_config"]
+    "NodewatcherConfig",
+    [
+        "region",
+        "scheduler",
+        "stack_name",
+        "scaledown_idletime",
+        "proxy_config",
+        "asg_settings_ttl",
+        "watchdog_max_lag",
+    ],
 )
 
 
@@ -44,30 +84,40 @@ def _get_config():
 
     :return: configuration parameters
     """
-    config_file = "/etc/nodewatcher.cfg"
-    log.info("Reading %s", config_file)
+    log.info("Reading %s", CONFIG_FILE)
 
     config = ConfigParser.RawConfigParser()
-    config.read(config_file)
+    config.read(CONFIG_FILE)
     if config.has_option("nodewatcher", "loglevel"):
         lvl = logging._levelNames[config.get("nodewatcher", "loglevel")]
         logging.getLogger().setLevel(lvl)
+    configure_log_rate_limit(config, "nodewatcher")
+    configure_metrics(config, "nodewatcher")
+    configure_tracing(config, "nodewatcher")
 
     region = config.get("nodewatcher", "region")
     scheduler = config.get("nodewatcher", "scheduler")
     stack_name = config.get("nodewatcher", "stack_name")
     scaledown_idletime = int(config.get("nodewatcher", "scaledown_idletime"))
+    asg_settings_ttl = DEFAULT_ASG_SETTINGS_TTL
+    if config.has_option("nodewatcher", "asg_settings_ttl"):
+        asg_settings_ttl = int(config.get("nodewatcher", "asg_settings_ttl"))
+    # 0 disables the watchdog
+    watchdog_max_lag = 0
+    if config.has_option("nodewatcher", "watchdog_max_lag"):
+        watchdog_max_lag = int(config.get("nodewatcher", "watchdog_max_lag"))
 
     _proxy = config.get("nodewatcher", "proxy")
-    proxy_config = Config()
-    if _proxy != "NONE":
-        proxy_config = Config(proxies={"https": _proxy})
+    proxy_config = get_proxy_config(_proxy)
 
     log.info(
-        "Configured parameters: region=%s scheduler=%s stack_name=%s scaledown_idletime=%s proxy=%s",
-        region, scheduler, stack_name, scaledown_idletime, _proxy
+        "Configured parameters: region=%s scheduler=%s stack_name=%s scaledown_idletime=%s proxy=%s "
+        "asg_settings_ttl=%s watchdog_max_lag=%s",
+        region, scheduler, stack_name, scaledown_idletime, _proxy, asg_settings_ttl, watchdog_max_lag
+    )
+    return NodewatcherConfig(
+        region, scheduler, stack_name, scaledown_idletime, proxy_config, asg_settings_ttl, watchdog_max_lag
     )
-    return NodewatcherConfig(region, scheduler, stack_name, scaledown_idletime, proxy_config)
 
 
 def _get_metadata(metadata_path):
@@ -96,8 +146,9 @@ def _has_jobs(scheduler_module, hostname):
     :param hostname: host to search for
     :return: true if the given host has running jobs
     """
-    _jobs = scheduler_module.hasJobs(hostname)
-    log.debug("jobs=%s" % _jobs)
+    with SCHEDULER_QUERY_SECONDS.time():
+        _jobs = scheduler_module.hasJobs(hostname)
+    log.debug("jobs=%s", _jobs)
     return _jobs
 
 
@@ -108,8 +159,9 @@ def _has_pending_jobs(scheduler_module):
     :param scheduler_module: scheduler specific module to use
     :return: true if there are pending jobs and the error code
     """
-    _has_pending_jobs, _error = scheduler_module.hasPendingJobs()
-    log.debug("has_pending_jobs=%s, error=%s" % (_has_pending_jobs, _error))
+    with SCHEDULER_QUERY_SECONDS.time():
+        _has_pending_jobs, _error = scheduler_module.hasPendingJobs()
+    log.debug("has_pending_jobs=%s, error=%s", _has_pending_jobs, _error)
     return _has_pending_jobs, _error
 
 
@@ -121,36 +173,36 @@ def _lock_host(scheduler_module, hostname, unlock=False):
     :param hostname: host to lock
     :param unlock: False to lock the host, True to unlock
     """
-    log.debug("%s %s" % (unlock and "unlocking" or "locking", hostname))
+    log.debug("%s %s", unlock and "unlocking" or "locking", hostname)
     scheduler_module.lockHost(hostname, unlock)
-    time.sleep(15)  # allow for some settling
+    clock.sleep(15)  # allow for some settling
 
 
-def _self_terminate(asg_name, asg_client, instance_id):
+def _self_terminate(asg_settings, asg_client, instance_id):
     """
     Terminate the given instance and decrease ASG desired capacity.
 
-    :param asg_name: ASG name
+    :param asg_settings: AsgSettingsCache object
     :param asg_client: ASG boto3 client
     :param instance_id: the instnace to terminate
     """
-    if not _maintain_size(asg_name, asg_client):
-        log.info("Self terminating %s" % instance_id)
+    # never take the termination decision on cached settings
+    asg_settings.invalidate()
+    if not _maintain_size(asg_settings):
+        log.info("Self terminating %s", instance_id)
         asg_client.terminate_instance_in_auto_scaling_group(InstanceId=instance_id, ShouldDecrementDesiredCapacity=True)
+        asg_settings.invalidate()
 
 
-def _maintain_size(asg_name, asg_client):
+def _maintain_size(asg_settings):
     """
     Verify if the desired capacity is lower than the configured min size.
     
-    :param asg_name: the ASG to query for
-    :param asg_client: ASG boto3 client
+    :param asg_settings: AsgSettingsCache object
     :return: True if the desired capacity is lower than the configured min size.
     """
-    asg = asg_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name]).get('AutoScalingGroups')[0]
-    _capacity = asg.get('DesiredCapacity')
-    _min_size = asg.get('MinSize')
-    log.info("DesiredCapacity is %d, MinSize is %d" % (_capacity, _min_size))
+    _min_size, _capacity, _ = asg_settings.get()
+    log.info("DesiredCapacity is %d, MinSize is %d", _capacity, _min_size)
     if _capacity > _min_size:
         log.debug('Capacity greater than min size.')
         return False
@@ -168,8 +220,8 @@ def _is_stack_ready(stack_name, region, proxy_config):
     :param proxy_config: Proxy configuration
     :return: true if the stack is in the *_COMPLETE status
     """
-    log.info('Checking for status of the stack %s' % stack_name)
-    cfn_client = boto3.client('cloudformation', region_name=region, config=proxy_config)
+    log.info('Checking for status of the stack %s', stack_name)
+    cfn_client = get_boto3_client('cloudformation', region, proxy_config)
     stacks = cfn_client.describe_stacks(StackName=stack_name)
     return stacks['Stacks'][0]['StackStatus'] in ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE']
 
@@ -220,86 +272,151 @@ def _init_idletime():
     return idletime
 
 
-def _poll_instance_status(config, scheduler_module, asg_name, hostname, instance_id):
+def _poll_instance_status(
+    config, scheduler_module, asg_name, hostname, instance_id, startup_timer=None, config_reloader=None, warm_state=None
+):
     """
     Verify instance/scheduler status and self-terminate the instance.
 
     The instance will be terminate if not required and exceeded the configured scaledown_idletime.
+    The idle time is the time elapsed between the checks finding the instance without jobs.
     :param config: NodewatcherConfig object
     :param scheduler_module: scheduler module
     :param asg_name: ASG name
     :param hostname: current hostname
     :param instance_id: current instance id
+    :param startup_timer: StartupTimer object to complete at the end of the first iteration
+    :param config_reloader: ConfigReloader object applying the requested config reloads between iterations
+    :param warm_state: WarmState object the discovered facts come from, the stack readiness is saved to it
     """
+    from botocore.exceptions import ClientError
+
     idletime = _init_idletime()
-    stack_ready = False
+    asg_settings = get_asg_settings_cache(config.region, config.proxy_config, asg_name, log, config.asg_settings_ttl)
+    stack_ready = warm_state.get("stack_ready", False) if warm_state else False
+    # a restarted daemon does not wait for the stack again
+    next_wait = 0 if stack_ready else 60
     termination_in_progress = False
+    health = get_health_monitor("nodewatcher", 60, config.watchdog_max_lag)
+    last_check = clock.now()
+    first_iteration = True
     while True:
+        if startup_timer and not first_iteration:
+            # the first iteration completed, whatever the stack state
+            startup_timer.complete("first_iteration")
         # if this node is terminating sleep for a long time and wait for termination
         if termination_in_progress:
-            time.sleep(300)
+            health.wait(300, "terminating")
+            clock.sleep(300)
             log.info("Instance is still terminating")
             continue
-        time.sleep(60)
-        if not stack_ready:
-            stack_ready = _is_stack_ready(config.stack_name, config.region, config.proxy_config)
-            log.info("Stack %s ready: %s" % (config.stack_name, stack_ready))
-            continue
-        asg_conn = boto3.client("autoscaling", region_name=config.region, config=config.proxy_config)
-
-        has_jobs = _has_jobs(scheduler_module, hostname)
-        if has_jobs:
-            log.info("Instance has active jobs.")
-            idletime = 0
-        else:
-            if _maintain_size(asg_name, asg_conn):
+        # the previous iteration, if any, completed
+        health.end_iteration(next_wait)
+        clock.sleep(next_wait)
+        # a jump of the system clock, e.g. an NTP step at boot, must not count as idle time
+        max_elapsed = 2 * next_wait
+        next_wait = 60
+        if config_reloader:
+            new_config = config_reloader.reload(config)
+            if new_config is not config:
+                config = new_config
+                asg_settings = get_asg_settings_cache(
+                    config.region, config.proxy_config, asg_name, log, config.asg_settings_ttl
+                )
+                health.set_watchdog(config.watchdog_max_lag)
+        if warm_state:
+            warm_state.check()
+        health.start_iteration()
+        get_command_executor().log_stats(log)
+        end_log_cycle(log)
+        diagnostics_checkpoint()
+        publish_metrics()
+        if startup_timer and first_iteration:
+            startup_timer.mark("initial_wait")
+        first_iteration = False
+        now = clock.now()
+        elapsed_minutes = min(max(now - last_check, 0), max_elapsed) / 60.0
+        last_check = now
+        with root_span("nodewatcher iteration") as iteration_span:
+            if not stack_ready:
+                stack_ready = _is_stack_ready(config.stack_name, config.region, config.proxy_config)
+                log.info("Stack %s ready: %s", config.stack_name, stack_ready)
+                if stack_ready and warm_state:
+                    warm_state.set("stack_ready", True)
                 continue
+            asg_conn = get_boto3_client("autoscaling", config.region, config.proxy_config)
+
+            health.set_phase("scheduler_query")
+            has_jobs = _has_jobs(scheduler_module, hostname)
+            iteration_span.set_attribute("has_jobs", has_jobs)
+            if has_jobs:
+                log.info("Instance has active jobs.")
+                idletime = 0
+                IDLE_MINUTES.set(idletime)
             else:
-                idletime += 1
-                log.info("Instance had no job for the past %s minute(s)", idletime)
-                _store_idletime(idletime)
-
-                if idletime >= config.scaledown_idletime:
-                    has_pending_jobs, error = _has_pending_jobs(scheduler_module)
-                    if error:
-                        log.info("Encountered an error while polling queue for pending jobs. "
-                                 "Not terminating instance")
-                    elif has_pending_jobs:
-                        log.info("Queue has pending jobs. Not terminating instance")
-                        continue
-
-                    _lock_host(scheduler_module, hostname)
-                    has_jobs = _has_jobs(scheduler_module, hostname)
-                    if has_jobs:
-                        log.info("Instance has active jobs.")
-                        idletime = 0
-                        _lock_host(scheduler_module, hostname, unlock=True)
-                        continue
-
-                    try:
-                        _self_terminate(asg_name, asg_conn, instance_id)
-                        termination_in_progress = True
-                    except ClientError as ex:
-                        log.error("Failed to terminate instance with exception %s" % ex)
-                        termination_in_progress = False
-                        _lock_host(scheduler_module, hostname, unlock=True)
-
-
-@retry(wait_fixed=60000)
+                if _maintain_size(asg_settings):
+                    continue
+                else:
+                    idletime += elapsed_minutes
+                    log.info("Instance had no job for the past %.1f minute(s)", idletime)
+                    _store_idletime(idletime)
+                    IDLE_MINUTES.set(idletime)
+                    iteration_span.set_attribute("idle_minutes", idletime)
+
+                    if idletime >= config.scaledown_idletime:
+                        has_pending_jobs, error = _has_pending_jobs(scheduler_module)
+                        if error:
+                            log.info("Encountered an error while polling queue for pending jobs. "
+                                     "Not terminating instance")
+                        elif has_pending_jobs:
+                            log.info("Queue has pending jobs. Not terminating instance")
+                            continue
+
+                        health.set_phase("self_termination")
+                        _lock_host(scheduler_module, hostname)
+                        has_jobs = _has_jobs(scheduler_module, hostname)
+                        if has_jobs:
+                            log.info("Instance has active jobs.")
+                            idletime = 0
+                            IDLE_MINUTES.set(idletime)
+                            _lock_host(scheduler_module, hostname, unlock=True)
+                            continue
+
+                        try:
+                            _self_terminate(asg_settings, asg_conn, instance_id)
+                            termination_in_progress = True
+                        except ClientError as ex:
+                            log.error("Failed to terminate instance with exception %s", ex)
+                            termination_in_progress = False
+                            _lock_host(scheduler_module, hostname, unlock=True)
+
+
+@retry(base_delay=60, max_delay=240)
 def main():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(module)s:%(funcName)s] %(message)s")
     log.info("nodewatcher startup")
+    install_diagnostics_handlers("nodewatcher", DATA_DIR + "diagnostics/")
+    install_reload_handler()
+    startup_timer = StartupTimer("nodewatcher", log)
     try:
         config = _get_config()
+        startup_timer.mark("config")
 
         scheduler_module = load_module("nodewatcher.plugins." + config.scheduler)
 
-        instance_id = _get_metadata("instance-id")
-        hostname = _get_metadata("local-hostname")
+        warm_state = WarmState("nodewatcher", {"region": config.region, "stack_name": config.stack_name}, DATA_DIR)
+        instance_id = warm_state.discover("instance_id", lambda: _get_metadata("instance-id"))
+        hostname = warm_state.discover("hostname", lambda: _get_metadata("local-hostname"))
         log.info("Instance id is %s, hostname is %s", instance_id, hostname)
-        asg_name = get_asg_name(config.stack_name, config.region, config.proxy_config, log)
+        asg_name = warm_state.discover(
+            "asg_name", lambda: get_asg_name(config.stack_name, config.region, config.proxy_config, log)
+        )
+        startup_timer.mark("aws_discovery")
 
-        _poll_instance_status(config, scheduler_module, asg_name, hostname, instance_id)
+        config_reloader = get_config_reloader("nodewatcher", CONFIG_FILE, _get_config, LIVE_OPTIONS)
+        _poll_instance_status(
+            config, scheduler_module, asg_name, hostname, instance_id, startup_timer, config_reloader, warm_state
+        )
     except Exception as e:
         log.critical("An unexpected error occurred: %s", e)
         raise
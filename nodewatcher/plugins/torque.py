@@ -43,7 +43,7 @@ def hasJobs(hostname):
         status, output = runPipe(commands)
         has_jobs = output != ""
     except subprocess.CalledProcessError:
-        log.error("Failed to run %s\n" % commands)
+        log.error("Failed to run %s\n", commands)
         has_jobs = False
 
     return has_jobs
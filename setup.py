@@ -26,9 +26,11 @@ console_scripts = [
     'sqswatcher = sqswatcher.sqswatcher:main',
     'nodewatcher = nodewatcher.nodewatcher:main',
     'jobwatcher = jobwatcher.jobwatcher:main',
+    'masterwatcher = masterwatcher.masterwatcher:main',
+    'watcherstatus = common.health:main',
 ]
 version = "2.3.1"
-requires = ['boto3>=1.7.55', 'python-dateutil>=2.6.1', 'retrying>=1.3.3', 'future>=0.17.1']
+requires = ['boto3>=1.7.55', 'python-dateutil>=2.6.1', 'future>=0.17.1']
 
 if sys.version_info[:2] == (2, 6):
     # For python2.6 we have to require argparse since it
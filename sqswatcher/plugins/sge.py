@@ -11,21 +11,46 @@
 
 import logging
 import os
-import socket
 import subprocess
-import time
 from tempfile import NamedTemporaryFile
 
-import paramiko
-
 import common.sge as sge
+from common.commands import is_command_failure
+from common.retry import SCHEDULER, get_circuit_breaker
 from common.sge import check_sge_command_output, run_sge_command
+from common.ssh import get_ssh_executor
 
 log = logging.getLogger(__name__)
 
 
+def _run_qconf(command):
+    """
+    Execute a qconf command, protected by the scheduler circuit breaker.
+
+    Only the commands that time out or cannot be executed count as failures of the scheduler, a non-zero exit
+    status is expected e.g. for a host not in the queue.
+
+    :param command: command to execute
+    :raise: subprocess.CalledProcessError if the command fails, CircuitOpenError if the breaker is open
+    """
+    with get_circuit_breaker(SCHEDULER).guard(is_command_failure):
+        run_sge_command(command, log)
+
+
+def _check_qconf_output(command):
+    """
+    Execute a qconf command and retrieve its output, protected by the scheduler circuit breaker.
+
+    :param command: command to execute
+    :return: the command output
+    :raise: subprocess.CalledProcessError if the command fails, CircuitOpenError if the breaker is open
+    """
+    with get_circuit_breaker(SCHEDULER).guard(is_command_failure):
+        return check_sge_command_output(command, log)
+
+
 def _is_host_configured(command, hostname):
-    output = check_sge_command_output(command, log)
+    output = _check_qconf_output(command)
     # Expected output
     # ip-172-31-66-16.ec2.internal
     # ip-172-31-74-69.ec2.internal
@@ -33,20 +58,18 @@ def _is_host_configured(command, hostname):
     return True if len(match) > 0 else False
 
 
-def addHost(hostname, cluster_user, slots, max_cluster_size):
-    log.info('Adding %s with %s slots' % (hostname,slots))
-
+def _register_host(hostname):
     # Adding host as administrative host
     try:
         command = ("qconf -ah %s" % hostname)
-        run_sge_command(command, log)
+        _run_qconf(command)
     except subprocess.CalledProcessError:
         log.warning("Unable to add host %s as administrative host", hostname)
 
     # Adding host as submit host
     try:
         command = ("qconf -as %s" % hostname)
-        run_sge_command(command, log)
+        _run_qconf(command)
     except subprocess.CalledProcessError:
         log.warning("Unable to add host %s as submission host", hostname)
 
@@ -71,58 +94,74 @@ report_variables      NONE
         # Add host as an execution host
         try:
             command = ("qconf -Ae %s" % t.name)
-            run_sge_command(command, log)
+            _run_qconf(command)
         except subprocess.CalledProcessError:
             log.warning("Unable to add host %s as execution host", hostname)
 
-    # Connect and start SGE
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    hosts_key_file = os.path.expanduser("~" + cluster_user) + '/.ssh/known_hosts'
-    user_key_file = os.path.expanduser("~" + cluster_user) + '/.ssh/id_rsa'
-    iter = 0
-    connected = False
-    while iter < 3 and connected is False:
-        try:
-            log.info('Connecting to host: %s iter: %d' % (hostname, iter))
-            ssh.connect(hostname, username=cluster_user, key_filename=user_key_file)
-            connected = True
-        except socket.error, e:
-            log.error('Socket error: %s' % e)
-            time.sleep(10 + iter)
-            iter = iter + 1
-            if iter == 3:
-               log.critical("Unable to provision host")
-               return
-    try:
-        ssh.load_host_keys(hosts_key_file)
-    except IOError:
-        ssh._host_keys_filename = None
-        pass
-    ssh.save_host_keys(hosts_key_file)
-    command = (
-        "sudo sh -c \'cd {0} && {0}/inst_sge -noremote -x -auto /opt/parallelcluster/templates/sge/sge_inst.conf\'"
-    ).format(sge.SGE_ROOT)
-    stdin, stdout, stderr = ssh.exec_command(command)
-    while not stdout.channel.exit_status_ready():
-        time.sleep(1)
-    ssh.close()
 
+def _add_host_to_queue(hostname, slots):
     # Add the host to the all.q
     try:
         command = ("qconf -aattr hostgroup hostlist %s @allhosts" % hostname)
-        run_sge_command(command, log)
+        _run_qconf(command)
     except subprocess.CalledProcessError:
         log.warning("Unable to add host %s to all.q", hostname)
 
     # Set the numbers of slots for the host
     try:
         command = ('qconf -aattr queue slots ["%s=%s"] all.q' % (hostname, slots))
-        run_sge_command(command, log)
+        _run_qconf(command)
     except subprocess.CalledProcessError:
         log.warning("Unable to set the number of slots for the host %s", hostname)
 
 
+def _add_hosts(hosts, cluster_user):
+    """
+    Add the given hosts to the cluster.
+
+    The SGE execution daemon is installed on all the hosts at the same time through the shared SSH executor.
+
+    :param hosts: list of Host objects to add
+    :param cluster_user: the user to connect as
+    :return: the list of hostnames that failed
+    """
+    failed = []
+    registered = []
+    for host in hosts:
+        log.info('Adding %s with %s slots', host.hostname, host.slots)
+        try:
+            _register_host(host.hostname)
+            registered.append(host)
+        except Exception as e:
+            log.error("Encountered error when adding host %s: %s", host.hostname, e)
+            failed.append(host.hostname)
+
+    # Connect and start SGE
+    command = (
+        "sudo sh -c \'cd {0} && {0}/inst_sge -noremote -x -auto /opt/parallelcluster/templates/sge/sge_inst.conf\'"
+    ).format(sge.SGE_ROOT)
+    ssh_executor = get_ssh_executor(cluster_user)
+    results = ssh_executor.run([host.hostname for host in registered], command)
+    ssh_executor.flush_host_keys()
+
+    for host in registered:
+        result = results[host.hostname]
+        if result.exit_code is None:
+            log.critical("Unable to provision host %s", host.hostname)
+            continue
+        if not result.success:
+            log.warning("SGE installation on host %s exited with code %s", host.hostname, result.exit_code)
+        log.info("SGE installed on host %s in %.1f seconds", host.hostname, result.duration)
+
+        try:
+            _add_host_to_queue(host.hostname, host.slots)
+        except Exception as e:
+            log.error("Encountered error when adding host %s: %s", host.hostname, e)
+            failed.append(host.hostname)
+
+    return failed
+
+
 def removeHost(hostname, cluster_user, max_cluster_size):
     log.info('Removing %s', hostname)
 
@@ -131,7 +170,7 @@ def removeHost(hostname, cluster_user, max_cluster_size):
     if _is_host_configured(command, hostname):
         # Removing host as administrative host
         command = ("qconf -dh %s" % hostname)
-        run_sge_command(command, log)
+        _run_qconf(command)
     else:
         log.info('Host %s is not administrative host', hostname)
 
@@ -139,7 +178,7 @@ def removeHost(hostname, cluster_user, max_cluster_size):
     # Purge hostname from all.q
     try:
         command = ("qconf -purge queue '*' all.q@%s" % hostname)
-        run_sge_command(command, log)
+        _run_qconf(command)
     except subprocess.CalledProcessError:
         log.warning("Unable to remove host %s from all.q", hostname)
 
@@ -147,7 +186,7 @@ def removeHost(hostname, cluster_user, max_cluster_size):
     # Remove host from @allhosts group
     try:
         command = ("qconf -dattr hostgroup hostlist %s @allhosts" % hostname)
-        run_sge_command(command, log)
+        _run_qconf(command)
     except subprocess.CalledProcessError:
         log.warning("Unable to remove host %s from @allhosts group", hostname)
 
@@ -156,7 +195,7 @@ def removeHost(hostname, cluster_user, max_cluster_size):
     if _is_host_configured(command, hostname):
         # Removing host as execution host
         command = ("qconf -de %s" % hostname)
-        run_sge_command(command, log)
+        _run_qconf(command)
     else:
         log.info('Host %s is not execution host', hostname)
 
@@ -165,7 +204,7 @@ def removeHost(hostname, cluster_user, max_cluster_size):
     if _is_host_configured(command, hostname):
         # Removing host as submission host
         command = ("qconf -ds %s" % hostname)
-        run_sge_command(command, log)
+        _run_qconf(command)
     else:
         log.info('Host %s is not submission host', hostname)
 
@@ -173,12 +212,13 @@ def removeHost(hostname, cluster_user, max_cluster_size):
 def update_cluster(max_cluster_size, cluster_user, update_events):
     failed = []
     succeeded = []
+    hosts_to_add = []
     for event in update_events:
         try:
             if event.action == "REMOVE":
                 removeHost(event.host.hostname, cluster_user, max_cluster_size)
             elif event.action == "ADD":
-                addHost(event.host.hostname, cluster_user, event.host.slots, max_cluster_size)
+                hosts_to_add.append(event.host)
             succeeded.append(event)
         except Exception as e:
             log.error(
@@ -186,4 +226,10 @@ def update_cluster(max_cluster_size, cluster_user, update_events):
             )
             failed.append(event)
 
+    failed_hostnames = _add_hosts(hosts_to_add, cluster_user)
+    for event in list(succeeded):
+        if event.action == "ADD" and event.host.hostname in failed_hostnames:
+            succeeded.remove(event)
+            failed.append(event)
+
     return failed, succeeded
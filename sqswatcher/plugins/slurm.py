@@ -16,14 +16,11 @@
 import logging
 import os
 import os.path
-from math import ceil
-from multiprocessing import Pool
 from shutil import move
 from tempfile import mkstemp
 
-import paramiko
-from retrying import retry
-
+from common.retry import SCHEDULER, circuit_breaker, retry
+from common.ssh import get_ssh_executor
 from common.utils import run_command
 
 log = logging.getLogger(__name__)
@@ -31,23 +28,7 @@ log = logging.getLogger(__name__)
 PCLUSTER_NODES_CONFIG = "/opt/slurm/etc/slurm_parallelcluster_nodes.conf"
 
 
-def _ssh_connect(hostname, cluster_user):
-    log.info("Connecting to host: %s" % (hostname))
-    ssh_client = paramiko.SSHClient()
-    ssh_client.load_system_host_keys()
-    ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    user_key_file = os.path.expanduser("~" + cluster_user) + "/.ssh/id_rsa"
-
-    try:
-        ssh_client.connect(hostname=hostname, username=cluster_user, key_filename=user_key_file)
-    except Exception as e:
-        log.error("Failed when connecting to host %s with error: %s", hostname, e)
-        raise
-
-    return ssh_client
-
-
-@retry(stop_max_attempt_number=3, wait_fixed=10000)
+@retry(attempts=3, base_delay=10, max_delay=30, breaker=SCHEDULER)
 def _restart_master_node():
     log.info("Restarting slurm on master node")
     if os.path.isfile("/etc/systemd/system/slurmctld.service"):
@@ -61,51 +42,33 @@ def _restart_master_node():
         raise
 
 
-@retry(stop_max_attempt_number=3, wait_fixed=10000)
-def _restart_compute_daemons(hostname, cluster_user):
-    log.info("Restarting slurm on compute node %s", hostname)
-    ssh_client = _ssh_connect(hostname, cluster_user)
+def _restart_multiple_compute_nodes(hostnames, cluster_user):
+    if not hostnames:
+        return {}
+
+    log.info("Restarting slurm on compute nodes %s", hostnames)
     command = (
         "if [ -f /etc/systemd/system/slurmd.service ]; "
         "then sudo systemctl restart slurmd.service; "
         'else sudo sh -c "/etc/init.d/slurm restart 2>&1 > /tmp/slurmdstart.log"; fi'
     )
-    stdin, stdout, stderr = ssh_client.exec_command(command, timeout=15)
-    # This blocks until command completes
-    return_code = stdout.channel.recv_exit_status()
-    if return_code != 0:
-        log.error("Failed when restarting slurmd on compute node %s", hostname)
-    ssh_client.close()
+    results = get_ssh_executor(cluster_user).run(hostnames, command, command_timeout=15)
+    for hostname, result in results.items():
+        if result.success:
+            log.debug("Restarted slurmd on compute node %s in %.1f seconds", hostname, result.duration)
+        else:
+            log.error("Failed when restarting slurmd on compute node %s", hostname)
 
-
-def _restart_compute_node_worker(args):
-    hostname = args[0]
-    try:
-        _restart_compute_daemons(*args)
-        return hostname, True
-    except Exception:
-        return hostname, False
-
-
-def _restart_multiple_compute_nodes(hostnames, cluster_user, parallelism=10):
-    if not hostnames:
-        return {}
-
-    pool = Pool(parallelism)
-    try:
-        r = pool.map_async(_restart_compute_node_worker, [(hostname, cluster_user) for hostname in hostnames])
-        results = r.get(timeout=int(ceil(len(hostnames) / float(parallelism)) * 10))
-    finally:
-        pool.terminate()
-
-    return dict(results)
+    # a node is failed only if the command could not be executed on it
+    return dict((hostname, result.exit_code is not None) for hostname, result in results.items())
 
 
 def _reconfigure_nodes():
     log.info("Reconfiguring slurm")
     command = ["/opt/slurm/bin/scontrol", "reconfigure"]
     try:
-        run_command(command, log)
+        with circuit_breaker(SCHEDULER):
+            run_command(command, log)
     except Exception as e:
         log.error("Failed when reconfiguring slurm daemon with exception %s", e)
 
@@ -10,18 +10,36 @@
 # limitations under the License.
 
 import logging
-import os
-import socket
-import time
+import subprocess
 from xml.etree import ElementTree
 
-import paramiko
-
-from common.utils import check_command_output, run_command
+from common import clock
+from common.commands import get_command_executor, is_command_failure
+from common.retry import SCHEDULER, get_circuit_breaker
+from common.ssh import get_ssh_executor
+from common.utils import check_command_output
 
 log = logging.getLogger(__name__)
 
 
+def _run_torque_command(command):
+    """
+    Execute a torque command, protected by the scheduler circuit breaker.
+
+    A failed command is logged as a warning, without raising. Only the commands that time out or cannot be
+    executed count as failures of the scheduler, a non-zero exit status is expected e.g. for a node already added.
+
+    :param command: command to execute
+    :raise CircuitOpenError: if the breaker is open
+    """
+    log.debug("Executing command: %s", command)
+    try:
+        with get_circuit_breaker(SCHEDULER).guard(is_command_failure):
+            get_command_executor().call(command)
+    except subprocess.CalledProcessError as e:
+        log.warning(e)
+
+
 def isHostInitState(host_state):
     # Node states http://docs.adaptivecomputing.com/torque/6-0-2/adminGuide/help.htm#topics/torque/8-resources/resources.htm#nodeStates
     init_states = ("down", "offline", "unknown", str(None))
@@ -48,80 +66,72 @@ def wakeupSchedOn(hostname):
             xmlnode = ElementTree.XML(output)
             host_state = xmlnode.findtext("./Node/state")
         except:
-            log.error("Error parsing XML from %s" % output)
+            log.error("Error parsing XML from %s", output)
 
         if isHostInitState(host_state):
-            log.debug("Host %s is still in state %s" % (hostname, host_state))
-            time.sleep(sleep_time)
+            log.debug("Host %s is still in state %s", hostname, host_state)
+            clock.sleep(sleep_time)
             times -= 1
 
     if host_state == "free":
         command = "/opt/torque/bin/qmgr -c \"set server scheduling=true\""
-        run_command(command, log, raise_on_error=False)
+        _run_torque_command(command)
     elif times == 0:
-        log.error("Host %s is still in state %s" % (hostname, host_state))
+        log.error("Host %s is still in state %s", hostname, host_state)
     else:
-        log.debug("Host %s is in state %s" % (hostname, host_state))
+        log.debug("Host %s is in state %s", hostname, host_state)
 
 
-def addHost(hostname, cluster_user, slots, max_cluster_size):
-    log.info('Adding %s with %s slots' % (hostname, slots))
+def _add_hosts(hosts, cluster_user):
+    """
+    Add the given hosts to the cluster.
 
-    command = ("/opt/torque/bin/qmgr -c 'create node %s np=%s'" % (hostname, slots))
-    run_command(command, log, raise_on_error=False)
+    Host keys of all the new hosts are collected at the same time through the shared SSH executor.
 
-    command = ('/opt/torque/bin/pbsnodes -c %s' % hostname)
-    run_command(command, log, raise_on_error=False)
+    :param hosts: list of Host objects to add
+    :param cluster_user: the user to connect as
+    """
+    for host in hosts:
+        log.info('Adding %s with %s slots', host.hostname, host.slots)
+
+        command = ("/opt/torque/bin/qmgr -c 'create node %s np=%s'" % (host.hostname, host.slots))
+        _run_torque_command(command)
+
+        command = ('/opt/torque/bin/pbsnodes -c %s' % host.hostname)
+        _run_torque_command(command)
 
     # Connect and hostkey
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    hosts_key_file = os.path.expanduser("~" + cluster_user) + '/.ssh/known_hosts'
-    user_key_file = os.path.expanduser("~" + cluster_user) + '/.ssh/id_rsa'
-    iter=0
-    connected=False
-    while iter < 3 and connected == False:
-        try:
-            log.info('Connecting to host: %s iter: %d' % (hostname, iter))
-            ssh.connect(hostname, username=cluster_user, key_filename=user_key_file)
-            connected=True
-        except socket.error, e:
-            log.info('Socket error: %s' % e)
-            time.sleep(10 + iter)
-            iter = iter + 1
-            if iter == 3:
-               log.info("Unable to provison host")
-               return
-    try:
-        ssh.load_host_keys(hosts_key_file)
-    except IOError:
-        ssh._host_keys_filename = None
-        pass
-    ssh.save_host_keys(hosts_key_file)
-    ssh.close()
+    ssh_executor = get_ssh_executor(cluster_user)
+    results = ssh_executor.run([host.hostname for host in hosts], None)
+    ssh_executor.flush_host_keys()
 
-    wakeupSchedOn(hostname)
+    for host in hosts:
+        if results[host.hostname].success:
+            wakeupSchedOn(host.hostname)
+        else:
+            log.info("Unable to provision host %s", host.hostname)
 
 
 def removeHost(hostname, cluster_user, max_cluster_size):
     log.info('Removing %s', hostname)
 
     command = ('/opt/torque/bin/pbsnodes -o %s' % hostname)
-    run_command(command, log, raise_on_error=False)
+    _run_torque_command(command)
 
     command = ("/opt/torque/bin/qmgr -c 'delete node %s'" % hostname)
-    run_command(command, log, raise_on_error=False)
+    _run_torque_command(command)
 
 
 def update_cluster(max_cluster_size, cluster_user, update_events):
     failed = []
     succeeded = []
+    hosts_to_add = []
     for event in update_events:
         try:
             if event.action == "REMOVE":
                 removeHost(event.host.hostname, cluster_user, max_cluster_size)
             elif event.action == "ADD":
-                addHost(event.host.hostname, cluster_user, event.host.slots, max_cluster_size)
+                hosts_to_add.append(event.host)
             succeeded.append(event)
         except Exception as e:
             log.error(
@@ -129,4 +139,11 @@ def update_cluster(max_cluster_size, cluster_user, update_events):
             )
             failed.append(event)
 
+    try:
+        _add_hosts(hosts_to_add, cluster_user)
+    except Exception as e:
+        log.error("Encountered error when adding hosts %s: %s", [host.hostname for host in hosts_to_add], e)
+        failed.extend(event for event in succeeded if event.action == "ADD")
+        succeeded = [event for event in succeeded if event.action != "ADD"]
+
     return failed, succeeded
@@ -19,14 +19,28 @@ import ConfigParser
 import itertools
 import json
 import logging
-import time
 
-import boto3
-from botocore.config import Config
-from botocore.exceptions import ClientError
-from retrying import retry
-
-from common.utils import CriticalError, get_asg_name, get_asg_settings, load_module
+from common import clock
+from common.commands import get_command_executor
+from common.config_reload import get_config_reloader, install_reload_handler
+from common.diagnostics import diagnostics_checkpoint, install_diagnostics_handlers
+from common.health import get_health_monitor
+from common.log_utils import configure_log_rate_limit, end_log_cycle
+from common.metrics import configure_metrics, get_registry, publish_metrics
+from common.retry import DYNAMODB, SQS, circuit_breaker, is_throttling_error, retry
+from common.state import WarmState
+from common.timing import StartupTimer
+from common.tracing import configure_tracing, root_span, span
+from common.utils import (
+    DEFAULT_ASG_SETTINGS_TTL,
+    CriticalError,
+    get_asg_name,
+    get_asg_settings_cache,
+    get_boto3_client,
+    get_boto3_resource,
+    get_proxy_config,
+    load_module,
+)
 
 
 class QueryConfigError(Exception):
@@ -35,10 +49,42 @@ class QueryConfigError(Exception):
 
 log = logging.getLogger(__name__)
 
+CONFIG_FILE = "/etc/sqswatcher.cfg"
+
+# options applied on reload, mapped to the config fields, the queue and the table keep their proxy until restart
+LIVE_OPTIONS = {
+    "cluster_user": "cluster_user",
+    "max_queue_size": "max_queue_size",
+    "asg_settings_ttl": "asg_settings_ttl",
+    "watchdog_max_lag": "watchdog_max_lag",
+}
+
+metrics = get_registry()
+RECEIVE_SECONDS = metrics.histogram("sqswatcher_receive_seconds", "Time spent receiving messages from the SQS queue")
+PARSE_SECONDS = metrics.histogram("sqswatcher_parse_seconds", "Time spent parsing the SQS messages")
+UPDATE_CLUSTER_SECONDS = metrics.histogram(
+    "sqswatcher_update_cluster_seconds", "Time spent adding and removing hosts from the scheduler"
+)
+DYNAMODB_SECONDS = metrics.histogram("sqswatcher_dynamodb_seconds", "Time spent updating the DynamoDB table")
+DELETE_SECONDS = metrics.histogram("sqswatcher_delete_seconds", "Time spent deleting the processed SQS messages")
+MESSAGES_TOTAL = metrics.counter("sqswatcher_messages_total", "SQS messages received")
+FAILED_EVENTS_TOTAL = metrics.counter("sqswatcher_failed_events_total", "Host update events re-queued after a failure")
+
 
 SQSWatcherConfig = collections.namedtuple(
     "SQSWatcherConfig",
-    ["region", "scheduler", "sqsqueue", "table_name", "cluster_user", "proxy_config", "max_queue_size", "stack_name"],
+    [
+        "region",
+        "scheduler",
+        "sqsqueue",
+        "table_name",
+        "cluster_user",
+        "proxy_config",
+        "max_queue_size",
+        "stack_name",
+        "asg_settings_ttl",
+        "watchdog_max_lag",
+    ],
 )
 
 Host = collections.namedtuple("Host", ["instance_id", "hostname", "slots"])
@@ -52,14 +98,16 @@ def _get_config():
 
     :return: the configuration parameters
     """
-    config_file = "/etc/sqswatcher.cfg"
-    log.info("Reading %s", config_file)
+    log.info("Reading %s", CONFIG_FILE)
 
     config = ConfigParser.RawConfigParser()
-    config.read(config_file)
+    config.read(CONFIG_FILE)
     if config.has_option("sqswatcher", "loglevel"):
         lvl = logging._levelNames[config.get("sqswatcher", "loglevel")]
         logging.getLogger().setLevel(lvl)
+    configure_log_rate_limit(config, "sqswatcher")
+    configure_metrics(config, "sqswatcher")
+    configure_tracing(config, "sqswatcher")
 
     region = config.get("sqswatcher", "region")
     scheduler = config.get("sqswatcher", "scheduler")
@@ -68,15 +116,20 @@ def _get_config():
     cluster_user = config.get("sqswatcher", "cluster_user")
     max_queue_size = int(config.get("sqswatcher", "max_queue_size"))
     stack_name = config.get("sqswatcher", "stack_name")
+    asg_settings_ttl = DEFAULT_ASG_SETTINGS_TTL
+    if config.has_option("sqswatcher", "asg_settings_ttl"):
+        asg_settings_ttl = int(config.get("sqswatcher", "asg_settings_ttl"))
+    # 0 disables the watchdog
+    watchdog_max_lag = 0
+    if config.has_option("sqswatcher", "watchdog_max_lag"):
+        watchdog_max_lag = int(config.get("sqswatcher", "watchdog_max_lag"))
 
     _proxy = config.get("sqswatcher", "proxy")
-    proxy_config = Config()
-    if _proxy != "NONE":
-        proxy_config = Config(proxies={"https": _proxy})
+    proxy_config = get_proxy_config(_proxy)
 
     log.info(
         "Configured parameters: region=%s scheduler=%s sqsqueue=%s table_name=%s cluster_user=%s "
-        "proxy=%s max_queue_size=%d stack_name=%s",
+        "proxy=%s max_queue_size=%d stack_name=%s asg_settings_ttl=%d watchdog_max_lag=%d",
         region,
         scheduler,
         sqsqueue,
@@ -85,13 +138,24 @@ def _get_config():
         _proxy,
         max_queue_size,
         stack_name,
+        asg_settings_ttl,
+        watchdog_max_lag,
     )
     return SQSWatcherConfig(
-        region, scheduler, sqsqueue, table_name, cluster_user, proxy_config, max_queue_size, stack_name
+        region,
+        scheduler,
+        sqsqueue,
+        table_name,
+        cluster_user,
+        proxy_config,
+        max_queue_size,
+        stack_name,
+        asg_settings_ttl,
+        watchdog_max_lag,
     )
 
 
-@retry(stop_max_attempt_number=3, wait_fixed=5000)
+@retry(attempts=3, base_delay=5, max_delay=20, breaker=SQS)
 def _get_sqs_queue(region, queue_name, proxy_config):
     """
     Get SQS Queue by queue name.
@@ -101,8 +165,10 @@ def _get_sqs_queue(region, queue_name, proxy_config):
     :param proxy_config: proxy configuration
     :return: the Queue object
     """
+    from botocore.exceptions import ClientError
+
     log.debug("Getting SQS queue '%s'", queue_name)
-    sqs = boto3.resource("sqs", region_name=region, config=proxy_config)
+    sqs = get_boto3_resource("sqs", region, proxy_config)
     try:
         queue = sqs.get_queue_by_name(QueueName=queue_name)
         log.debug("SQS queue is %s", queue)
@@ -114,9 +180,11 @@ def _get_sqs_queue(region, queue_name, proxy_config):
 
 
 @retry(
-    stop_max_attempt_number=3,
-    wait_fixed=5000,
-    retry_on_exception=lambda exception: not isinstance(exception, CriticalError)
+    attempts=3,
+    base_delay=5,
+    max_delay=20,
+    retry_on=lambda exception: not isinstance(exception, CriticalError),
+    breaker=DYNAMODB,
 )
 def _get_ddb_table(region, table_name, proxy_config):
     """
@@ -127,8 +195,10 @@ def _get_ddb_table(region, table_name, proxy_config):
     :param proxy_config: proxy configuration
     :return: the Table object
     """
+    from botocore.exceptions import ClientError
+
     log.debug("Getting DynamoDB table '%s'", table_name)
-    ddb_client = boto3.client("dynamodb", region_name=region, config=proxy_config)
+    ddb_client = get_boto3_client("dynamodb", region, proxy_config)
     try:
         tables = ddb_client.list_tables().get("TableNames")
         if table_name not in tables:
@@ -136,7 +206,7 @@ def _get_ddb_table(region, table_name, proxy_config):
             log.critical(error_msg)
             raise CriticalError(error_msg)
 
-        ddb_resource = boto3.resource("dynamodb", region_name=region, config=proxy_config)
+        ddb_resource = get_boto3_resource("dynamodb", region, proxy_config)
         table = ddb_resource.Table(table_name)
         log.debug("DynamoDB table found correctly.")
     except ClientError as e:
@@ -147,12 +217,7 @@ def _get_ddb_table(region, table_name, proxy_config):
 
 
 def _retry_on_request_limit_exceeded(func):
-    @retry(
-        stop_max_attempt_number=5,
-        wait_exponential_multiplier=5000,
-        retry_on_exception=lambda exception: isinstance(exception, ClientError)
-        and exception.response.get("Error").get("Code") == "RequestLimitExceeded",
-    )
+    @retry(attempts=5, base_delay=5, max_delay=40, retry_on=is_throttling_error, breaker=DYNAMODB)
     def _retry():
         return func()
 
@@ -178,7 +243,8 @@ def _retrieve_all_sqs_messages(queue):
         # setting WaitTimeSeconds in order to use Amazon SQS Long Polling.
         # when not using Long Polling with a small queue you might not receive any message
         # since only a subset of random machines is queried.
-        retrieved_messages = queue.receive_messages(MaxNumberOfMessages=max_messages_per_call, WaitTimeSeconds=2)
+        with circuit_breaker(SQS):
+            retrieved_messages = queue.receive_messages(MaxNumberOfMessages=max_messages_per_call, WaitTimeSeconds=2)
         if len(retrieved_messages) > 0:
             messages.extend(retrieved_messages)
         else:
@@ -211,7 +277,7 @@ def _parse_sqs_messages(messages, table):
             log.info("Processing EC2_INSTANCE_TERMINATE event for instance %s", instance_id)
             update_event = _process_instance_terminate_event(message_attrs, message, table)
         else:
-            log.info("Unsupported event type %s. Discarding message." % event_type)
+            log.info("Unsupported event type %s. Discarding message.", event_type)
             update_event = None
 
         if update_event:
@@ -225,6 +291,7 @@ def _parse_sqs_messages(messages, table):
             log.warning("Discarding message %s", message)
             message.delete()
 
+    log.info("Processed %d messages, %d host update events", len(messages), len(update_events))
     return update_events.values()
 
 
@@ -261,83 +328,142 @@ def _process_sqs_messages(
     if not update_events and not update_max_cluster_size:
         return
 
-    failed_events, succeeded_events = scheduler_module.update_cluster(
-        max_cluster_size, sqs_config.cluster_user, update_events
-    )
-
-    for event in list(succeeded_events):
-        try:
-            if event.action == "ADD":
-                _retry_on_request_limit_exceeded(
-                    lambda: table.put_item(Item={"instanceId": event.host.instance_id, "hostname": event.host.hostname})
-                )
-            elif event.action == "REMOVE":
-                _retry_on_request_limit_exceeded(lambda: table.delete_item(Key={"instanceId": event.host.instance_id}))
-            log.debug("Successfully processed event %s", event)
-        except Exception as e:
-            log.error(
-                "Failed when updating dynamo db table for instance %s with exception %s", event.host.instance_id, e
+    with UPDATE_CLUSTER_SECONDS.time():
+        with span("update_cluster", events=len(update_events)) as update_span:
+            # the scheduler commands run by the plugins are protected by the SCHEDULER circuit breaker
+            failed_events, succeeded_events = scheduler_module.update_cluster(
+                max_cluster_size, sqs_config.cluster_user, update_events
             )
-            failed_events.append(event)
-            succeeded_events.remove(event)
+            update_span.set_attribute("failed_events", len(failed_events))
+
+    with DYNAMODB_SECONDS.time():
+        for event in list(succeeded_events):
+            try:
+                if event.action == "ADD":
+                    _retry_on_request_limit_exceeded(
+                        lambda: table.put_item(
+                            Item={"instanceId": event.host.instance_id, "hostname": event.host.hostname}
+                        )
+                    )
+                elif event.action == "REMOVE":
+                    _retry_on_request_limit_exceeded(
+                        lambda: table.delete_item(Key={"instanceId": event.host.instance_id})
+                    )
+                log.debug("Successfully processed event %s", event)
+            except Exception as e:
+                log.error(
+                    "Failed when updating dynamo db table for instance %s with exception %s", event.host.instance_id, e
+                )
+                failed_events.append(event)
+                succeeded_events.remove(event)
 
+    FAILED_EVENTS_TOTAL.inc(len(failed_events))
     for event in failed_events:
         log.warning("Re-queuing failed event %s", event)
         _requeue_message(queue, event.message)
 
-    for event in itertools.chain(failed_events, succeeded_events):
-        log.debug("Removing event from queue: %s", event)
-        event.message.delete()
+    with DELETE_SECONDS.time():
+        for event in itertools.chain(failed_events, succeeded_events):
+            log.debug("Removing event from queue: %s", event)
+            event.message.delete()
 
 
-def _retrieve_max_cluster_size(sqs_config, asg_name, fallback):
+def _retrieve_max_cluster_size(asg_settings, fallback):
     try:
-        _, _, max_size = get_asg_settings(sqs_config.region, sqs_config.proxy_config, asg_name, log)
+        _, _, max_size = asg_settings.get()
         return max_size
     except Exception:
         return fallback
 
 
-def _poll_queue(sqs_config, queue, table, asg_name):
+def _poll_queue(sqs_config, queue, table, asg_name, startup_timer=None, config_reloader=None, warm_state=None):
     """
     Poll SQS queue.
 
     :param sqs_config: SQS daemon configuration
     :param queue: SQS Queue object connected to the cluster queue
     :param table: DB table resource object
+    :param asg_name: ASG name
+    :param startup_timer: StartupTimer object to complete at the end of the first iteration
+    :param config_reloader: ConfigReloader object applying the requested config reloads between iterations
+    :param warm_state: WarmState object the ASG name comes from
     """
     scheduler_module = load_module("sqswatcher.plugins." + sqs_config.scheduler)
+    asg_settings = get_asg_settings_cache(
+        sqs_config.region, sqs_config.proxy_config, asg_name, log, sqs_config.asg_settings_ttl
+    )
+
+    health = get_health_monitor("sqswatcher", 30, sqs_config.watchdog_max_lag)
 
     max_cluster_size = sqs_config.max_queue_size
     while True:
-        new_max_cluster_size = _retrieve_max_cluster_size(sqs_config, asg_name, max_cluster_size)
-        messages = _retrieve_all_sqs_messages(queue)
-        update_events = _parse_sqs_messages(messages, table)
-        _process_sqs_messages(
-            update_events,
-            scheduler_module,
-            sqs_config,
-            table,
-            queue,
-            new_max_cluster_size,
-            new_max_cluster_size != max_cluster_size,
-        )
-        max_cluster_size = new_max_cluster_size
-        time.sleep(30)
-
-
-@retry(wait_fixed=30000)
+        if config_reloader:
+            new_config = config_reloader.reload(sqs_config)
+            if new_config is not sqs_config:
+                if new_config.max_queue_size != sqs_config.max_queue_size:
+                    max_cluster_size = new_config.max_queue_size
+                sqs_config = new_config
+                asg_settings = get_asg_settings_cache(
+                    sqs_config.region, sqs_config.proxy_config, asg_name, log, sqs_config.asg_settings_ttl
+                )
+                health.set_watchdog(sqs_config.watchdog_max_lag)
+        if warm_state:
+            warm_state.check()
+        health.start_iteration()
+        with root_span("sqswatcher iteration") as iteration_span:
+            new_max_cluster_size = _retrieve_max_cluster_size(asg_settings, max_cluster_size)
+            health.set_phase("receive")
+            with RECEIVE_SECONDS.time():
+                messages = _retrieve_all_sqs_messages(queue)
+            MESSAGES_TOTAL.inc(len(messages))
+            health.set_phase("parse")
+            with PARSE_SECONDS.time():
+                update_events = _parse_sqs_messages(messages, table)
+            iteration_span.set_attribute("messages", len(messages))
+            iteration_span.set_attribute("events", len(update_events))
+            health.set_phase("update_cluster")
+            _process_sqs_messages(
+                update_events,
+                scheduler_module,
+                sqs_config,
+                table,
+                queue,
+                new_max_cluster_size,
+                new_max_cluster_size != max_cluster_size,
+            )
+            max_cluster_size = new_max_cluster_size
+        asg_settings.log_stats()
+        get_command_executor().log_stats(log)
+        end_log_cycle(log)
+        diagnostics_checkpoint()
+        publish_metrics()
+        if startup_timer:
+            startup_timer.complete("first_iteration")
+        health.end_iteration(30)
+        clock.sleep(30)
+
+
+@retry(base_delay=30, max_delay=120)
 def main():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(module)s:%(funcName)s] %(message)s")
     log.info("sqswatcher startup")
+    install_diagnostics_handlers("sqswatcher")
+    install_reload_handler()
 
+    startup_timer = StartupTimer("sqswatcher", log)
     try:
         config = _get_config()
+        startup_timer.mark("config")
         queue = _get_sqs_queue(config.region, config.sqsqueue, config.proxy_config)
         table = _get_ddb_table(config.region, config.table_name, config.proxy_config)
-        asg_name = get_asg_name(config.stack_name, config.region, config.proxy_config, log)
+        warm_state = WarmState("sqswatcher", {"region": config.region, "stack_name": config.stack_name})
+        asg_name = warm_state.discover(
+            "asg_name", lambda: get_asg_name(config.stack_name, config.region, config.proxy_config, log)
+        )
+        startup_timer.mark("aws_discovery")
 
-        _poll_queue(config, queue, table, asg_name)
+        config_reloader = get_config_reloader("sqswatcher", CONFIG_FILE, _get_config, LIVE_OPTIONS)
+        _poll_queue(config, queue, table, asg_name, startup_timer, config_reloader, warm_state)
     except Exception as e:
         log.critical("An unexpected error occurred: %s", e)
         raise
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Benchmark of the jobwatcher get_optimal_nodes: linear scan of the allocated nodes vs free slots index.
+
+Usage: python tests/bench_optimal_nodes.py [jobs ...]
+The linear scan is quadratic, it is skipped for more than LINEAR_SCAN_MAX_JOBS jobs unless the environment
+variable BENCH_LINEAR_SCAN is set.
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jobwatcher", "plugins"))
+
+from utils import get_optimal_nodes  # noqa: E402
+
+INSTANCE_PROPERTIES = {"slots": 36}
+LINEAR_SCAN_MAX_JOBS = 20000
+
+
+def _linear_scan(nodes_requested, slots_requested, instance_properties):
+    vcpus = instance_properties.get("slots")
+    slots_remaining_per_node = []
+    for num_of_nodes, slots in zip(nodes_requested, slots_requested):
+        slots_required_per_node = -(-slots // num_of_nodes)
+        if slots_required_per_node > vcpus:
+            num_of_nodes = -(-slots // vcpus)
+            slots_required_per_node = -(-slots // num_of_nodes)
+        for slot_idx, slots_available in enumerate(slots_remaining_per_node):
+            if num_of_nodes > 0 and slots_available >= slots_required_per_node:
+                slots_remaining_per_node[slot_idx] -= slots_required_per_node
+                num_of_nodes -= 1
+        for _ in range(num_of_nodes):
+            slots_remaining_per_node.append(vcpus - slots_required_per_node)
+    return len(slots_remaining_per_node)
+
+
+def _generate_jobs(jobs, seed=0):
+    """Job arrays of single node tasks mixed with multi node jobs, in submission order."""
+    rng = random.Random(seed)
+    nodes_requested = []
+    slots_requested = []
+    while len(nodes_requested) < jobs:
+        if rng.random() < 0.8:
+            tasks = min(rng.choice([10, 100, 1000]), jobs - len(nodes_requested))
+            slots = rng.choice([1, 2, 4, 8, 16])
+            nodes_requested.extend([1] * tasks)
+            slots_requested.extend([slots] * tasks)
+        else:
+            nodes = rng.randint(2, 8)
+            nodes_requested.append(nodes)
+            slots_requested.append(nodes * rng.randint(1, 36))
+    return nodes_requested, slots_requested
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1000, 10000, 100000]
+    print("{0:>8} {1:>14} {2:>12} {3:>8}".format("jobs", "method", "time (ms)", "nodes"))
+    for jobs in sizes:
+        nodes_requested, slots_requested = _generate_jobs(jobs)
+        methods = [("index", get_optimal_nodes)]
+        if jobs <= LINEAR_SCAN_MAX_JOBS or os.environ.get("BENCH_LINEAR_SCAN"):
+            methods.insert(0, ("linear scan", _linear_scan))
+        for name, function in methods:
+            start = time.time()
+            nodes = function(nodes_requested, slots_requested, INSTANCE_PROPERTIES)
+            elapsed = time.time() - start
+            print("{0:>8} {1:>14} {2:>12.1f} {3:>8}".format(jobs, name, elapsed * 1000, nodes))
+
+
+if __name__ == "__main__":
+    main()
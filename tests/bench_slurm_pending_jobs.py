@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Benchmark of the Slurm get_required_nodes: whole squeue output vs streaming placement.
+
+Usage: python tests/bench_slurm_pending_jobs.py [jobs ...]
+Every measure runs in a forked process, memory is the peak RSS growth of that process.
+"""
+
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jobwatcher", "plugins"))
+
+import slurm  # noqa: E402
+from common.slurm import PENDING_RESOURCES_REASONS  # noqa: E402
+from common.utils import check_command_output, command_output_lines  # noqa: E402
+from utils import get_optimal_nodes  # noqa: E402
+
+log = logging.getLogger(__name__)
+
+INSTANCE_PROPERTIES = {"slots": 36}
+
+
+def _write_squeue_output(jobs, seed=0):
+    """Job arrays of single node tasks mixed with multi node jobs, some running or pending for other reasons."""
+    rng = random.Random(seed)
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    with os.fdopen(fd, "w") as f:
+        job_id = 0
+        while job_id < jobs:
+            if rng.random() < 0.8:
+                tasks = min(rng.choice([10, 100, 1000]), jobs - job_id)
+                nodes, slots = 1, rng.choice([1, 2, 4, 8, 16])
+            else:
+                tasks = 1
+                nodes = rng.randint(2, 8)
+                slots = nodes * rng.randint(1, 36)
+            state, reason = rng.choice([("PD", PENDING_RESOURCES_REASONS[0]), ("PD", "Licenses"), ("R", "")])
+            for _ in range(tasks):
+                f.write("{0}|{1}|{2}|{3}|{4}|0|OK|N/A\n".format(job_id, state, nodes, slots, reason))
+                job_id += 1
+    return path
+
+
+def _whole_output(path):
+    output = check_command_output(["cat", path], log)
+    nodes_requested = []
+    slots_requested = []
+    for line in output.split("\n"):
+        line_arr = line.split("|")
+        if len(line_arr) == 8 and line_arr[1] == "PD" and line_arr[4] in PENDING_RESOURCES_REASONS:
+            nodes_requested.append(int(line_arr[2]))
+            slots_requested.append(int(line_arr[3]))
+    return get_optimal_nodes(nodes_requested, slots_requested, INSTANCE_PROPERTIES)
+
+
+def _streaming(path):
+    slurm.command_output_lines = lambda command, log: command_output_lines(["cat", path], log)
+    return slurm.get_required_nodes(INSTANCE_PROPERTIES)
+
+
+def _measure(function, path):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        nodes = function(path)
+        elapsed = time.time() - start
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        os.write(write_fd, "{0} {1} {2}".format(nodes, elapsed, rss_growth).encode())
+        os._exit(0)
+
+    os.close(write_fd)
+    result = os.read(read_fd, 1024).decode().split()
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return int(result[0]), float(result[1]), int(result[2])
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 200000, 1000000]
+    print("{0:>8} {1:>10} {2:>12} {3:>12} {4:>12} {5:>8}".format(
+        "jobs", "out (KB)", "method", "time (ms)", "peak (KB)", "nodes"))
+    for jobs in sizes:
+        path = _write_squeue_output(jobs)
+        try:
+            size_kb = os.path.getsize(path) // 1024
+            for name, function in [("whole", _whole_output), ("streaming", _streaming)]:
+                nodes, elapsed, rss_growth = _measure(function, path)
+                print("{0:>8} {1:>10} {2:>12} {3:>12.1f} {4:>12} {5:>8}".format(
+                    jobs, size_kb, name, elapsed * 1000, rss_growth, nodes))
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Benchmark of the Torque get_busy_nodes parsing: whole document vs streaming parse.
+
+Usage: python tests/bench_torque_busy_nodes.py [nodes ...]
+Every measure runs in a forked process, memory is the peak RSS growth of that process.
+"""
+
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.utils import check_command_output, command_output_stream  # noqa: E402
+from jobwatcher.plugins.torque import _count_busy_nodes  # noqa: E402
+
+log = logging.getLogger(__name__)
+
+NODE_TEMPLATE = (
+    "<Node><name>ip-10-0-{0}-{1}</name><state>{2}</state><power_state>Running</power_state><np>16</np>"
+    "<ntype>cluster</ntype>{3}<status>rectime=1527799181,macaddr=02:e4:00:b0:b1:72,cpuclock=Fixed,varattr=,"
+    "jobs={4},state={2},netload=210647044,gres=,loadave=0.00,ncpus=16,physmem=65017208kb,availmem=63753728kb,"
+    "totmem=65017208kb,idletime=856,nusers=1,nsessions=1,sessions=19698,"
+    "uname=Linux ip-10-0-{0}-{1} 4.14.104-95.84.amzn2.x86_64 #1 SMP Sat Mar 2 00:40:20 UTC 2019 x86_64,"
+    "opsys=linux</status><mom_service_port>15002</mom_service_port><mom_manager_port>15003</mom_manager_port>"
+    "</Node>"
+)
+
+
+def _write_pbsnodes_output(nodes):
+    fd, path = tempfile.mkstemp(suffix=".xml")
+    with os.fdopen(fd, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><Data>')
+        for i in range(nodes):
+            if i % 2:
+                jobs = ",".join("{0}/{1}.master".format(slot, i) for slot in range(8))
+                f.write(NODE_TEMPLATE.format(i // 256, i % 256, "job-exclusive", "<jobs>" + jobs + "</jobs>", jobs))
+            else:
+                f.write(NODE_TEMPLATE.format(i // 256, i % 256, "free", "", ""))
+        f.write("</Data>")
+    return path
+
+
+def _fromstring(path):
+    root = ElementTree.fromstring(check_command_output(["cat", path], log))
+    return len([node for node in root.findall("Node") if len(node.findall("jobs")) != 0])
+
+
+def _iterparse(path):
+    with command_output_stream(["cat", path], log) as output:
+        return _count_busy_nodes(output)[0]
+
+
+def _measure(function, path):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        busy = function(path)
+        elapsed = time.time() - start
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        os.write(write_fd, "{0} {1} {2}".format(busy, elapsed, rss_growth).encode())
+        os._exit(0)
+
+    os.close(write_fd)
+    result = os.read(read_fd, 1024).decode().split()
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return int(result[0]), float(result[1]), int(result[2])
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1000, 5000, 20000]
+    print("{0:>8} {1:>10} {2:>10} {3:>12} {4:>12} {5:>8}".format(
+        "nodes", "xml (KB)", "method", "time (ms)", "peak (KB)", "busy"))
+    for nodes in sizes:
+        path = _write_pbsnodes_output(nodes)
+        try:
+            size_kb = os.path.getsize(path) // 1024
+            for name, function in [("fromstring", _fromstring), ("iterparse", _iterparse)]:
+                busy, elapsed, rss_growth = _measure(function, path)
+                print("{0:>8} {1:>10} {2:>10} {3:>12.1f} {4:>12} {5:>8}".format(
+                    nodes, size_kb, name, elapsed * 1000, rss_growth, busy))
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,3 +6,5 @@ echo $PATH
 which nodewatcher
 which sqswatcher
 which jobwatcher 
+which masterwatcher
+which watcherstatus
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Demand history ring buffer and forecast policy.
+
+Usage: python tests/test_forecast.py
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.forecast import DAY, SAMPLE_INTERVAL, DemandHistory, ForecastPolicy  # noqa
+
+HOUR = 3600
+# midnight UTC
+START_TIME = 1560124800
+
+
+class TestDemandHistory(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, "demand_history.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_ring_buffer(self):
+        history = DemandHistory(self.path, capacity=10)
+        for i in range(25):
+            self.assertTrue(history.add(START_TIME + i * SAMPLE_INTERVAL, i, 1, 2))
+            # merged with the previous sample, the max demand is kept
+            self.assertFalse(history.add(START_TIME + i * SAMPLE_INTERVAL + 10, 0, 0, 0))
+        self.assertEqual(len(history), 10)
+        self.assertEqual([sample[1] for sample in history.samples()], list(range(15, 25)))
+        history.save()
+
+        loaded = DemandHistory(self.path, capacity=10)
+        self.assertEqual(list(loaded.samples()), list(history.samples()))
+        # saved with a different capacity
+        self.assertEqual(len(DemandHistory(self.path, capacity=20)), 0)
+
+    def test_daily_forecast(self):
+        policy = ForecastPolicy(DemandHistory(None), lead_time=HOUR, max_nodes=15)
+        # 3 days with 20 nodes used from 8:00 to 18:00, 30 the last day
+        for day in range(3):
+            for sample_time in range(0, DAY, SAMPLE_INTERVAL):
+                busy = 8 * HOUR <= sample_time < 18 * HOUR
+                demand = (30 if day == 2 else 20) if busy else 0
+                policy.record(START_TIME + day * DAY + sample_time, 0, demand, demand)
+
+        today = START_TIME + 3 * DAY
+        self.assertEqual(policy.forecast(today + 6 * HOUR), 0)
+        # the most recent day weighs more
+        self.assertEqual(policy.forecast(today + 7 * HOUR + 30 * 60), 25)
+        self.assertEqual(policy.get_required_nodes(today + 7 * HOUR + 30 * 60, 0), 15)
+        self.assertEqual(policy.get_required_nodes(today + 7 * HOUR + 30 * 60, 20), 25)
+        self.assertEqual(policy.get_required_nodes(today + 7 * HOUR + 30 * 60, 40), 40)
+        self.assertEqual(policy.get_required_nodes(today + 19 * HOUR, 2), 2)
+        self.assertEqual(ForecastPolicy(DemandHistory(None), HOUR, 10).forecast(today), None)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Instance catalog conversion, lookup and conditional download.
+
+Usage: python tests/test_instance_catalog.py
+"""
+
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import common.instance_catalog as instance_catalog  # noqa
+from botocore.exceptions import ClientError, EndpointConnectionError  # noqa
+
+INSTANCES = {
+    "c5.xlarge": {"vcpus": "4", "memory": "8", "gpu": 0},
+    "c5.18xlarge": {"vcpus": "72", "memory": "144"},
+    "p3.8xlarge": {"vcpus": "32", "memory": "244", "gpu": "4"},
+    "t2.micro": {"vcpus": "1", "memory": "1"},
+    "x1.32xlarge": {"vcpus": "N/A", "memory": "1952"},
+}
+
+
+class FakeS3Client(object):
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = []
+
+    def get_object(self, **kwargs):
+        self.requests.append(kwargs)
+        if self.error:
+            raise self.error
+        if kwargs.get("IfNoneMatch") == '"etag-1"':
+            raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject")
+        return {"Body": io.BytesIO(json.dumps(INSTANCES).encode()), "ETag": '"etag-1"', "LastModified": None}
+
+
+class TestInstanceCatalog(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, "instances.tsv")
+        self.get_boto3_client = instance_catalog.get_boto3_client
+
+    def tearDown(self):
+        instance_catalog.get_boto3_client = self.get_boto3_client
+        shutil.rmtree(self.data_dir)
+
+    def _update(self, s3_client):
+        instance_catalog.get_boto3_client = lambda *args: s3_client
+        return instance_catalog.update_instance_catalog(self.path, "us-east-1", None)
+
+    def test_lookup(self):
+        instances = {}
+        for i in range(1000):
+            instances["m{0}.large".format(i)] = {"vcpus": str(i + 1), "memory": "8"}
+        instance_catalog.write_instance_catalog(self.path, instances, '"etag"', "2019-06-10T09:00:00+00:00")
+        catalog = instance_catalog.InstanceCatalog(self.path)
+        for instance_type, properties in instances.items():
+            self.assertEqual(catalog.get(instance_type)["vcpus"], int(properties["vcpus"]))
+        for instance_type in ["a", "m0", "m1.large0", "m999.larg", "z"]:
+            self.assertEqual(catalog.get(instance_type), None)
+        self.assertEqual(catalog.get_metadata(), ('"etag"', "2019-06-10T09:00:00+00:00"))
+
+    def test_conditional_download(self):
+        s3_client = FakeS3Client()
+        catalog = self._update(s3_client)
+        self.assertEqual(catalog.get("p3.8xlarge"), {"vcpus": 32, "memory": 244.0, "gpus": 4})
+        self.assertEqual(catalog.get("x1.32xlarge")["vcpus"], 0)
+        self.assertFalse("IfNoneMatch" in s3_client.requests[0])
+
+        # not modified
+        catalog = self._update(s3_client)
+        self.assertEqual(s3_client.requests[1]["IfNoneMatch"], '"etag-1"')
+        self.assertEqual(catalog.get("c5.xlarge"), {"vcpus": 4, "memory": 8.0, "gpus": 0})
+
+    def test_fallback(self):
+        error = EndpointConnectionError(endpoint_url="https://s3.amazonaws.com")
+        self.assertRaises(EndpointConnectionError, self._update, FakeS3Client(error))
+
+        self._update(FakeS3Client())
+        catalog = self._update(FakeS3Client(error))
+        self.assertEqual(catalog.get("t2.micro")["vcpus"], 1)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    unittest.main()
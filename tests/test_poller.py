@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Adaptive polling period and trigger file.
+
+Usage: python tests/test_poller.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import clock  # noqa
+from common.poller import AdaptivePoller  # noqa
+
+
+class TouchingClock(clock.VirtualClock):
+    """Virtual clock touching a file at the given time."""
+
+    def __init__(self, path, touch_time):
+        super(TouchingClock, self).__init__(0)
+        self.path = path
+        self.touch_time = touch_time
+
+    def sleep(self, seconds):
+        super(TouchingClock, self).sleep(seconds)
+        if self.touch_time is not None and self.time() >= self.touch_time:
+            with open(self.path, "w") as trigger_file:
+                trigger_file.write("")
+            os.utime(self.path, (self.time(), self.time()))
+            self.touch_time = None
+
+
+class TestAdaptivePoller(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.trigger_file = os.path.join(self.data_dir, "trigger")
+        self.previous_clock = clock.get_clock()
+
+    def tearDown(self):
+        clock.set_clock(self.previous_clock)
+        shutil.rmtree(self.data_dir)
+
+    def test_backoff(self):
+        poller = AdaptivePoller(5, 60)
+        intervals = [poller.update(value) for value in [0, 3, 3, 3, 3, 3, 3, 4, 4]]
+        self.assertEqual(intervals, [5, 5, 10, 20, 40, 60, 60, 5, 10])
+
+    def test_wait(self):
+        clock.set_clock(clock.VirtualClock(0))
+        self.assertFalse(AdaptivePoller(5, 60).wait(60))
+        self.assertEqual(clock.now(), 60)
+        self.assertFalse(AdaptivePoller(5, 60, self.trigger_file).wait(30))
+        self.assertEqual(clock.now(), 90)
+
+    def test_trigger(self):
+        clock.set_clock(TouchingClock(self.trigger_file, 20))
+        poller = AdaptivePoller(5, 60, self.trigger_file)
+        for value in [1, 1, 1, 1, 1]:
+            poller.update(value)
+        self.assertEqual(poller.interval, 60)
+        self.assertTrue(poller.wait())
+        self.assertEqual(clock.now(), 20)
+        self.assertEqual(poller.interval, 5)
+        self.assertFalse(poller.wait(30))
+        self.assertEqual(clock.now(), 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
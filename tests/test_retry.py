@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Retry backoff and circuit breakers.
+
+Usage: python tests/test_retry.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.health import WatchdogTimeout  # noqa
+from common.retry import CircuitBreaker, CircuitOpenError, decorrelated_jitter, get_circuit_breaker, retry  # noqa
+
+
+class TestRetry(unittest.TestCase):
+    def test_jitter_bounds(self):
+        delay = 1
+        for _ in range(100):
+            next_delay = decorrelated_jitter(1, 20, delay)
+            self.assertTrue(1 <= next_delay <= min(20, delay * 3))
+            delay = next_delay
+
+    def test_retry_attempts(self):
+        calls = []
+
+        @retry(attempts=3, base_delay=0, max_delay=0)
+        def _fail():
+            calls.append(1)
+            raise IOError("failure")
+
+        self.assertRaises(IOError, _fail)
+        self.assertEqual(len(calls), 3)
+
+    def test_retry_on(self):
+        calls = []
+
+        @retry(attempts=3, base_delay=0, max_delay=0, retry_on=lambda exception: isinstance(exception, IOError))
+        def _fail():
+            calls.append(1)
+            raise ValueError("not retried")
+
+        self.assertRaises(ValueError, _fail)
+        self.assertEqual(len(calls), 1)
+
+    def test_breaker_fails_fast(self):
+        calls = []
+
+        @retry(attempts=10, base_delay=0, max_delay=0, breaker="test_fail_fast")
+        def _fail():
+            calls.append(1)
+            raise IOError("failure")
+
+        get_circuit_breaker("test_fail_fast").failure_threshold = 3
+        self.assertRaises(CircuitOpenError, _fail)
+        self.assertEqual(len(calls), 3)
+        self.assertRaises(CircuitOpenError, _fail)
+        self.assertEqual(len(calls), 3)
+
+    def test_retry_forever_on_open_breaker(self):
+        calls = []
+
+        @retry(base_delay=0, max_delay=0)
+        def _main():
+            calls.append(1)
+            if len(calls) < 3:
+                raise CircuitOpenError("open")
+            return "done"
+
+        self.assertEqual(_main(), "done")
+        self.assertEqual(len(calls), 3)
+
+    def test_watchdog_timeout(self):
+        calls = []
+
+        @retry(attempts=3, base_delay=0, max_delay=0)
+        def _loop_step():
+            calls.append(1)
+            if len(calls) == 1:
+                raise WatchdogTimeout()
+
+        @retry(base_delay=0, max_delay=0)
+        def _main():
+            try:
+                _loop_step()
+            except Exception:
+                pass
+            return len(calls)
+
+        # neither the bounded retry nor the loop error handler stop it, the main retry restarts the loop
+        self.assertEqual(_main(), 2)
+
+    def test_breaker_trial_call(self):
+        breaker = CircuitBreaker("test_trial", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        # a single trial call is let through after the reset timeout
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertTrue(breaker.allow_request())
+        self.assertTrue(breaker.allow_request())
+
+    def test_breaker_ignored_exception(self):
+        breaker = CircuitBreaker("test_ignored", failure_threshold=2, reset_timeout=0)
+        breaker.record_failure()
+
+        def _call(exception):
+            with breaker.guard(lambda e: isinstance(e, IOError)):
+                raise exception
+
+        # an exception that is not a failure does not reset the failure count
+        self.assertRaises(ValueError, _call, ValueError("not a failure"))
+        self.assertRaises(IOError, _call, IOError("failure"))
+        # nor closes an open breaker, it only releases the trial call
+        self.assertRaises(ValueError, _call, ValueError("not a failure"))
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+
+    def test_breaker_interrupted_trial_call(self):
+        breaker = CircuitBreaker("test_interrupted", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        def _call():
+            with breaker.guard():
+                raise KeyboardInterrupt()
+
+        self.assertRaises(KeyboardInterrupt, _call)
+        self.assertTrue(breaker.allow_request())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Simulation of the daemon loops on a virtual clock.
+
+Usage: python tests/test_simulation.py
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import nodewatcher.nodewatcher as nodewatcher  # noqa
+from common import clock  # noqa
+from common.state import WarmState  # noqa
+from common.timing import StartupTimer  # noqa
+
+HOUR = 3600
+
+
+class InstanceTerminated(Exception):
+    pass
+
+
+class FakeScheduler(object):
+    """Scheduler running jobs on the node in the given time windows, relative to the simulation start."""
+
+    def __init__(self, start_time, busy_windows):
+        self.start_time = start_time
+        self.busy_windows = busy_windows
+
+    def hasJobs(self, hostname):
+        elapsed = clock.now() - self.start_time
+        return any(start <= elapsed < end for start, end in self.busy_windows)
+
+    def hasPendingJobs(self):
+        return False, False
+
+    def lockHost(self, hostname, unlock=False):
+        pass
+
+
+class TestNodewatcherSimulation(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.previous_clock = clock.set_clock(clock.VirtualClock(1500000000))
+        self.patched = {}
+        for name, value in [
+            ("IDLETIME_FILE", os.path.join(self.data_dir, "node_idletime.json")),
+            ("DATA_DIR", self.data_dir + "/"),
+            ("get_boto3_client", lambda *args: None),
+            ("_maintain_size", lambda asg_settings: False),
+            ("_self_terminate", self._self_terminate),
+        ]:
+            self.patched[name] = getattr(nodewatcher, name)
+            setattr(nodewatcher, name, value)
+
+    def tearDown(self):
+        for name, value in self.patched.items():
+            setattr(nodewatcher, name, value)
+        clock.set_clock(self.previous_clock)
+        shutil.rmtree(self.data_dir)
+
+    def _self_terminate(self, asg_settings, asg_client, instance_id):
+        raise InstanceTerminated()
+
+    def _simulate(self, busy_windows, scaledown_idletime, startup_timer=None):
+        config = nodewatcher.NodewatcherConfig("us-east-1", "slurm", "stack", scaledown_idletime, None, 300, 0)
+        warm_state = WarmState("nodewatcher", {}, self.data_dir)
+        warm_state.set("stack_ready", True)
+        start_time = clock.now()
+        scheduler = FakeScheduler(start_time, busy_windows)
+        try:
+            nodewatcher._poll_instance_status(
+                config, scheduler, "asg", "host", "i-12345", startup_timer=startup_timer, warm_state=warm_state
+            )
+        except InstanceTerminated:
+            return clock.now() - start_time
+
+    def test_day_of_jobs(self):
+        # jobs every few hours for a whole day, the node is idle for at most one hour in between
+        busy_windows = [(0, 2 * HOUR), (3 * HOUR, 7 * HOUR), (7.5 * HOUR, 12 * HOUR), (13 * HOUR, 24 * HOUR)]
+        real_start = time.time()
+        terminated_after = self._simulate(busy_windows, scaledown_idletime=90)
+        # idle time is counted from the last check finding jobs
+        self.assertTrue(24 * HOUR + 89 * 60 <= terminated_after <= 24 * HOUR + 92 * 60, terminated_after)
+        self.assertTrue(time.time() - real_start < 30)
+
+    def test_idle_node(self):
+        terminated_after = self._simulate([(0, HOUR)], scaledown_idletime=10)
+        self.assertTrue(HOUR + 9 * 60 <= terminated_after <= HOUR + 11 * 60, terminated_after)
+
+    def test_clock_jump(self):
+        # the system clock is stepped forward by a day while the node is idle
+        self.patched["_has_jobs"] = nodewatcher._has_jobs
+
+        def _has_jobs(scheduler_module, hostname):
+            if clock.now() - start_time == 5 * 60:
+                clock.get_clock().advance(24 * HOUR)
+            return False
+
+        start_time = clock.now()
+        nodewatcher._has_jobs = _has_jobs
+        terminated_after = self._simulate([], scaledown_idletime=10) - 24 * HOUR
+        self.assertTrue(9 * 60 <= terminated_after <= 11 * 60, terminated_after)
+
+    def test_warm_restart_startup_time(self):
+        # the stack is known to be ready, the first iteration queries the scheduler
+        startup_timer = StartupTimer("nodewatcher", logging.getLogger(__name__))
+        self._simulate([(0, HOUR)], scaledown_idletime=10, startup_timer=startup_timer)
+        phases = [name for name, _ in startup_timer.get_phases()]
+        self.assertEqual(["initial_wait", "first_iteration"], [name for name in phases if name != "import"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.CRITICAL)
+    unittest.main()
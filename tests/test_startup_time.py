@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file.
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Cold import time of the daemons.
+
+Usage: python tests/test_startup_time.py
+The budget, in seconds, can be changed with the STARTUP_IMPORT_BUDGET environment variable.
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+DAEMONS = ["jobwatcher.jobwatcher", "nodewatcher.nodewatcher", "sqswatcher.sqswatcher", "masterwatcher.masterwatcher"]
+PLUGINS = [
+    "{0}.plugins.{1}".format(daemon, scheduler)
+    for daemon in ["jobwatcher", "nodewatcher", "sqswatcher"]
+    for scheduler in ["sge", "slurm", "torque"]
+]
+# modules to be imported only when used
+HEAVY_MODULES = ["boto3", "botocore", "paramiko", "cryptography"]
+
+# number of runs per module, the best one is compared with the budget
+RUNS = 3
+
+IMPORT_SCRIPT = """
+import sys, time
+start_time = time.time()
+for module in sys.argv[1:]:
+    __import__(module)
+print(time.time() - start_time)
+print(",".join(sorted(set(name.split(".")[0] for name in sys.modules if sys.modules[name] is not None))))
+"""
+
+
+def _cold_import(modules):
+    process = subprocess.Popen(
+        [sys.executable, "-W", "ignore", "-c", IMPORT_SCRIPT] + modules, cwd=ROOT_DIR, stdout=subprocess.PIPE
+    )
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        raise Exception("Import of {0} failed".format(", ".join(modules)))
+    duration, loaded_modules = output.decode("utf-8").splitlines()
+    return float(duration), loaded_modules.split(",")
+
+
+class StartupTimeTest(unittest.TestCase):
+    def setUp(self):
+        self.budget = float(os.environ.get("STARTUP_IMPORT_BUDGET", "0.5"))
+
+    def test_daemons_import_budget(self):
+        for daemon in DAEMONS:
+            duration = min(_cold_import([daemon])[0] for _ in range(RUNS))
+            self.assertTrue(
+                duration <= self.budget,
+                "Import of {0} took {1:.3f}s, budget is {2:.3f}s".format(daemon, duration, self.budget),
+            )
+
+    def test_no_heavy_modules_at_import(self):
+        _, loaded_modules = _cold_import(DAEMONS + PLUGINS)
+        for module in HEAVY_MODULES:
+            self.assertFalse(module in loaded_modules, "{0} imported at startup".format(module))
+
+
+if __name__ == "__main__":
+    unittest.main()